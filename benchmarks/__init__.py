@@ -0,0 +1,10 @@
+"""
+benchmarks
+~~~~~~~~~~
+
+Benchmarks for the query and cache layers, run against synthetic fleets
+served by a stub connection. See `python -m benchmarks.run --help`.
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
@@ -0,0 +1,150 @@
+"""
+benchmarks.fleet
+~~~~~~~~~~~~~~~~
+
+Synthetic fleets of instances, security groups and VPCs, and a stub
+connection serving them like EC2 would.
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import random
+import time
+
+from boto.ec2.instance import Instance, InstanceState
+from boto.ec2.securitygroup import SecurityGroup
+from boto.vpc.vpc import VPC
+
+STATES = (
+    InstanceState(16, 'running'),
+    InstanceState(16, 'running'),
+    InstanceState(16, 'running'),
+    InstanceState(80, 'stopped'),
+    InstanceState(48, 'terminated'),
+)
+ROLES = ('web', 'api', 'worker', 'db', 'cache', 'search', 'queue', 'batch')
+ENVIRONMENTS = ('production', 'staging', 'development')
+TYPES = ('t1.micro', 'm3.medium', 'm3.large', 'c3.xlarge', 'r3.2xlarge')
+ZONES = ('us-east-1a', 'us-east-1b', 'us-east-1c', 'us-east-1d')
+
+
+class Reservation(object):
+    def __init__(self, id, instances):
+        self.id = id
+        self.instances = instances
+
+
+class Page(list):
+    "A page of reservations, with the token for the next one"
+    next_token = None
+
+
+class Fleet(object):
+    """
+    Deterministic synthetic inventory of `size` instances, spread over
+    one VPC per 1000 instances and 10 security groups per VPC.
+
+    Instances are named like `production-web-00042`, with Environment and
+    Role tags, and about one in ten has an extra Owner tag, so tag lookups
+    see both hits and misses.
+    """
+
+    def __init__(self, size, seed=0):
+        rand = random.Random(seed)
+        self.size = size
+        self.vpcs = []
+        for n in xrange(max(1, size // 1000)):
+            vpc = VPC()
+            vpc.id = 'vpc-%08x' % n
+            vpc.cidr_block = '10.%d.%d.0/16' % (n // 256, n % 256)
+            vpc.state = 'available'
+            vpc.is_default = n == 0
+            vpc.instance_tenancy = 'default'
+            vpc.dhcp_options_id = 'dopt-%08x' % (n % 4)
+            vpc.tags = {'Name': 'vpc-%d' % n}
+            self.vpcs.append(vpc)
+
+        self.security_groups = []
+        for n in xrange(len(self.vpcs) * 10):
+            group = SecurityGroup()
+            group.id = 'sg-%08x' % n
+            group.name = '%s-%s-%d' % (ENVIRONMENTS[n % 3], ROLES[n % len(ROLES)], n)
+            group.description = 'Group %d' % n
+            group.vpc_id = self.vpcs[n // 10].id
+            group.owner_id = '123456789012'
+            self.security_groups.append(group)
+
+        self.instances = []
+        for n in xrange(size):
+            role = ROLES[rand.randrange(len(ROLES))]
+            environment = ENVIRONMENTS[rand.randrange(len(ENVIRONMENTS))]
+            vpc = self.vpcs[n % len(self.vpcs)]
+            i = Instance()
+            i.id = 'i-%08x' % n
+            i._state = STATES[rand.randrange(len(STATES))]
+            i.instance_type = TYPES[rand.randrange(len(TYPES))]
+            i._placement.zone = ZONES[n % len(ZONES)]
+            i.image_id = 'ami-%04x' % rand.randrange(32)
+            i.vpc_id = vpc.id
+            i.subnet_id = 'subnet-%08x' % (n % 64)
+            i.key_name = environment
+            i.private_ip_address = '10.%d.%d.%d' % (n // 65536 % 256, n // 256 % 256, n % 256)
+            i.ip_address = rand.random() < 0.3 and '54.%d.%d.%d' % (n // 65536 % 256, n // 256 % 256, n % 256) or None
+            i.launch_time = '2014-%02d-%02dT%02d:00:00.000Z' % (1 + n % 12, 1 + n % 28, n % 24)
+            i.tags = {
+                'Name': '%s-%s-%05d' % (environment, role, n),
+                'Environment': environment,
+                'Role': role,
+            }
+            if rand.random() < 0.1:
+                i.tags['Owner'] = 'team-%d' % rand.randrange(20)
+            self.instances.append(i)
+        self.reservations = [
+            Reservation('r-%08x' % (n // 2), self.instances[n:n + 2])
+            for n in xrange(0, size, 2)
+        ]
+
+
+class StubConnection(object):
+    """
+    Serves a Fleet like an EC2 connection, after sleeping `latency`
+    seconds per call to stand in for the network. API filters are
+    ignored, which is allowed, since managers check every filter in
+    Python anyway.
+    """
+
+    def __init__(self, fleet, latency=0):
+        self.fleet = fleet
+        self.latency = latency
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_instances(self, filters=None):
+        self._call()
+        return self.fleet.reservations
+
+    def get_all_reservations(self, filters=None, max_results=None, next_token=None):
+        self._call()
+        start = int(next_token or 0)
+        reservations = self.fleet.reservations
+        if max_results is None:
+            return reservations
+        # Pages hold about max_results instances, at two per reservation
+        end = start + max(1, max_results // 2)
+        page = Page(reservations[start:end])
+        if end < len(reservations):
+            page.next_token = str(end)
+        return page
+
+    def get_all_security_groups(self, filters=None, group_ids=None):
+        self._call()
+        return self.fleet.security_groups
+
+    def get_all_vpcs(self, filters=None, vpc_ids=None):
+        self._call()
+        return self.fleet.vpcs
@@ -0,0 +1,272 @@
+"""
+benchmarks.run
+~~~~~~~~~~~~~~
+
+Run the benchmarks, writing machine readable results as JSON.
+
+    $ python -m benchmarks.run --sizes 1000,100000 --output results.json
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import argparse
+import gc
+import json
+import platform
+import resource
+import sys
+import threading
+import time
+
+import ec2
+from ec2 import ratelimit
+from ec2.models import columns, managers
+from ec2.models.helpers import make_compare
+from ec2.models.managers import InstanceManager, SecurityGroupManager, VPCManager
+
+from .fleet import Fleet, StubConnection
+
+SIZES = (1000, 10000, 100000)
+
+# One filter per comparison, against tags and attributes, picked so each
+# matches a different share of the fleet
+FILTERS = (
+    ('exact', {'name': 'production-web-00042'}),
+    ('exact_attribute', {'instance_type': 'm3.large'}),
+    ('iexact', {'name__iexact': 'PRODUCTION-WEB-00042'}),
+    ('like', {'name__like': r'^production-web-\d+$'}),
+    ('ilike', {'name__ilike': r'^PRODUCTION-WEB'}),
+    ('contains', {'name__contains': '-web-'}),
+    ('icontains', {'name__icontains': '-WEB-'}),
+    ('startswith', {'name__startswith': 'production-web'}),
+    ('istartswith', {'name__istartswith': 'PRODUCTION-WEB'}),
+    ('endswith', {'name__endswith': '42'}),
+    ('iendswith', {'name__iendswith': '42'}),
+    ('isnull_tag', {'owner__isnull': True}),
+    ('isnull_attribute', {'ip_address__isnull': False}),
+    ('multiple', {'state': 'running', 'name__startswith': 'production', 'instance_type': 'm3.large'}),
+)
+
+
+def measure(func, setup=None, min_time=0.2, max_runs=1000):
+    "Call `func` until `min_time` seconds are spent, returning (runs, total, best)"
+    runs, total, best = 0, 0.0, None
+    while runs == 0 or (total < min_time and runs < max_runs):
+        if setup is not None:
+            setup()
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        runs += 1
+        total += elapsed
+        if best is None or elapsed < best:
+            best = elapsed
+    return runs, total, best
+
+
+def maxrss():
+    "Peak memory use of this process so far, in kilobytes"
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on OS X, kilobytes everywhere else
+        rss //= 1024
+    return rss
+
+
+class Suite(object):
+    "Every benchmark for one fleet size"
+
+    def __init__(self, size, min_time=0.2, latency=0, threads=8, verbose=False):
+        self.size = size
+        self.min_time = min_time
+        self.threads = threads
+        self.verbose = verbose
+        self.results = []
+        self.fleet = Fleet(size)
+        self.connection = StubConnection(self.fleet, latency)
+
+    def bench(self, name, func, setup=None, ops=1):
+        """
+        Measure `func`, which does `ops` operations per call. `setup` is
+        called before every call, outside of the timing. Without one,
+        `func` is called once before measuring, to warm up.
+        """
+        if setup is None:
+            # Leave lazily built indexes and columns out of the timing
+            func()
+        gc.collect()
+        calls = self.connection.calls
+        runs, total, best = measure(func, setup, self.min_time)
+        result = {
+            'name': name,
+            'size': self.size,
+            'runs': runs,
+            'mean': total / runs,
+            'best': best,
+            'ops_per_sec': ops * runs / total if total else None,
+            'api_calls': float(self.connection.calls - calls) / runs,
+            'maxrss_kb': maxrss(),
+        }
+        self.results.append(result)
+        if self.verbose:
+            sys.stderr.write('%-40s %8d %12.6fs %14.1f ops/s\n' % (name, self.size, result['mean'], result['ops_per_sec'] or 0))
+        return result
+
+    def run(self):
+        def connect(region_name=None):
+            return self.connection
+        saved = managers.get_connection, managers.get_vpc_connection, ratelimit.limiter
+        managers.get_connection = managers.get_vpc_connection = connect
+        # Nothing to protect from throttling here
+        ratelimit.limiter = ratelimit.RateLimiter(rate=1e9, burst=1e9)
+        try:
+            self.run_cold()
+            self.run_warm()
+            self.run_concurrent()
+            self.run_lite()
+        finally:
+            managers.get_connection, managers.get_vpc_connection, ratelimit.limiter = saved
+            for manager in (InstanceManager, SecurityGroupManager, VPCManager):
+                manager.clear()
+        return self.results
+
+    def run_cold(self):
+        clear = InstanceManager.clear
+        self.bench('cold.all', InstanceManager.all, clear)
+        self.bench('cold.filter.pushdown', lambda: len(InstanceManager.filter(state='running', name__startswith='production')), clear)
+        self.bench('cold.first', lambda: InstanceManager.first(name__endswith='7'), clear)
+        self.bench('cold.iter_filter', lambda: sum(1 for _ in InstanceManager.iter_filter(state='stopped')), clear)
+
+        def refill():
+            InstanceManager.clear()
+            InstanceManager.all()
+        InstanceManager.INCREMENTAL = True
+        try:
+            self.bench('refresh.incremental', InstanceManager.refresh, refill)
+        finally:
+            InstanceManager.INCREMENTAL = False
+
+    def run_warm(self):
+        InstanceManager.all()
+        objects = InstanceManager.all()
+        self.bench('warm.all', InstanceManager.all)
+        self.bench('warm.get.id', lambda: InstanceManager.get(id='i-%08x' % (self.size // 2)))
+        self.bench('warm.get.name', lambda: InstanceManager.get(name=self.fleet.instances[-1].tags['Name']))
+
+        for name, kwargs in FILTERS:
+            self.bench('warm.filter.%s' % name, lambda: len(InstanceManager.filter(**kwargs)))
+        if columns.numpy is not None:
+            # The same, evaluated object by object
+            min_objects = columns.MIN_OBJECTS
+            columns.MIN_OBJECTS = sys.maxint
+            try:
+                for name, kwargs in FILTERS:
+                    self.bench('warm.filter.rowwise.%s' % name, lambda: len(InstanceManager.filter(**kwargs)))
+            finally:
+                columns.MIN_OBJECTS = min_objects
+        for name, kwargs in FILTERS:
+            if name == 'multiple':
+                continue
+            (key, value), = kwargs.items()
+            self.bench('compare.%s' % name, lambda: sum(1 for obj in objects if make_compare(key, value, obj)))
+
+        self.bench('chained.filter', lambda: len(
+            InstanceManager.filter(state='running').filter(name__startswith='production').exclude(instance_type='t1.micro')))
+        self.bench('chained.order_by', lambda: list(
+            InstanceManager.filter(state='running').order_by('-launch_time')[:10]))
+        self.bench('queryset.count', lambda: InstanceManager.filter(name__contains='-db-').count())
+        self.bench('queryset.exists', lambda: InstanceManager.filter(name__endswith='99').exists())
+        self.bench('queryset.values_list', lambda: InstanceManager.filter(state='stopped').values_list('id', flat=True))
+
+        SecurityGroupManager.all()
+        VPCManager.all()
+        self.bench('warm.security_groups.filter', lambda: len(SecurityGroupManager.filter(name__startswith='production')))
+        self.bench('warm.vpcs.filter', lambda: len(VPCManager.filter(cidr_block__startswith='10.0.')))
+
+    def run_concurrent(self):
+        threads = self.threads
+        per_thread = 10
+
+        def hammer(func):
+            def run():
+                def work():
+                    for _ in xrange(per_thread):
+                        func()
+                workers = [threading.Thread(target=work) for _ in xrange(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            return run
+
+        InstanceManager.all()
+        self.bench(
+            'concurrent.filter',
+            hammer(lambda: len(InstanceManager.filter(state='running', name__startswith='production'))),
+            ops=threads * per_thread)
+        self.bench('concurrent.get', hammer(lambda: InstanceManager.get(id='i-00000000')), ops=threads * per_thread)
+        # Every thread finds the cache cold, only one of them refills it
+        self.bench('concurrent.cold.all', hammer(InstanceManager.all), InstanceManager.clear, ops=threads * per_thread)
+
+    def run_lite(self):
+        InstanceManager.LITE = True
+        try:
+            InstanceManager.clear()
+            self.bench('lite.cold.all', InstanceManager.all, InstanceManager.clear)
+            InstanceManager.all()
+            self.bench('lite.warm.filter', lambda: len(InstanceManager.filter(state='running', name__startswith='production')))
+        finally:
+            InstanceManager.LITE = False
+            InstanceManager.clear()
+
+
+def run(sizes=SIZES, min_time=0.2, latency=0, threads=8, verbose=False):
+    "Run every benchmark for every fleet size, returning the results as a dict"
+    ec2.credentials.ACCESS_KEY_ID = 'benchmark'
+    ec2.credentials.SECRET_ACCESS_KEY = 'benchmark'
+    results = []
+    for size in sizes:
+        results.extend(Suite(size, min_time, latency, threads, verbose).run())
+    return {
+        'meta': {
+            'ec2': ec2.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'numpy': columns.numpy is not None and columns.numpy.__version__ or None,
+            'timestamp': int(time.time()),
+            'min_time': min_time,
+            'latency': latency,
+            'threads': threads,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ec2 query and cache layers.')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma separated fleet sizes, e.g. 1000,500000')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to spend on each benchmark')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds each stubbed API call takes')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='threads for the concurrent benchmarks')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--quiet', action='store_true', help="don't print progress to stderr")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.min_time, args.latency, args.threads, not args.quiet)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -18,3 +18,7 @@ __all__ = ('credentials', 'instances', 'security_groups', 'vpcs')
 
 from .connection import credentials  # noqa
 from .models import Instance, SecurityGroup, VPC  # noqa
+
+instances = Instance.objects
+security_groups = SecurityGroup.objects
+vpcs = VPC.objects
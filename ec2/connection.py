@@ -7,37 +7,151 @@ ec2.connection
 """
 
 import os
+import threading
+import time
+
 import boto.ec2
 import boto.vpc
 
-_connection = None
-_vpc_connection = None
+# Maximum number of connections kept per service, region and credentials
+MAX_CONNECTIONS = 10
+# Seconds a connection may sit unused before it's closed
+MAX_IDLE = 60 * 5
+
+_patched = False
+_patch_lock = threading.Lock()
 
 
 def patch_boto():
-    import boto.ec2.connection
-    from .models.models import Instance, Reservation, SecurityGroup, VPC
-    boto.ec2.connection.Instance = Instance
-    boto.ec2.connection.Reservation = Reservation
-    boto.ec2.connection.SecurityGroup = SecurityGroup
-    boto.ec2.connection.VPC = VPC
+    "Swap our models in for boto's own, once"
+    global _patched
+    if _patched:
+        return
+    with _patch_lock:
+        if _patched:
+            return
+        import boto.ec2.connection
+        from .models.models import Instance, Reservation, SecurityGroup, VPC
+        boto.ec2.connection.Instance = Instance
+        boto.ec2.connection.Reservation = Reservation
+        boto.ec2.connection.SecurityGroup = SecurityGroup
+        boto.ec2.connection.VPC = VPC
+        _patched = True
 
 
-def get_connection():
-    "Cache a global connection object to be used by all classes"
-    global _connection
-    patch_boto()
-    if _connection is None:
-        _connection = boto.ec2.connect_to_region(**credentials())
-    return _connection
+class ConnectionPool(object):
+    """
+    Pool of boto connections, keyed by service, region and credentials.
+
+    Each thread leases its own connection, so concurrent API calls don't
+    share one HTTP connection. Once `max_size` connections exist for a key,
+    new threads share the least recently used one. Connections left idle
+    for longer than `max_idle` seconds, or leased by threads that have
+    since exited, go back to the pool; idle ones are closed.
+    """
+
+    def __init__(self, max_size=MAX_CONNECTIONS, max_idle=MAX_IDLE):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        # key -> {thread ident: [connection, last used]}
+        self._leases = {}
+        # key -> [[connection, last used], ...] not leased to any thread
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, connect):
+        "Return the current thread's connection for `key`, calling `connect` to make one"
+        ident = threading.current_thread().ident
+        now = time.time()
+        leases = self._leases.get(key)
+        if leases is not None:
+            lease = leases.get(ident)
+            if lease is not None:
+                lease[1] = now
+                return lease[0]
+
+        with self._lock:
+            self._evict(now)
+            leases = self._leases.setdefault(key, {})
+            free = self._free.setdefault(key, [])
+            if free:
+                lease = free.pop()
+            elif len(self._connections(key)) < self.max_size:
+                lease = [connect(), now]
+            else:
+                lease = min(leases.values(), key=lambda l: l[1])
+            lease[1] = now
+            leases[ident] = lease
+            return lease[0]
+
+    def _connections(self, key):
+        connections = [lease[0] for lease in self._leases.get(key, {}).values()]
+        connections.extend(lease[0] for lease in self._free.get(key, ()))
+        # Leases may share a connection
+        return set(map(id, connections))
+
+    def _evict(self, now):
+        alive = set(t.ident for t in threading.enumerate())
+        for key, leases in self._leases.items():
+            free = self._free.setdefault(key, [])
+            for ident, lease in leases.items():
+                if ident not in alive or now - lease[1] > self.max_idle:
+                    del leases[ident]
+                    shared = any(l[0] is lease[0] for l in leases.values())
+                    if not shared and not any(l[0] is lease[0] for l in free):
+                        free.append(lease)
+            for lease in free[:]:
+                if now - lease[1] > self.max_idle:
+                    free.remove(lease)
+                    _close(lease[0])
+
+    def size(self, key):
+        "Number of distinct connections open for `key`"
+        with self._lock:
+            return len(self._connections(key))
 
+    def clear(self):
+        "Close and forget every connection"
+        with self._lock:
+            for leases in self._leases.values():
+                for lease in leases.values():
+                    _close(lease[0])
+            for free in self._free.values():
+                for lease in free:
+                    _close(lease[0])
+            self._leases.clear()
+            self._free.clear()
 
-def get_vpc_connection():
-    global _vpc_connection
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+pool = ConnectionPool()
+
+
+def _connect(service, connect_to_region, region_name=None):
     patch_boto()
-    if _vpc_connection is None:
-        _vpc_connection = boto.vpc.connect_to_region(**credentials())
-    return _vpc_connection
+    kwargs = dict(**credentials())
+    if region_name is not None:
+        kwargs['region_name'] = region_name
+    key = (service, kwargs['region_name'], kwargs['aws_access_key_id'], kwargs['aws_secret_access_key'])
+    return pool.get(key, lambda: connect_to_region(**kwargs))
+
+
+def get_connection(region_name=None):
+    """
+    Get a pooled connection object for the current thread to be used by
+    all classes. Defaults to the region in `credentials`.
+    """
+    return _connect('ec2', boto.ec2.connect_to_region, region_name)
+
+
+def get_vpc_connection(region_name=None):
+    return _connect('vpc', boto.vpc.connect_to_region, region_name)
 
 
 class credentials(object):
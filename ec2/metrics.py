@@ -0,0 +1,150 @@
+"""
+ec2.metrics
+~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import re
+import socket
+import threading
+import time
+
+# Callables receiving every metric as hook(kind, name, value, tags), where
+# kind is 'count' or 'timing' (in seconds) and tags is a dict. While this
+# is empty, recording a metric is a single function call that returns
+# right away.
+hooks = []
+
+
+def add_hook(hook):
+    """
+    Start sending metrics to `hook`
+
+    >>> ec2.metrics.add_hook(ec2.metrics.StatsdExporter('localhost', 8125))
+    """
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+def remove_hook(hook):
+    try:
+        hooks.remove(hook)
+    except ValueError:
+        pass
+
+
+def incr(name, value=1, **tags):
+    "Count `value` more of `name`"
+    if not hooks:
+        return
+    for hook in hooks:
+        hook('count', name, value, tags)
+
+
+def start():
+    "Start a timer for stop(), or return None when nobody is listening"
+    if not hooks:
+        return None
+    return time.time()
+
+
+def stop(started, name, **tags):
+    "Record the seconds since start() returned `started`, as `name`"
+    if started is None or not hooks:
+        return
+    elapsed = time.time() - started
+    for hook in hooks:
+        hook('timing', name, elapsed, tags)
+
+
+class StatsdExporter(object):
+    """
+    Send metrics to a statsd server over UDP. Tag values are appended to
+    the metric name, sorted by tag name, since plain statsd has no tags.
+
+    >>> ec2.metrics.add_hook(StatsdExporter('localhost', 8125, prefix='ec2.'))
+    # ec2.api.calls.InstanceManager.get_all_instances:1|c
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='ec2.'):
+        self.address = host, port
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, kind, name, value, tags):
+        parts = [self.prefix + name]
+        parts.extend(str(tags[tag]) for tag in sorted(tags))
+        name = '.'.join(parts)
+        if kind == 'timing':
+            return '%s:%d|ms' % (name, round(value * 1000))
+        return '%s:%s|c' % (name, value)
+
+    def __call__(self, kind, name, value, tags):
+        try:
+            self.socket.sendto(self.format(kind, name, value, tags), self.address)
+        except socket.error:
+            # Metrics are best effort
+            pass
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusExporter(object):
+    """
+    Aggregate metrics in memory, to be scraped in the Prometheus text
+    format from render(). Counts become counters, and timings summaries
+    with a count and sum.
+
+    >>> exporter = PrometheusExporter()
+    >>> ec2.metrics.add_hook(exporter)
+    >>> print exporter.render()
+    # TYPE ec2_api_calls_total counter
+    ec2_api_calls_total{action="get_all_instances",manager="InstanceManager"} 1
+    """
+
+    def __init__(self, prefix='ec2_'):
+        self.prefix = prefix
+        # (kind, name) -> {sorted tag items: [count, sum]}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, name, value, tags):
+        labels = tuple(sorted(tags.items()))
+        with self._lock:
+            series = self._metrics.setdefault((kind, name), {})
+            totals = series.setdefault(labels, [0, 0])
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for (kind, name), series in sorted(self._metrics.items()):
+                name = self.prefix + _metric_name(name)
+                if kind == 'count':
+                    name += '_total'
+                    lines.append('# TYPE %s counter' % name)
+                else:
+                    name += '_seconds'
+                    lines.append('# TYPE %s summary' % name)
+                for labels, (count, total) in sorted(series.items()):
+                    labels = ','.join('%s="%s"' % (_metric_name(k), _label_value(v)) for k, v in labels)
+                    labels = labels and '{%s}' % labels
+                    if kind == 'count':
+                        lines.append('%s%s %s' % (name, labels, total))
+                    else:
+                        lines.append('%s_count%s %s' % (name, labels, count))
+                        lines.append('%s_sum%s %s' % (name, labels, repr(float(total))))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
@@ -7,3 +7,6 @@ ec2.models
 """
 
 from .models import Instance, Reservation, SecurityGroup, VPC  # noqa
+from . import helpers  # noqa
+from .query import Q, Query, compile_filter  # noqa
+from .relations import related  # noqa
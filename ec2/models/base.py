@@ -6,22 +6,48 @@ ec2.models.base
 :license: BSD, see LICENSE for more details.
 """
 
+from collections import namedtuple
 from datetime import datetime, timedelta
+from itertools import islice
+from threading import Lock
+import time
 
-from .helpers import make_compare
+from . import bulk, futures
+from .cache import ResultCache, dumps, loads, make_key
+from .helpers import snapshot
+from .indexes import IndexSet, JoinIndex
+from .query import compile_filter
+from .queryset import QuerySet
+from .records import Record
+from .regions import RegionSet
+from ec2 import metrics
+from ec2.connection import credentials
 
 
+# Default number of seconds cached results may be used for
 MAX_CACHE_AGE = 60 * 5
 
+EPOCH = datetime(1970, 1, 1)
+
+# Objects added, changed in place, and removed by an incremental refresh
+Diff = namedtuple('Diff', 'added changed removed')
+
 
 class _EC2MetaClass(type):
     "Metaclass for all EC2 filter type classes"
 
     def __new__(cls, name, bases, attrs):
-        # Append MultipleObjectsReturned and DoesNotExist exceptions
+        # Append MultipleObjectsReturned and DoesNotExist exceptions,
+        # subclassing any inherited ones so they can still be caught
         for contrib in ('MultipleObjectsReturned', 'DoesNotExist'):
-            attrs[contrib] = type(contrib, (Exception,), {})
-        return super(_EC2MetaClass, cls).__new__(cls, name, bases, attrs)
+            parents = tuple(getattr(b, contrib) for b in bases if hasattr(b, contrib))
+            attrs[contrib] = type(contrib, parents or (Exception,), {})
+        new_cls = super(_EC2MetaClass, cls).__new__(cls, name, bases, attrs)
+        # Each class gets its own cache of targeted API results,
+        # and its own lock so only one thread refreshes the cache
+        new_cls._results = ResultCache(new_cls.MAX_RESULTS)
+        new_cls._refresh_lock = Lock()
+        return new_cls
 
 
 class objects_base(object):
@@ -29,36 +55,284 @@ class objects_base(object):
 
     __metaclass__ = _EC2MetaClass
 
+    # Fields (attributes or tag names) to index whenever the cache is filled.
+    # exact, iexact, startswith and istartswith filters on these fields are
+    # answered from the index instead of scanning every object.
+    INDEXES = ()
+    _indexes = None
+
+    # Mapping of field name -> EC2 API filter name. When the cache is cold,
+    # filters on these fields are sent along with the API call so only the
+    # matching objects are fetched.
+    FILTERS = {}
+    # Field name -> comparisons its API filter supports, for API filters
+    # that only match whole values. Other fields push down any comparison.
+    FILTER_COMPARISONS = {}
+
+    # Number of distinct pushed down queries to keep results for
+    MAX_RESULTS = 128
+
+    # Seconds until the cache expires and all() has to wait for a refresh
+    HARD_TTL = MAX_CACHE_AGE
+    # Seconds until all() starts refreshing the cache in the background,
+    # while still returning the stale cache. None disables this.
+    SOFT_TTL = None
+
+    # Merge refreshed results into the cache by id instead of replacing it,
+    # so cached objects are updated in place. See refresh().
+    INCREMENTAL = False
+    # The Diff from the most recent incremental refresh
+    last_diff = None
+
+    # CacheBackend to share snapshots of the cache through, e.g. a
+    # FileBackend or KeyValueBackend, so other processes can start from a
+    # recent snapshot instead of the API. None keeps the cache in this
+    # process only. Set it on objects_base to use it for every manager.
+    CACHE_BACKEND = None
+
+    # Region to query, defaults to the one in `credentials`
+    REGION_NAME = None
+
+    # Cache compact Records of just LITE_FIELDS instead of full boto
+    # objects, interning the values of LITE_INTERN and tag keys. The full
+    # object is only fetched when something else is needed from a record.
+    LITE = False
+    LITE_FIELDS = ('id', 'tags')
+    LITE_INTERN = ()
+    # boto class records stand in for
+    MODEL = None
+
+    # Relation name -> `relations.Relation` to another manager's objects,
+    # which filters can follow with keys like `vpc__cidr_block`
+    RELATIONS = {}
+
+    @classmethod
+    def _cache_older_than(cls, seconds):
+        if seconds is None or '_cached_at' not in cls.__dict__:
+            return False
+        return datetime.utcnow() - cls._cached_at > timedelta(seconds=seconds)
+
     @classmethod
     def is_cache_expired(cls):
-        if hasattr(cls, '_cached_at'):
-            if datetime.utcnow() - cls._cached_at > timedelta(seconds=MAX_CACHE_AGE):
-                return True
+        "Whether the cache is older than HARD_TTL, and must be refreshed before use"
+        return cls._cache_older_than(cls.HARD_TTL)
+
+    @classmethod
+    def is_cache_stale(cls):
+        "Whether the cache is older than SOFT_TTL, and should be refreshed in the background"
+        return cls._cache_older_than(cls.SOFT_TTL)
 
-        return False
+    @classmethod
+    def is_cached(cls):
+        # Regional subclasses must not see their parent's cache
+        return '_cache' in cls.__dict__ and not cls.is_cache_expired()
 
     @classmethod
     def all(cls):
         """
         Wrapper around _all() to cache and return all results of something
 
+        Only one thread refreshes an expired cache, while the others wait
+        for it. If SOFT_TTL is set, a stale cache is returned right away
+        while it is refreshed in the background.
+
         >>> ec2.instances.all()
         [ ... ]
         """
-        if not hasattr(cls, '_cache') or cls.is_cache_expired():
-            cls._cache = cls._all()
-            cls._cached_at = datetime.utcnow()
+        if not cls.is_cached():
+            if '_cache' in cls.__dict__:
+                metrics.incr('cache.expired', manager=cls.__name__)
+            else:
+                metrics.incr('cache.misses', manager=cls.__name__)
+            cls._refresh(lambda: not cls.is_cached())
+        elif cls.is_cache_stale():
+            metrics.incr('cache.stale', manager=cls.__name__)
+            # Hold on to the stale cache, the refresh may replace it
+            # before submit() returns
+            cache = cls._cache
+            futures.submit((cls, 'refresh'), cls._refresh, cls.is_cache_stale, cls.SOFT_TTL)
+            return cache
+        else:
+            metrics.incr('cache.hits', manager=cls.__name__)
         return cls._cache
 
     @classmethod
-    def get(cls, **kwargs):
+    def _refresh(cls, needed, max_age=None):
+        "Refill the cache, unless another thread already did while we waited"
+        with cls._refresh_lock:
+            if needed():
+                started = metrics.start()
+                objects, fetched_at = cls._fetch(max_age=max_age)
+                if cls.INCREMENTAL:
+                    cls._merge(objects, fetched_at)
+                else:
+                    cls._fill(objects, fetched_at)
+                metrics.stop(started, 'cache.refresh', manager=cls.__name__)
+
+    @classmethod
+    def _fetch(cls, force=False, max_age=None):
+        """
+        Fetch everything, returning the objects and when they were fetched.
+        Uses a snapshot from CACHE_BACKEND instead, if it's no older than
+        `max_age` seconds, which defaults to HARD_TTL.
+        """
+        backend = cls.CACHE_BACKEND
+        if backend is None:
+            return cls._compact(cls._all()), time.time()
+        key = cls._snapshot_key()
+        stored = None if force else backend.get(key)
+        if max_age is None:
+            max_age = cls.HARD_TTL
+        if stored is not None and time.time() - stored[0] <= max_age:
+            try:
+                return cls._compact(loads(stored[1], cls._connection)), stored[0]
+            except Exception:
+                # Unreadable snapshot, just fetch a new one
+                pass
+        fetched_at = time.time()
+        objects = cls._compact(cls._all())
+        backend.set(key, fetched_at, dumps(objects))
+        return objects, fetched_at
+
+    @classmethod
+    def _compact(cls, objects):
+        "Turn objects into Records bound to this manager, if LITE is on"
+        if not cls.LITE:
+            return objects
+        if cls.__dict__.get('_lite_fields') != cls.LITE_FIELDS:
+            cls._lite_fields = cls.LITE_FIELDS
+            cls._record_fields = dict((name, i) for i, name in enumerate(cls.LITE_FIELDS))
+        fields, interned = cls._record_fields, frozenset(cls.LITE_INTERN)
+        records = []
+        for obj in objects:
+            if isinstance(obj, Record):
+                obj._manager = cls
+            else:
+                obj = Record.from_object(obj, fields, interned, cls)
+            records.append(obj)
+        return records
+
+    @classmethod
+    def _snapshot_key(cls):
+        "Key for this manager's snapshots, unique per class, region and account"
+        creds = credentials()
+        return '%s-%s-%s' % (
+            cls.__name__, cls.REGION_NAME or creds['region_name'], creds['aws_access_key_id'])
+
+    @classmethod
+    def refresh(cls):
+        """
+        Refetch everything now and merge it into the cache by id.
+
+        Objects that changed are updated in place, new ones are appended
+        and ones that are gone are dropped, so references to cached objects
+        stay valid. The cached list itself is replaced, never changed, so
+        anyone still using the old one sees it as it was. Returns a Diff of
+        what was added, changed and removed.
+
+        >>> diff = ec2.instances.refresh()
+        >>> [i.id for i in diff.added]
+        ['i-123']
+        """
+        with cls._refresh_lock:
+            return cls._merge(*cls._fetch(force=True))
+
+    @classmethod
+    def _merge(cls, objects, fetched_at=None):
+        if '_cache' not in cls.__dict__:
+            cls._fill(list(objects), fetched_at)
+            cls.last_diff = Diff(list(cls._cache), [], [])
+            return cls.last_diff
+
+        cached = {}
+        for obj in cls._cache:
+            cached[obj.id] = obj
+        fetched = set()
+        added, changed = [], []
+        for obj in objects:
+            fetched.add(obj.id)
+            current = cached.get(obj.id)
+            if current is None:
+                added.append(obj)
+            elif snapshot(current) != snapshot(obj):
+                if isinstance(current, Record):
+                    current._values, current._full = obj._values, None
+                else:
+                    # Without clearing first, so concurrent filters never
+                    # see the object without its attributes
+                    current.__dict__.update(obj.__dict__)
+                changed.append(current)
+        removed = [obj for obj in cls._cache if obj.id not in fetched]
+        cls._fill([obj for obj in cls._cache if obj.id in fetched] + added, fetched_at)
+        cls.last_diff = Diff(added, changed, removed)
+        return cls.last_diff
+
+    @classmethod
+    def _fill(cls, objects, fetched_at=None):
+        """
+        Publish `objects` as the cache. Lists are never changed once
+        published, readers holding on to one with its indexes always see
+        them agree, and pair them up again by identity otherwise.
+        """
+        indexes = IndexSet(objects, cls.INDEXES, cls)
+        if fetched_at is None:
+            cls._cached_at = datetime.utcnow()
+        else:
+            cls._cached_at = datetime.utcfromtimestamp(fetched_at)
+        cls._cache, cls._indexes = objects, indexes
+
+    @classmethod
+    def for_region(cls, region_name):
+        """
+        Return a version of this manager bound to another region,
+        with its own connection and cache.
+
+        >>> ec2.instances.for_region('us-west-2').filter(state='running')
+        [ ... ]
+        """
+        if '_regional' not in cls.__dict__:
+            cls._regional = {}
+        try:
+            return cls._regional[region_name]
+        except KeyError:
+            pass
+        regional = type(cls)(cls.__name__, (cls,), {'REGION_NAME': region_name})
+        return cls._regional.setdefault(region_name, regional)
+
+    @classmethod
+    def in_regions(cls, regions, max_workers=None):
+        """
+        Query several regions concurrently, merging the results
+
+        >>> ec2.instances.in_regions(['us-east-1', 'eu-west-1']).filter(state='running')
+        [ ... ]
+        """
+        return RegionSet(cls, regions, max_workers)
+
+    @classmethod
+    def iter_all(cls):
+        """
+        Iterate over all results without caching them. If nothing is
+        cached, results are paged through and yielded as they arrive.
+
+        >>> for instance in ec2.instances.iter_all():
+        ...     print instance.id
+        """
+        if cls.is_cached():
+            return iter(cls._cache)
+        return cls._iter_all()
+
+    @classmethod
+    def get(cls, *args, **kwargs):
         """
         Generic get() for one item only
 
         >>> ec2.instances.get(name='production-web-01')
         <Instance: ...>
         """
-        things = cls.filter(**kwargs)
+        query = compile_filter(*args, **kwargs)
+        # Two matches are enough to know there are too many
+        things = list(islice(query.iterate(*cls._source(query), manager=cls), 2))
         if len(things) > 1:
             # Raise an exception if more than one object is matched
             raise cls.MultipleObjectsReturned
@@ -68,7 +342,20 @@ class objects_base(object):
         return things[0]
 
     @classmethod
-    def filter(cls, **kwargs):
+    def first(cls, *args, **kwargs):
+        """
+        Return the first object matching the filters, or None.
+        Stops fetching pages as soon as a match is found.
+
+        >>> ec2.instances.first(state='running')
+        <Instance: ...>
+        """
+        for obj in cls.iter_filter(*args, **kwargs):
+            return obj
+        return None
+
+    @classmethod
+    def filter(cls, *args, **kwargs):
         """
         The meat. Filtering using Django model style syntax.
 
@@ -88,22 +375,130 @@ class objects_base(object):
             endswith: check if attribute value ends with the string
             iendswith: case insensitive startswith
             isnull: check if the attribute does not exist
+            in: check if attribute value is one of a list of values
+            gt, gte, lt, lte: check if attribute value is greater or less
+                than the value. Dates and datetimes are compared with
+                timestamps like launch_time, and numbers with numeric tags
+            range: check if attribute value is between a (low, high) pair
+
+        Filters are compiled into a `Query` once per call. A precompiled
+        `Query` may also be passed in to skip that step entirely, and so
+        may `Q` objects, combined with `|`, `&` and `~`.
+
+        Returns a lazy `QuerySet`, which can be filtered further, and is
+        only evaluated once its results are used.
+
+        If nothing is cached yet, any filters that EC2 understands are
+        pushed down to the API call, and the rest are checked in Python.
 
         >>> ec2.instances.filter(name__startswith='production')
         [ ... ]
+        >>> running = ec2.models.compile_filter(state='running')
+        >>> ec2.instances.filter(running).filter(name__startswith='production')
+        [ ... ]
+        >>> ec2.instances.filter(Q(name__startswith='web') | Q(name__startswith='api'))
+        [ ... ]
+        """
+        return QuerySet(cls).filter(*args, **kwargs)
+
+    @classmethod
+    def exclude(cls, *args, **kwargs):
+        """
+        Opposite of filter(), returning a lazy `QuerySet` of everything
+        not matching all of the filters
+
+        >>> ec2.instances.exclude(state='terminated')
+        [ ... ]
+        """
+        return QuerySet(cls).exclude(*args, **kwargs)
+
+    @classmethod
+    def iter_filter(cls, *args, **kwargs):
+        """
+        Same as filter(), but yields matches lazily. If nothing is cached,
+        results are paged through without being cached, so memory use is
+        bounded by the page size rather than the number of objects.
+
+        >>> for instance in ec2.instances.iter_filter(state='running'):
+        ...     print instance.id
+        """
+        query = compile_filter(*args, **kwargs)
+        if cls.is_cached():
+            return query.iterate(cls._cache, cls._indexes, cls)
+        return query.iterate(cls._iter_all(filters=query.pushdown(cls.FILTERS, cls.FILTER_COMPARISONS) or None), manager=cls)
+
+    @classmethod
+    def _source(cls, query):
+        "Return the objects to evaluate `query` against, and their indexes"
+        if not cls.is_cached():
+            filters = query.pushdown(cls.FILTERS, cls.FILTER_COMPARISONS)
+            if filters:
+                return cls._filtered(filters), None
+        return cls.all(), cls._indexes
+
+    @classmethod
+    def _lookup(cls, attr, values, key=None):
+        """
+        Cached objects whose `attr`, or the `key` of any item in it, is one
+        of `values`, found through a hash map over the cache. Fetches
+        everything once if nothing is cached.
         """
-        qs = cls.all()
-        for key in kwargs:
-            qs = filter(lambda i: make_compare(key, kwargs[key], i), qs)
-        return qs
+        objects = cls.all()
+        indexes = cls.__dict__.get('_indexes')
+        if indexes is None or indexes.objects is not objects:
+            # Refreshed in between
+            join = JoinIndex(objects, attr, key)
+        else:
+            join = indexes.join(attr, key)
+        return [objects[i] for i in join.lookup(values)]
+
+    @classmethod
+    def _iter_all(cls, filters=None):
+        "Iterate over results. Managers that can page through results override this."
+        return iter(cls._all(filters=filters))
+
+    @classmethod
+    def _filtered(cls, filters):
+        "Fetch the objects matching API `filters`, caching the result"
+        key = make_key(filters)
+        objects = cls._results.get(key)
+        if objects is None:
+            metrics.incr('cache.results.misses', manager=cls.__name__)
+            objects = cls._all(filters=filters)
+            cls._results.set(key, objects, cls.HARD_TTL)
+        else:
+            metrics.incr('cache.results.hits', manager=cls.__name__)
+        return objects
+
+    @classmethod
+    def cache_stats(cls):
+        """
+        Hit and miss counters for the cache of pushed down queries
+
+        >>> ec2.instances.cache_stats()
+        {'hits': 10, 'misses': 2, 'size': 2, 'max_size': 128}
+        """
+        return cls._results.stats()
 
     @classmethod
     def clear(cls):
-        "Clear the cached instances"
-        try:
-            del cls._cache
-        except AttributeError:
-            pass
+        """
+        Clear the cached instances, and their snapshot in CACHE_BACKEND,
+        so the next all() fetches them from the API again
+        """
+        cls._forget()
+        if cls.CACHE_BACKEND is not None:
+            cls.CACHE_BACKEND.delete(cls._snapshot_key())
+
+    @classmethod
+    def _forget(cls):
+        "Drop what's cached in this process only, like a process restarting would"
+        for attr in ('_cache', '_indexes'):
+            try:
+                delattr(cls, attr)
+            except AttributeError:
+                pass
+        cls._results.clear()
 
     @classmethod
     def create(cls, *args, **kwargs):
@@ -114,7 +509,10 @@ class objects_base(object):
         <VPC: ...>
         """
         result = cls._create(*args, **kwargs)
-        cls.clear()
+        if getattr(result, 'id', None) is None:
+            cls.clear()
+        else:
+            cls._write(added=[result])
         return result
 
     @classmethod
@@ -126,5 +524,150 @@ class objects_base(object):
         True
         """
         result = cls._delete(*args, **kwargs)
-        cls.clear()
+        ids = result and cls._deleted_ids(*args, **kwargs)
+        if ids is None or not result:
+            cls.clear()
+        else:
+            cls._write(removed=ids)
         return result
+
+    @classmethod
+    def _deleted_ids(cls, *args, **kwargs):
+        """
+        Ids of the objects removed by _delete() called with the same
+        arguments, or None if that isn't known
+        """
+        return None
+
+    @classmethod
+    def _write(cls, added=(), removed=()):
+        """
+        Write created objects and the ids of deleted ones through to the
+        cache, its indexes and its snapshot in CACHE_BACKEND, instead of
+        refetching everything. Like an incremental refresh, the cached
+        list is replaced rather than changed.
+        """
+        cls._results.clear()
+        backend = cls.CACHE_BACKEND
+        with cls._refresh_lock:
+            if '_cache' not in cls.__dict__:
+                # Nothing to write to here, but the snapshot is stale now
+                if backend is not None:
+                    backend.delete(cls._snapshot_key())
+                return
+            added = cls._compact(list(added))
+            ids = set(removed)
+            ids.update(obj.id for obj in added)
+            # Still as old as what it was fetched with
+            fetched_at = (cls._cached_at - EPOCH).total_seconds()
+            objects = [obj for obj in cls._cache if obj.id not in ids] + added
+            cls._fill(objects, fetched_at)
+            if backend is not None:
+                backend.set(cls._snapshot_key(), fetched_at, dumps(objects))
+
+    @classmethod
+    def bulk_create(cls, items, max_workers=None):
+        """
+        create() many objects at once, making the API calls concurrently
+        on at most `max_workers` threads. Each item is the arguments for
+        one create(): a tuple, a dict of keyword arguments, or a single
+        value. Returns a `BulkResult` per item, in order, with either the
+        created object or the error raised. The cache is only updated
+        once, at the end.
+
+        >>> results = ec2.security_groups.bulk_create([('web', 'Web servers'), ('db', 'Databases')])
+        >>> [r.error for r in results if r.error]
+        []
+        """
+        results = bulk.run(cls._create, items, max_workers)
+        created = [r.result for r in results if r.error is None]
+        if any(getattr(obj, 'id', None) is None for obj in created):
+            cls.clear()
+        elif created:
+            cls._write(added=created)
+        return results
+
+    @classmethod
+    def bulk_delete(cls, items, max_workers=None):
+        """
+        delete() many objects at once, like bulk_create()
+
+        >>> ec2.vpcs.bulk_delete(['vpc-123', 'vpc-456'])
+        [BulkResult(args=('vpc-123',), kwargs={}, result=True, error=None), ...]
+        """
+        results = bulk.run(cls._delete, items, max_workers)
+        removed = []
+        for r in results:
+            if r.error is not None:
+                continue
+            ids = r.result and cls._deleted_ids(*r.args, **r.kwargs)
+            if ids is None or not r.result:
+                cls.clear()
+                return results
+            removed.extend(ids)
+        if removed:
+            cls._write(removed=removed)
+        return results
+
+    @classmethod
+    def aall(cls):
+        """
+        Run all() in the background, returning an AsyncResult.
+        Concurrent calls share one fetch, and the same cache as all().
+
+        >>> result = ec2.instances.aall()
+        >>> result.get()
+        [ ... ]
+        """
+        return futures.submit(futures.call_key(cls, 'all', (), {}), cls.all)
+
+    @classmethod
+    def afilter(cls, *args, **kwargs):
+        """
+        Run filter() in the background, returning an AsyncResult.
+        Identical concurrent calls share one result.
+
+        >>> ec2.instances.afilter(state='running').get()
+        [ ... ]
+        """
+        key = futures.call_key(cls, 'filter', args, kwargs)
+        return futures.submit(key, cls._evaluated_filter, *args, **kwargs)
+
+    @classmethod
+    def _evaluated_filter(cls, *args, **kwargs):
+        # Evaluate in the background, not wherever the result ends up
+        things = cls.filter(*args, **kwargs)
+        len(things)
+        return things
+
+    @classmethod
+    def aget(cls, *args, **kwargs):
+        """
+        Run get() in the background, returning an AsyncResult.
+        DoesNotExist and MultipleObjectsReturned are raised from its get().
+
+        >>> ec2.instances.aget(name='production-web-01').get()
+        <Instance: ...>
+        """
+        key = futures.call_key(cls, 'get', args, kwargs)
+        return futures.submit(key, cls.get, *args, **kwargs)
+
+    @classmethod
+    def acreate(cls, *args, **kwargs):
+        """
+        Run create() in the background, returning an AsyncResult
+
+        >>> ec2.vpcs.acreate('10.10.10.0/16').get()
+        <VPC: ...>
+        """
+        return futures.submit(None, cls.create, *args, **kwargs)
+
+    @classmethod
+    def adelete(cls, *args, **kwargs):
+        """
+        Run delete() in the background, returning an AsyncResult
+
+        >>> ec2.vpcs.adelete('vpc-123').get()
+        True
+        """
+        return futures.submit(None, cls.delete, *args, **kwargs)
@@ -0,0 +1,49 @@
+"""
+ec2.models.bulk
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from collections import namedtuple
+
+from .futures import bounded_map
+
+# Outcome of one item of a bulk operation. Exactly one of `result`
+# and `error` is set, depending on whether the call raised.
+BulkResult = namedtuple('BulkResult', 'args kwargs result error')
+
+
+def arguments(item):
+    """
+    Turn one item of a bulk operation into call arguments. A dict is
+    keyword arguments, a tuple positional arguments, and anything else
+    the only argument.
+
+    >>> arguments(('web', 'Web servers'))
+    (('web', 'Web servers'), {})
+    >>> arguments('vpc-123')
+    (('vpc-123',), {})
+    """
+    if isinstance(item, dict):
+        return (), item
+    if isinstance(item, tuple):
+        return item, {}
+    return (item,), {}
+
+
+def run(func, items, max_workers=None):
+    """
+    Call `func` once per item on a bounded pool of threads, returning a
+    BulkResult per item, in the same order. Errors are collected rather
+    than raised, so one failure doesn't stop the rest.
+    """
+    def call(item):
+        args, kwargs = arguments(item)
+        try:
+            return BulkResult(args, kwargs, func(*args, **kwargs), None)
+        except Exception as e:
+            return BulkResult(args, kwargs, None, e)
+
+    return bounded_map(call, items, max_workers)
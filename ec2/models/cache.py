@@ -0,0 +1,320 @@
+"""
+ec2.models.cache
+~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import errno
+import os
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+try:
+    from cStringIO import StringIO
+except ImportError:  # pragma: no cover
+    from StringIO import StringIO
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from boto.connection import AWSAuthConnection
+
+# Bump whenever the snapshot format changes, older snapshots are ignored
+FORMAT_VERSION = 1
+
+
+def make_key(filters=None, ids=None):
+    """
+    Normalize API filters and requested ids into a hashable cache key.
+    Filter values may be a single value or a list of values.
+
+    >>> make_key({'instance-state-name': ['running', 'stopped']}, ['i-1'])
+    ((('instance-state-name', ('running', 'stopped')),), ('i-1',))
+    """
+    items = []
+    for name, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = tuple(sorted(value))
+        items.append((name, value))
+    return tuple(sorted(items)), tuple(sorted(ids or ()))
+
+
+class ResultCache(object):
+    """
+    Bounded LRU cache of API results, with a ttl per entry.
+
+    Keeps hit and miss counters so the cache can be tuned.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        "Return the cached value for `key`, or None if missing or expired"
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires < time.time():
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = expires, value
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        "Cache `value` under `key` for `ttl` seconds"
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = time.time() + ttl, value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+        }
+
+
+def _persistent_id(obj):
+    # Never pickle connections, they're reattached when loading
+    if isinstance(obj, AWSAuthConnection):
+        return 'connection'
+    return None
+
+
+def dumps(objects):
+    "Serialize boto objects into compressed bytes, leaving out their connections"
+    buf = StringIO()
+    pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = _persistent_id
+    pickler.dump(objects)
+    return zlib.compress(buf.getvalue())
+
+
+def loads(data, connect):
+    """
+    Deserialize boto objects from dumps(). `connect` is only called if
+    the objects referenced a connection, to get one to reattach.
+    """
+    connections = []
+
+    def persistent_load(pid):
+        if not connections:
+            connections.append(connect())
+        return connections[0]
+    unpickler = pickle.Unpickler(StringIO(zlib.decompress(data)))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def _pack(fetched_at, data):
+    return pickle.dumps((FORMAT_VERSION, fetched_at, data), pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack(raw):
+    "Return (fetched_at, data) from _pack(), or None if it can't be read"
+    try:
+        version, fetched_at, data = pickle.loads(raw)
+    except (EOFError, ValueError, TypeError, KeyError, IndexError, pickle.UnpicklingError):
+        return None
+    if version != FORMAT_VERSION:
+        return None
+    return fetched_at, data
+
+
+class CacheBackend(object):
+    """
+    Interface for somewhere to keep snapshots of a manager's cache.
+
+    Snapshots are opaque bytes from dumps(), stored with the time they
+    were fetched at.
+    """
+
+    def get(self, key):
+        "Return (fetched_at, data) stored under `key`, or None"
+        raise NotImplementedError
+
+    def set(self, key, fetched_at, data):
+        "Store `data` fetched at `fetched_at` under `key`"
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    "Keep snapshots in this process, shared by every manager using it"
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._snapshots.get(key)
+
+    def set(self, key, fetched_at, data):
+        with self._lock:
+            self._snapshots[key] = fetched_at, data
+
+    def delete(self, key):
+        with self._lock:
+            self._snapshots.pop(key, None)
+
+
+class KeyValueBackend(CacheBackend):
+    """
+    Keep snapshots in a shared key-value store, so a fleet of processes
+    can share one refreshed inventory instead of each hitting the API.
+
+    `client` only needs get(key), set(key, value[, timeout]) and
+    delete(key), which covers redis and memcached clients alike. If
+    `timeout` is given, it's passed along so the store expires old
+    snapshots by itself.
+
+    >>> import redis
+    >>> objects_base.CACHE_BACKEND = KeyValueBackend(redis.StrictRedis(), timeout=600)
+    """
+
+    def __init__(self, client, prefix='ec2:', timeout=None):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return _unpack(raw)
+
+    def set(self, key, fetched_at, data):
+        if self.timeout is None:
+            self.client.set(self.prefix + key, _pack(fetched_at, data))
+        else:
+            self.client.set(self.prefix + key, _pack(fetched_at, data), self.timeout)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class DictClient(object):
+    """
+    In-memory stand-in for a redis or memcached client, for use with
+    KeyValueBackend in tests and local development.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._values[key]
+            except KeyError:
+                return None
+            if expires is not None and expires < time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._values[key] = timeout and time.time() + timeout or None, value
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._values.pop(key, None) is not None
+
+
+class FileBackend(CacheBackend):
+    """
+    Persist cache snapshots as files in a directory, so short lived
+    processes can start with a warm cache.
+
+    Writes go to a temporary file that's renamed into place, and readers
+    and writers take a shared or exclusive lock, so concurrent processes
+    never see a partial snapshot.
+
+    >>> InstanceManager.CACHE_BACKEND = FileBackend('/tmp/ec2')
+    """
+
+    def __init__(self, directory=None):
+        self.directory = os.path.expanduser(directory or '~/.cache/ec2')
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(os.sep, '_') + '.cache')
+
+    @contextmanager
+    def _locked(self, key, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(key) + '.lock', 'a') as f:
+            fcntl.flock(f, exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key):
+        try:
+            with self._locked(key, False):
+                with open(self._path(key), 'rb') as f:
+                    raw = f.read()
+        except (IOError, OSError):
+            return None
+        return _unpack(raw)
+
+    def set(self, key, fetched_at, data):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with self._locked(key, True):
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_pack(fetched_at, data))
+                os.rename(tmp, self._path(key))
+            except Exception:
+                os.remove(tmp)
+                raise
+
+    def delete(self, key):
+        try:
+            with self._locked(key, True):
+                os.remove(self._path(key))
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,144 @@
+"""
+ec2.models.columns
+~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from .records import attribute
+from .tags import tag_value
+
+_missing = object()
+
+# Below this many objects, checking each one is as fast as vectorizing
+MIN_OBJECTS = 512
+
+
+def _cell(obj, field):
+    """
+    Everything a Predicate looks at for `field` on `obj`: the attribute,
+    and the first tag matching it case insensitively.
+    """
+    return attribute(obj, field, _missing), tag_value(obj, field, _missing)
+
+
+def _evaluate(predicate, attr, tag):
+    "Same as calling `predicate` on an object with this attribute and tag"
+    if attr is not _missing:
+        try:
+            return predicate.test(attr)
+        except AttributeError:
+            pass
+    if tag is not _missing:
+        return predicate.tag_test(tag)
+    return predicate.missing
+
+
+class Column(object):
+    """
+    Dictionary encoded values of one field across a list of objects.
+
+    Every distinct (attribute, tag) pair is stored once in `cells`, and
+    `codes` holds the cell of each object. A predicate is then evaluated
+    once per distinct value instead of once per object. If any value
+    can't be hashed, the column isn't `usable`.
+    """
+
+    def __init__(self, objects, field):
+        self.usable = True
+        self.cells = []
+        self.codes = numpy.empty(len(objects), dtype=numpy.intp)
+        seen = {}
+        for position, obj in enumerate(objects):
+            attr, tag = _cell(obj, field)
+            # Equal values of different types, like 1 and True, may
+            # still compare differently
+            key = attr.__class__, attr, tag.__class__, tag
+            try:
+                code = seen[key]
+            except KeyError:
+                code = seen[key] = len(self.cells)
+                self.cells.append((attr, tag))
+            except TypeError:
+                self.usable = False
+                self.cells = self.codes = None
+                return
+            self.codes[position] = code
+
+    def mask(self, predicate):
+        "Boolean array of the objects matching `predicate`"
+        results = numpy.fromiter(
+            (bool(_evaluate(predicate, attr, tag)) for attr, tag in self.cells),
+            dtype=bool, count=len(self.cells))
+        return results[self.codes]
+
+
+class ColumnSet(object):
+    """
+    Columns over a list of cached objects, built the first time a field
+    is filtered on, so predicates can be evaluated as boolean masks.
+
+    Objects may change in place after their columns were built, so the
+    matches are checked against the live objects before being returned.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.columns = {}
+
+    def column(self, field):
+        try:
+            return self.columns[field]
+        except KeyError:
+            column = self.columns[field] = Column(self.objects, field)
+            return column
+
+    def match(self, predicate):
+        "Boolean array of the objects matching a single predicate, or None if unsupported"
+        column = self.column(predicate.field)
+        if not column.usable:
+            return None
+        try:
+            return column.mask(predicate)
+        except Exception:
+            # Checking row by row may never get to the value that
+            # raised, so leave it to decide
+            return None
+
+    def mask(self, predicates):
+        """
+        Boolean array of the objects matching every predicate or
+        expression, or None if unsupported
+        """
+        mask = None
+        for predicate in predicates:
+            matched = predicate.mask(self)
+            if matched is None:
+                return None
+            if mask is None:
+                mask = matched
+            else:
+                mask = mask & matched
+        return mask
+
+    def filter(self, predicates):
+        "Return a list of the objects matching every predicate or expression, or None if unsupported"
+        mask = self.mask(predicates)
+        if mask is None:
+            return None
+        objects = self.objects
+        matched = (objects[i] for i in numpy.flatnonzero(mask))
+        return [obj for obj in matched if all(p(obj) for p in predicates)]
+
+
+def columns_for(objects):
+    "Return a ColumnSet over `objects`, or None if NumPy isn't installed"
+    if numpy is None:
+        return None
+    return ColumnSet(objects)
@@ -0,0 +1,83 @@
+"""
+ec2.models.futures
+~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+# Number of threads running API calls in the background, and the
+# default bound on those making many calls at once, see bounded_map()
+MAX_WORKERS = 8
+
+_pool = None
+_inflight = {}
+_lock = Lock()
+
+
+def get_pool():
+    "Lazily start the shared pool of background threads"
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPool(MAX_WORKERS)
+    return _pool
+
+
+def _run(key, func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if key is not None:
+            with _lock:
+                _inflight.pop(key, None)
+
+
+def submit(key, func, *args, **kwargs):
+    """
+    Run `func` on the shared pool, returning an AsyncResult.
+
+    While a call is running, any other call submitted with the same
+    `key` gets the same AsyncResult instead of starting another one.
+    Pass a key of None to never share results.
+    """
+    if key is not None:
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+    pool = get_pool()
+    # Hold the lock until the result is registered, so _run can't
+    # unregister it before that
+    with _lock:
+        if key is not None and key in _inflight:
+            return _inflight[key]
+        result = pool.apply_async(_run, (key, func, args, kwargs))
+        if key is not None:
+            _inflight[key] = result
+    return result
+
+
+def bounded_map(func, items, max_workers=None):
+    """
+    Call `func` on every item on a pool of at most `max_workers` threads,
+    MAX_WORKERS by default, returning the results in order. A single item
+    is called in this thread instead.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return map(func, items)
+    pool = ThreadPool(min(len(items), max_workers or MAX_WORKERS))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+
+
+def call_key(cls, method, args, kwargs):
+    "Key identifying a read-only call, used to share identical calls"
+    return cls, method, args, tuple(sorted(kwargs.items()))
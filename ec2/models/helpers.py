@@ -8,6 +8,30 @@ ec2.models.helpers
 
 import re
 
+# Attributes that refer back to the API rather than describe the object,
+# or that are derived from the rest of it, like the folded tag names
+SNAPSHOT_EXCLUDE = frozenset(['connection', 'region', '_tag_names'])
+
+
+def snapshot(value, depth=4):
+    """
+    Reduce a boto object to comparable builtins, so two fetches of the
+    same object can be checked for changes.
+    """
+    if depth < 0:
+        return repr(value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, snapshot(v, depth - 1)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(snapshot(v, depth - 1) for v in value)
+    if hasattr(value, '__dict__'):
+        return tuple(sorted(
+            (k, snapshot(v, depth - 1))
+            for k, v in vars(value).items()
+            if k not in SNAPSHOT_EXCLUDE
+        ))
+    return value
+
 
 def make_compare(key, value, obj):
     "Map a key name to a specific comparison function"
@@ -100,7 +124,7 @@ class Compare(object):
             if hasattr(obj, 'tags'):
                 for tag in obj.tags:
                     if key == tag.lower():
-                        return value in obj.tags[tag]
+                        return value in obj.tags[tag].lower()
             # There is no tag found either
             return False
 
@@ -121,7 +145,7 @@ class Compare(object):
     def istartswith(key, value, obj):
         value = value.lower()
         try:
-            return getattr(obj, key).startswith(value)
+            return getattr(obj, key).lower().startswith(value)
         except AttributeError:
             # Fall back to checking tags
             if hasattr(obj, 'tags'):
@@ -148,7 +172,7 @@ class Compare(object):
     def iendswith(key, value, obj):
         value = value.lower()
         try:
-            return getattr(obj, key).endswith(value)
+            return getattr(obj, key).lower().endswith(value)
         except AttributeError:
             # Fall back to checking tags
             if hasattr(obj, 'tags'):
@@ -0,0 +1,359 @@
+"""
+ec2.models.indexes
+~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from bisect import bisect_left, bisect_right
+from random import Random
+
+from .columns import columns_for
+from .query import comparable, comparable_range
+from .records import attribute, is_loaded
+from .tags import fold_all, tag_value
+
+_missing = object()
+
+# Objects sampled to estimate how many objects a filter matches
+SAMPLE_SIZE = 100
+# Upper bound on the number of estimates kept for a list of objects
+MAX_ESTIMATES = 1024
+
+
+def _identity(value):
+    return value
+
+
+def _lower(value):
+    return value.lower()
+
+
+def _prefixable(value):
+    # Only things that can be `startswith`ed are worth a sorted index,
+    # anything else raises AttributeError just like the Predicate would
+    value.startswith
+    return value
+
+
+def resolve(obj, field, convert=_identity):
+    """
+    Resolve `field` on `obj` the same way a Predicate does, falling
+    back to a case insensitive tag lookup when the attribute is missing
+    or can't be converted.
+    """
+    value = attribute(obj, field, _missing)
+    if value is not _missing:
+        try:
+            return convert(value)
+        except AttributeError:
+            pass
+    value = tag_value(obj, field, _missing)
+    if value is _missing:
+        return _missing
+    try:
+        return convert(value)
+    except AttributeError:
+        return _missing
+
+
+class HashIndex(object):
+    "Map of value -> positions in the indexed list, for equality lookups"
+
+    def __init__(self, objects, field, convert=_identity):
+        self.usable = True
+        index = {}
+        for position, obj in enumerate(objects):
+            value = resolve(obj, field, convert)
+            if value is _missing:
+                continue
+            try:
+                index.setdefault(value, []).append(position)
+            except TypeError:
+                # Unhashable values can't be indexed, so this index
+                # can't answer for every object
+                self.usable = False
+                break
+        self.index = index
+
+    def lookup(self, value):
+        try:
+            return self.index.get(value, [])
+        except TypeError:
+            return None
+
+
+class SortedIndex(object):
+    "Sorted list of (value, position) pairs, for prefix lookups"
+
+    def __init__(self, objects, field, convert=_prefixable):
+        pairs = []
+        for position, obj in enumerate(objects):
+            value = resolve(obj, field, convert)
+            if value is not _missing:
+                pairs.append((value, position))
+        pairs.sort()
+        self.keys = [pair[0] for pair in pairs]
+        self.positions = [pair[1] for pair in pairs]
+
+    def prefix(self, prefix):
+        if not isinstance(prefix, basestring):
+            return None
+        keys = self.keys
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return sorted(self.positions[start:end])
+
+
+class RangeIndex(object):
+    """
+    Sorted list of (value, position) pairs, for ordering comparisons.
+    Values are converted like the comparison does, and left out when
+    they're None or can't be.
+    """
+
+    def __init__(self, objects, field, convert):
+        self.usable = True
+        pairs = []
+        for position, obj in enumerate(objects):
+            value = resolve(obj, field)
+            if value is _missing or value is None:
+                continue
+            try:
+                pairs.append((convert(value), position))
+            except (TypeError, ValueError):
+                continue
+        try:
+            pairs.sort()
+        except (TypeError, ValueError):
+            # Values that can't be ordered among themselves
+            self.usable = False
+        self.keys = [pair[0] for pair in pairs]
+        self.positions = [pair[1] for pair in pairs]
+
+    def between(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        "Positions of values between `low` and `high`, where None is unbounded"
+        keys = self.keys
+        try:
+            if low is None:
+                start = 0
+            elif low_inclusive:
+                start = bisect_left(keys, low)
+            else:
+                start = bisect_right(keys, low)
+            if high is None:
+                end = len(keys)
+            elif high_inclusive:
+                end = bisect_right(keys, high)
+            else:
+                end = bisect_left(keys, high)
+        except (TypeError, ValueError):
+            return None
+        return sorted(self.positions[start:end])
+
+
+class JoinIndex(object):
+    """
+    Map of value -> positions for joining on `attr`, which may also hold
+    a list of items, each joined on by its `key`
+    """
+
+    def __init__(self, objects, attr, key=None):
+        index = {}
+        for position, obj in enumerate(objects):
+            value = attribute(obj, attr)
+            if key is None:
+                values = (value,)
+            else:
+                values = [getattr(item, key, None) for item in value or ()]
+            for value in values:
+                if value is None:
+                    continue
+                try:
+                    index.setdefault(value, []).append(position)
+                except TypeError:
+                    # Can't be joined on
+                    continue
+        self.index = index
+
+    def lookup(self, values):
+        "Positions of the objects holding any of `values`"
+        matched = set()
+        for value in values:
+            try:
+                matched.update(self.index.get(value, ()))
+            except TypeError:
+                continue
+        return sorted(matched)
+
+
+class FieldIndex(object):
+    """
+    All of the indexes kept for a single field. The case insensitive
+    and sorted variants are only built the first time they're needed.
+    """
+
+    def __init__(self, objects, field):
+        self.objects = objects
+        self.field = field
+        self.exact = HashIndex(objects, field)
+        self._iexact = None
+        self._startswith = None
+        self._istartswith = None
+        # Conversion function -> RangeIndex
+        self._ranges = {}
+
+    def positions(self, comp, value):
+        "Return the positions matching a comparison, or None if unsupported"
+        if comp == 'exact':
+            if not self.exact.usable:
+                return None
+            return self.exact.lookup(value)
+        if comp == 'in':
+            return self._in(value)
+        if comp in ('gt', 'gte', 'lt', 'lte', 'range'):
+            return self._range(comp, value)
+        if not isinstance(value, basestring):
+            return None
+        if comp == 'iexact':
+            if self._iexact is None:
+                self._iexact = HashIndex(self.objects, self.field, _lower)
+            return self._iexact.lookup(value.lower())
+        if comp == 'startswith':
+            if self._startswith is None:
+                self._startswith = SortedIndex(self.objects, self.field)
+            return self._startswith.prefix(value)
+        if comp == 'istartswith':
+            if self._istartswith is None:
+                self._istartswith = SortedIndex(self.objects, self.field, lambda v: _prefixable(v).lower())
+            return self._istartswith.prefix(value.lower())
+        return None
+
+    def _in(self, values):
+        if not self.exact.usable:
+            return None
+        matched = set()
+        for value in values:
+            positions = self.exact.lookup(value)
+            if positions is None:
+                return None
+            matched.update(positions)
+        return sorted(matched)
+
+    def _range(self, comp, value):
+        if comp == 'range':
+            low, high, convert = comparable_range(value)
+        else:
+            value, convert = comparable(value)
+            low = high = None
+            if comp in ('gt', 'gte'):
+                low = value
+            else:
+                high = value
+        if convert is None or (low is None and high is None):
+            return None
+        index = self._ranges.get(convert)
+        if index is None:
+            index = self._ranges[convert] = RangeIndex(self.objects, self.field, convert)
+        if not index.usable:
+            return None
+        return index.between(low, high, comp != 'gt', comp != 'lt')
+
+
+class Statistics(object):
+    """
+    Estimates of the share of objects each predicate or expression
+    matches, from a sample of them, so queries can check
+    the ones ruling out the most objects first. Estimates are memoized,
+    and only last as long as the list of objects.
+    """
+
+    def __init__(self, objects, sample_size=SAMPLE_SIZE):
+        self.objects = objects
+        self.sample_size = sample_size
+        self._sample = None
+        self._estimates = {}
+
+    def sample(self):
+        if self._sample is None:
+            objects = self.objects
+            if len(objects) <= self.sample_size:
+                self._sample = list(objects)
+            else:
+                # Seeded, so plans don't change from one run to the next,
+                # and random, so regular patterns in ids or names don't
+                # skew the estimates
+                self._sample = Random(len(objects)).sample(objects, self.sample_size)
+        return self._sample
+
+    def selectivity(self, conjunct):
+        "Estimated share of objects matching `conjunct`, or None if it can't be sampled"
+        try:
+            return self._estimates[conjunct]
+        except KeyError:
+            pass
+        sample = self.sample()
+        estimate = None
+        # Sampling mustn't fetch full objects that a cheaper check would
+        # have ruled out
+        if sample and all(is_loaded(sample[0], field) for field in conjunct.fields()):
+            try:
+                matched = sum(1 for obj in sample if conjunct(obj))
+            except Exception:
+                # Leave raising to the real evaluation
+                pass
+            else:
+                estimate = float(matched) / len(sample)
+        if len(self._estimates) >= MAX_ESTIMATES:
+            self._estimates.clear()
+        self._estimates[conjunct] = estimate
+        return estimate
+
+
+class IndexSet(object):
+    """
+    Indexes over a list of cached objects, keyed by field name.
+
+    Fields may be attributes or tag names, resolved exactly like filters.
+    Every tag name is indexed too, case insensitively, the first time
+    it's filtered on. The tags of each object are folded once up front,
+    so neither the indexes nor filters have to search them again.
+    Every other field can be scanned through `columns`, when NumPy is
+    installed. `statistics` estimates how many objects filters match.
+    Relations to other managers are joined through `join()`.
+    """
+
+    def __init__(self, objects, fields, manager=None):
+        self.objects = objects
+        self.manager = manager
+        # (attr, key) -> JoinIndex, built the first time it's joined on
+        self._joins = {}
+        self.tag_names = fold_all(objects)
+        self.columns = columns_for(objects)
+        self.statistics = Statistics(objects)
+        self.fields = {}
+        for field in fields:
+            self.fields[field] = FieldIndex(objects, field)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def positions(self, field, comp, value):
+        try:
+            index = self.fields[field]
+        except KeyError:
+            if field not in self.tag_names:
+                return None
+            # Attributes still win over tags, since it resolves fields
+            # like filters do
+            index = self.fields.setdefault(field, FieldIndex(self.objects, field))
+        return index.positions(comp, value)
+
+    def join(self, attr, key=None):
+        "The JoinIndex on `attr`, or on the `key` of each item in it"
+        try:
+            return self._joins[attr, key]
+        except KeyError:
+            return self._joins.setdefault((attr, key), JoinIndex(self.objects, attr, key))
@@ -6,12 +6,38 @@ ec2.models.managers
 :license: BSD, see LICENSE for more details.
 """
 
+from boto.ec2.instance import Instance, Reservation
+from boto.ec2.securitygroup import SecurityGroup
+from boto.vpc.vpc import VPC
+
+from . import relations
 from .base import objects_base
-from ec2.connection import get_connection, get_vpc_connection
+from .relations import Embedded, ForeignKey, ManyToMany, Reverse
+from ec2 import metrics, ratelimit
+from ec2.connection import credentials, get_connection, get_vpc_connection
 
 
 class BaseManager(objects_base):
     """ """
+    @classmethod
+    def _connection(cls):
+        return get_connection(cls.REGION_NAME)
+
+    @classmethod
+    def _call(cls, action, *args, **kwargs):
+        "Call `action` on this manager's connection, paced by the rate limiter"
+        creds = credentials()
+        key = creds['aws_access_key_id'], cls.REGION_NAME or creds['region_name'], action
+        metrics.incr('api.calls', manager=cls.__name__, action=action)
+        started = metrics.start()
+        try:
+            return ratelimit.limiter.call(key, getattr(cls._connection(), action), *args, **kwargs)
+        except Exception:
+            metrics.incr('api.errors', manager=cls.__name__, action=action)
+            raise
+        finally:
+            metrics.stop(started, 'api.time', manager=cls.__name__, action=action)
+
     @classmethod
     def _all(cls, args, **kwargs):
         raise NotImplementedError("Coming Soon!")
@@ -24,58 +50,207 @@ class BaseManager(objects_base):
     def _delete(cls, args, **kwargs):
         raise NotImplementedError("Coming Soon!")
 
+    @classmethod
+    def _hydrate(cls, id):
+        "Fetch a single full object by id"
+        raise NotImplementedError("Coming Soon!")
+
 
 class InstanceManager(BaseManager):
     """ """
+    INDEXES = ('id', 'private_ip_address', 'ip_address', 'name', 'launch_time')
+    FILTERS = {
+        'id': 'instance-id',
+        'state': 'instance-state-name',
+        'instance_type': 'instance-type',
+        'image_id': 'image-id',
+        'vpc_id': 'vpc-id',
+        'subnet_id': 'subnet-id',
+        'key_name': 'key-name',
+        'placement': 'availability-zone',
+        'architecture': 'architecture',
+        'root_device_type': 'root-device-type',
+        'private_ip_address': 'private-ip-address',
+        'ip_address': 'ip-address',
+        'private_dns_name': 'private-dns-name',
+        'public_dns_name': 'dns-name',
+        'name': 'tag:Name',
+    }
+    # Number of instances to fetch per page when iterating
+    PAGE_SIZE = 1000
+    MODEL = Instance
+    LITE_FIELDS = (
+        'id', 'state', 'instance_type', 'placement', 'image_id', 'vpc_id',
+        'subnet_id', 'key_name', 'private_ip_address', 'ip_address',
+        'private_dns_name', 'public_dns_name', 'launch_time', 'groups', 'tags')
+    LITE_INTERN = ('state', 'instance_type', 'placement', 'image_id', 'vpc_id', 'subnet_id', 'key_name')
+    RELATIONS = {
+        'vpc': ForeignKey('vpc_id', 'VPCManager'),
+        'groups': ManyToMany('groups', 'SecurityGroupManager'),
+    }
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS instances"
-        reservations = get_connection().get_all_instances()
+        reservations = cls._call('get_all_instances', filters=filters)
         instances = [i for r in reservations for i in r.instances]
         return instances
 
+    @classmethod
+    def _iter_all(cls, filters=None):
+        "Page through AWS instances, yielding them as each page arrives"
+        next_token = None
+        while True:
+            reservations = cls._call(
+                'get_all_reservations', filters=filters, max_results=cls.PAGE_SIZE, next_token=next_token)
+            for reservation in reservations:
+                for instance in reservation.instances:
+                    yield instance
+            next_token = getattr(reservations, 'next_token', None)
+            if not next_token:
+                break
+
+    @classmethod
+    def _hydrate(cls, id):
+        instances = cls._call('get_only_instances', instance_ids=[id])
+        if not instances:
+            raise cls.DoesNotExist
+        return instances[0]
+
 
 class ReservationManager(BaseManager):
     """ """
+    INDEXES = ('id',)
+    FILTERS = {
+        'id': 'reservation-id',
+        'owner_id': 'owner-id',
+    }
+    MODEL = Reservation
+    # Add 'instances' to follow that relation from lite records, at the
+    # cost of keeping every full instance
+    LITE_FIELDS = ('id', 'owner_id', 'groups')
+    RELATIONS = {
+        'instances': Embedded('instances'),
+        'groups': ManyToMany('groups', 'SecurityGroupManager'),
+    }
 
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS reservations"
-        reservations = get_connection().get_all_reservations()
+        reservations = cls._call('get_all_reservations', filters=filters)
         return reservations
 
+    @classmethod
+    def _hydrate(cls, id):
+        reservations = cls._call('get_all_reservations', filters={'reservation-id': id})
+        if not reservations:
+            raise cls.DoesNotExist
+        return reservations[0]
+
 
 class SecurityGroupManager(BaseManager):
+    INDEXES = ('id', 'name')
+    FILTERS = {
+        'id': 'group-id',
+        'name': 'group-name',
+        'description': 'description',
+        'vpc_id': 'vpc-id',
+        'owner_id': 'owner-id',
+    }
+    MODEL = SecurityGroup
+    LITE_FIELDS = ('id', 'name', 'description', 'vpc_id', 'owner_id', 'tags')
+    LITE_INTERN = ('vpc_id', 'owner_id')
+    RELATIONS = {
+        'vpc': ForeignKey('vpc_id', 'VPCManager'),
+        'instances': Reverse('InstanceManager', 'groups', 'id'),
+    }
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS Security Groups"
-        return get_connection().get_all_security_groups()
+        return cls._call('get_all_security_groups', filters=filters)
+
+    @classmethod
+    def _hydrate(cls, id):
+        groups = cls._call('get_all_security_groups', group_ids=[id])
+        if not groups:
+            raise cls.DoesNotExist
+        return groups[0]
 
     @classmethod
     def _create(cls, name, description, vpc_id=None, dry_run=False):
-        return get_connection().create_security_group(
-            name, description, vpc_id=vpc_id, dry_run=dry_run)
+        return cls._call(
+            'create_security_group', name, description, vpc_id=vpc_id, dry_run=dry_run)
 
     @classmethod
     def _delete(cls, name=None, group_id=None, dry_run=False):
-        return get_connection().delete_security_group(
-            name=name, group_id=group_id, dry_run=dry_run)
+        return cls._call(
+            'delete_security_group', name=name, group_id=group_id, dry_run=dry_run)
+
+    @classmethod
+    def _deleted_ids(cls, name=None, group_id=None, dry_run=False):
+        if group_id is not None:
+            return [group_id]
+        # Names are only unique within a VPC
+        ids = [g.id for g in cls.__dict__.get('_cache', ()) if g.name == name]
+        if len(ids) != 1:
+            return None
+        return ids
 
 
 class VPCManager(BaseManager):
     """ """
+    INDEXES = ('id', 'cidr_block')
+    FILTERS = {
+        'id': 'vpc-id',
+        'cidr_block': 'cidr',
+        'state': 'state',
+        'dhcp_options_id': 'dhcp-options-id',
+        'name': 'tag:Name',
+    }
+    # EC2 only matches whole CIDR blocks, wildcards never match
+    FILTER_COMPARISONS = {
+        'cidr_block': ('exact',),
+    }
+    MODEL = VPC
+    LITE_FIELDS = ('id', 'cidr_block', 'state', 'is_default', 'instance_tenancy', 'dhcp_options_id', 'tags')
+    LITE_INTERN = ('state', 'instance_tenancy', 'dhcp_options_id')
+    RELATIONS = {
+        'instances': Reverse('InstanceManager', 'vpc_id'),
+        'security_groups': Reverse('SecurityGroupManager', 'vpc_id'),
+    }
+
+    @classmethod
+    def _connection(cls):
+        return get_vpc_connection(cls.REGION_NAME)
+
     @classmethod
-    def _all(cls):
+    def _all(cls, filters=None):
         "Grab all AWS Virtual Private Clouds"
-        return get_vpc_connection().get_all_vpcs()
+        return cls._call('get_all_vpcs', filters=filters)
 
     @classmethod
     def _create(cls, cidr_block, instance_tenancy=None, dry_run=False):
         "Create AWS Virtual Private Clouds"
-        return get_vpc_connection().create_vpc(
-            cidr_block, instance_tenancy=instance_tenancy, dry_run=dry_run)
+        return cls._call(
+            'create_vpc', cidr_block, instance_tenancy=instance_tenancy, dry_run=dry_run)
 
     @classmethod
     def _delete(cls, id, dry_run=False):
         "Delete AWS Virtual Private Clouds"
-        return get_vpc_connection().delete_vpc(id, dry_run=dry_run)
+        return cls._call('delete_vpc', id, dry_run=dry_run)
+
+    @classmethod
+    def _deleted_ids(cls, id, dry_run=False):
+        return [id]
+
+    @classmethod
+    def _hydrate(cls, id):
+        vpcs = cls._call('get_all_vpcs', vpc_ids=[id])
+        if not vpcs:
+            raise cls.DoesNotExist
+        return vpcs[0]
+
+
+for manager in (InstanceManager, ReservationManager, SecurityGroupManager, VPCManager):
+    relations.register(manager)
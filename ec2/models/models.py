@@ -11,6 +11,7 @@ from boto.ec2.instance import Instance as OrigInstance
 from boto.ec2.securitygroup import SecurityGroup as OrigSecurityGroup
 from boto.vpc.vpc import VPC as OrigVPC
 
+from . import relations
 from .managers import (
     InstanceManager,
     ReservationManager,
@@ -20,11 +21,29 @@ from .managers import (
 
 class DeleteMixin(object):
     def delete(self, *args, **kwargs):
-        self.objects.clear()
-        super(DeleteMixin, self).delete()
+        result = super(DeleteMixin, self).delete(*args, **kwargs)
+        # The cache of the region this came from
+        manager = relations.manager_for(self) or self.objects
+        if result:
+            manager._write(removed=[self.id])
+        else:
+            manager.clear()
+        return result
 
 
-class Instance(DeleteMixin, OrigInstance):
+class TagsMixin(object):
+    # add_tag() and remove_tag() go through these too
+    def add_tags(self, *args, **kwargs):
+        super(TagsMixin, self).add_tags(*args, **kwargs)
+        # Tags may have been swapped without the count changing
+        self._tag_names = None
+
+    def remove_tags(self, *args, **kwargs):
+        super(TagsMixin, self).remove_tags(*args, **kwargs)
+        self._tag_names = None
+
+
+class Instance(TagsMixin, DeleteMixin, OrigInstance):
     objects = InstanceManager()
 
 
@@ -32,9 +51,9 @@ class Reservation(DeleteMixin, OrigReservation):
     objects = ReservationManager()
 
 
-class SecurityGroup(DeleteMixin, OrigSecurityGroup):
+class SecurityGroup(TagsMixin, DeleteMixin, OrigSecurityGroup):
     objects = SecurityGroupManager()
 
 
-class VPC(DeleteMixin, OrigVPC):
+class VPC(TagsMixin, DeleteMixin, OrigVPC):
     objects = VPCManager()
@@ -0,0 +1,874 @@
+"""
+ec2.models.query
+~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import operator
+import re
+from datetime import date, datetime, time
+
+from . import columns, relations
+from .records import attribute
+from .tags import tag_value
+from ec2 import metrics
+
+_missing = object()
+
+# Cost of following a relation, on top of the comparison on the other side
+JOIN_COST = 5
+# Share of objects a filter is assumed to match when it can't be estimated
+DEFAULT_SELECTIVITY = 0.5
+# Upper bound on the number of compiled queries memoized by compile_filter()
+MAX_COMPILED_QUERIES = 256
+_compiled = {}
+
+# Most values EC2 accepts for one API filter. Longer `in` lists are
+# checked in Python instead.
+MAX_FILTER_VALUES = 200
+
+# Formats of the timestamps EC2 returns, like launch_time
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def _record(started, manager, scanned, matched):
+    "Record the metrics of evaluating a query, tagged with its `manager`"
+    tags = {} if manager is None else {'manager': manager.__name__}
+    metrics.stop(started, 'filter.time', **tags)
+    metrics.incr('filter.scanned', scanned, **tags)
+    metrics.incr('filter.matched', matched, **tags)
+
+
+def split_key(key):
+    "Split a `field__comparison` key into its field and comparison"
+    if '__' not in key:
+        # If no __ exists, default to doing an "exact" comparison
+        return key, 'exact'
+    field, comp = key.rsplit('__', 1)
+    if comp not in OPERATORS and key.split('__', 1)[0] in relations.NAMES:
+        # A field across a relation, like `vpc__state`
+        return key, 'exact'
+    return field, comp
+
+
+def _escape(value):
+    "Escape EC2 API filter wildcards"
+    for char in '\\*?':
+        value = value.replace(char, '\\' + char)
+    return value
+
+
+def _regex(value, flags=0):
+    if isinstance(value, basestring):
+        return re.compile(value, flags)
+    if flags and not value.flags & flags:
+        # Compiled patterns can't be recompiled with new flags
+        return re.compile(value.pattern, value.flags | flags)
+    return value
+
+
+def _exact(value):
+    return lambda v: v == value
+
+
+def _iexact(value):
+    value = value.lower()
+    return lambda v: v.lower() == value
+
+
+def _like(value):
+    value = _regex(value)
+    return lambda v: bool(value.match(v))
+
+
+def _ilike(value):
+    value = _regex(value, re.I)
+    return lambda v: bool(value.match(v))
+
+
+def _contains(value):
+    return lambda v: value in v
+
+
+def _icontains(value):
+    value = value.lower()
+    return lambda v: value in v.lower()
+
+
+def _startswith(value):
+    return lambda v: v.startswith(value)
+
+
+def _istartswith(value):
+    value = value.lower()
+    return lambda v: v.lower().startswith(value)
+
+
+def _endswith(value):
+    return lambda v: v.endswith(value)
+
+
+def _iendswith(value):
+    value = value.lower()
+    return lambda v: v.lower().endswith(value)
+
+
+def _isnull(value):
+    return lambda v: (v is None) == value
+
+
+def _in(values):
+    try:
+        values = frozenset(values)
+    except TypeError:
+        pass
+
+    def test(v):
+        try:
+            return v in values
+        except TypeError:
+            # Unhashable, so it can't be one of them
+            return False
+    return test
+
+
+def _utc(value):
+    "Naive UTC datetime for a datetime or date"
+    if not isinstance(value, datetime):
+        return datetime.combine(value, time())
+    offset = value.utcoffset()
+    if offset is not None:
+        value = (value - offset).replace(tzinfo=None)
+    return value
+
+
+def _to_datetime(value):
+    if isinstance(value, basestring):
+        for format in TIME_FORMATS:
+            try:
+                return datetime.strptime(value, format)
+            except ValueError:
+                pass
+        raise ValueError('Not a timestamp: %r' % (value,))
+    if isinstance(value, date):
+        return _utc(value)
+    raise TypeError(value)
+
+
+def _to_number(value):
+    if isinstance(value, basestring):
+        # Tags are always strings
+        return float(value)
+    if isinstance(value, (int, long, float)):
+        return value
+    raise TypeError(value)
+
+
+def _to_string(value):
+    if isinstance(value, basestring):
+        return value
+    raise TypeError(value)
+
+
+def comparable(value):
+    """
+    Prepare a filter value for ordering comparisons. Returns the value,
+    and a function converting the values it's compared with to the same
+    kind, raising TypeError or ValueError for those that can't be, or
+    None if there's no such kind.
+
+    Dates are compared as naive UTC datetimes, with timestamp strings
+    parsed, and numbers with numeric strings, like tags, converted.
+    """
+    if isinstance(value, date):
+        return _utc(value), _to_datetime
+    if isinstance(value, basestring):
+        return value, _to_string
+    if isinstance(value, (int, long, float)):
+        return value, _to_number
+    return value, None
+
+
+def _ordering(op):
+    def factory(value):
+        value, convert = comparable(value)
+
+        def test(v):
+            if v is None:
+                return False
+            try:
+                if convert is not None:
+                    v = convert(v)
+                return op(v, value)
+            except (TypeError, ValueError):
+                # Not comparable, so not a match
+                return False
+        return test
+    return factory
+
+
+def comparable_range(value):
+    """
+    Prepare a (low, high) range filter value like comparable(), returning
+    low, high and the function converting values to their kind. Both
+    bounds must be of the same kind, or they'd be compared across types.
+    """
+    low, high = value
+    low, convert = comparable(low)
+    high, high_convert = comparable(high)
+    if convert is not high_convert:
+        raise TypeError('Range bounds must be of the same kind, got %r and %r' % (low, high))
+    return low, high, convert
+
+
+def _range(value):
+    low, high, convert = comparable_range(value)
+
+    def test(v):
+        if v is None:
+            return False
+        try:
+            if convert is not None:
+                v = convert(v)
+            return low <= v <= high
+        except (TypeError, ValueError):
+            return False
+    return test
+
+
+# Mapping of comparison name -> function translating the filter value
+# into an EC2 API filter value, using its `*` wildcard
+PUSHDOWN = {
+    'exact': _escape,
+    'contains': lambda value: '*%s*' % _escape(value),
+    'startswith': lambda value: '%s*' % _escape(value),
+    'endswith': lambda value: '*%s' % _escape(value),
+    'in': lambda values: [_escape(value) for value in values],
+}
+
+# Mapping of comparison name -> factory building a one argument test
+# from the filter value. Mirrors the methods on `helpers.Compare`, and
+# adds membership and ordering comparisons.
+OPERATORS = {
+    'exact': _exact,
+    'iexact': _iexact,
+    'like': _like,
+    'regex': _like,
+    'ilike': _ilike,
+    'iregex': _ilike,
+    'contains': _contains,
+    'icontains': _icontains,
+    'startswith': _startswith,
+    'istartswith': _istartswith,
+    'endswith': _endswith,
+    'iendswith': _iendswith,
+    'isnull': _isnull,
+    'in': _in,
+    'gt': _ordering(operator.gt),
+    'gte': _ordering(operator.ge),
+    'lt': _ordering(operator.lt),
+    'lte': _ordering(operator.le),
+    'range': _range,
+}
+
+# Rough relative cost of evaluating each comparison on one object, so
+# the cheap ones are checked first and can short circuit the rest
+COSTS = {
+    'exact': 1,
+    'isnull': 1,
+    'in': 1,
+    'iexact': 2,
+    'gt': 2,
+    'gte': 2,
+    'lt': 2,
+    'lte': 2,
+    'range': 2,
+    'startswith': 2,
+    'endswith': 2,
+    'istartswith': 3,
+    'iendswith': 3,
+    'contains': 3,
+    'icontains': 4,
+    'like': 10,
+    'regex': 10,
+    'ilike': 10,
+    'iregex': 10,
+}
+
+
+def _cost(node):
+    return node.cost
+
+
+def rank(cost, selectivity):
+    """
+    Expected work spent per object ruled out, when a check costing `cost`
+    matches a `selectivity` share of objects. Checking in ascending rank
+    does the least work overall.
+    """
+    return cost / max(1.0 - selectivity, 1e-6)
+
+
+class Predicate(object):
+    """
+    A single compiled `key=value` filter.
+
+    The comparison is resolved and its value prepared (lowered, regex
+    compiled) once, so evaluating it against an object is just an
+    attribute lookup, with a fall back to the object's tags.
+
+    Fields starting with the name of a relation, like `vpc__cidr_block`,
+    are compared on the related objects instead, and match if any of
+    them does.
+    """
+
+    def __init__(self, key, value):
+        self.key = key
+        self.field, self.comp = split_key(key)
+        try:
+            factory = OPERATORS[self.comp]
+        except KeyError:
+            raise AttributeError("No comparison '%s'" % self.comp)
+        if self.comp == 'in':
+            if isinstance(value, basestring):
+                # Would be taken apart into its characters
+                raise TypeError("'in' takes a list of values, not a string: %r" % (value,))
+            # Could be a generator, and is needed more than once
+            value = tuple(value)
+        self.value = value
+        self.cost = COSTS[self.comp]
+        self.related = None
+        name, _, rest = self.field.partition('__')
+        if rest and name in relations.NAMES:
+            predicate = Predicate('%s__%s' % (rest, self.comp), value)
+            self.related = name, predicate
+            self.cost = predicate.cost + JOIN_COST
+        self.test = factory(value)
+        if self.comp == 'isnull':
+            # A missing tag is null, a present one only matches isnull=True
+            # when it's None. Same as `Compare.isnull`.
+            self.tag_test = lambda v: (v is None) and value
+            self.missing = value
+        else:
+            self.tag_test = self.test
+            self.missing = False
+
+    def __repr__(self):
+        return '<Predicate: %s=%r>' % (self.key, self.value)
+
+    def pushdown(self):
+        "Return this comparison as an EC2 API filter value, or None if it can't be"
+        if self.comp not in PUSHDOWN:
+            return None
+        if self.comp == 'in':
+            # EC2 OR's a list of values together, up to a limit
+            if not self.value or len(self.value) > MAX_FILTER_VALUES:
+                return None
+            if not all(isinstance(v, basestring) for v in self.value):
+                return None
+        elif not isinstance(self.value, basestring):
+            return None
+        return PUSHDOWN[self.comp](self.value)
+
+    def __call__(self, obj):
+        if self.related is not None:
+            name, predicate = self.related
+            objects = relations.follow(obj, name)
+            if not objects:
+                return predicate.missing
+            for related in objects:
+                if predicate(related):
+                    return True
+            return False
+        field = self.field
+        value = attribute(obj, field, _missing)
+        if value is not _missing:
+            try:
+                return self.test(value)
+            except AttributeError:
+                pass
+        # Fall back to checking tags
+        value = tag_value(obj, field, _missing)
+        if value is not _missing:
+            return self.tag_test(value)
+        # There is no tag found either
+        return self.missing
+
+    def fields(self):
+        if self.related is not None:
+            return set([self.related[0]])
+        return set([self.field])
+
+    def candidates(self, indexes):
+        "Positions of exactly the objects matching, or None if no index can tell"
+        if self.related is None:
+            return indexes.positions(self.field, self.comp, self.value)
+        name, predicate = self.related
+        manager = indexes.manager
+        # Objects without related objects only match when a missing
+        # value does
+        if manager is None or name not in manager.RELATIONS or predicate.missing:
+            return None
+        return manager.RELATIONS[name].candidates(indexes, manager, predicate)
+
+    def mask(self, columns):
+        "Boolean array of the objects in a `ColumnSet` matching, or None if unsupported"
+        if self.related is not None:
+            return None
+        return columns.match(self)
+
+
+class All(object):
+    "Expression matching when all of its children do, checking the cheapest first"
+
+    def __init__(self, children):
+        self.children = tuple(sorted(children, key=_cost))
+        self.cost = sum(child.cost for child in self.children)
+
+    def __repr__(self):
+        return '(%s)' % ' & '.join(map(repr, self.children))
+
+    def __call__(self, obj):
+        for child in self.children:
+            if not child(obj):
+                return False
+        return True
+
+    def fields(self):
+        return set().union(*[child.fields() for child in self.children])
+
+    def candidates(self, indexes):
+        "Positions of at least every object matching, or None if no index can tell"
+        best = None
+        for child in self.children:
+            positions = child.candidates(indexes)
+            if positions is not None and (best is None or len(positions) < len(best)):
+                best = positions
+        return best
+
+    def mask(self, columns):
+        mask = None
+        for child in self.children:
+            matched = child.mask(columns)
+            if matched is None:
+                return None
+            mask = matched if mask is None else mask & matched
+        return mask
+
+
+class Any(object):
+    "Expression matching when any of its children do, checking the cheapest first"
+
+    def __init__(self, children):
+        self.children = tuple(sorted(children, key=_cost))
+        self.cost = sum(child.cost for child in self.children)
+
+    def __repr__(self):
+        return '(%s)' % ' | '.join(map(repr, self.children))
+
+    def __call__(self, obj):
+        for child in self.children:
+            if child(obj):
+                return True
+        return False
+
+    def fields(self):
+        return set().union(*[child.fields() for child in self.children])
+
+    def candidates(self, indexes):
+        "Positions of at least every object matching, or None if no index can tell"
+        matched = set()
+        for child in self.children:
+            positions = child.candidates(indexes)
+            if positions is None:
+                return None
+            matched.update(positions)
+        return sorted(matched)
+
+    def mask(self, columns):
+        mask = None
+        for child in self.children:
+            matched = child.mask(columns)
+            if matched is None:
+                return None
+            mask = matched if mask is None else mask | matched
+        return mask
+
+
+class Not(object):
+    "Expression matching when its child doesn't"
+
+    def __init__(self, child):
+        self.child = child
+        self.cost = child.cost
+
+    def __repr__(self):
+        return '~%r' % (self.child,)
+
+    def __call__(self, obj):
+        return not self.child(obj)
+
+    def fields(self):
+        return self.child.fields()
+
+    def candidates(self, indexes):
+        return None
+
+    def mask(self, columns):
+        matched = self.child.mask(columns)
+        if matched is None:
+            return None
+        return ~matched
+
+
+class Q(object):
+    """
+    Filters that can be combined with `|` (or), `&` (and) and negated
+    with `~`, then passed to filter(), exclude(), get() and so on. The
+    kwargs of a single Q all have to match, like they do in filter().
+
+    >>> from ec2.models import Q
+    >>> ec2.instances.filter(Q(name__startswith='web') | Q(name__startswith='api'), ~Q(state='terminated'))
+    [ ... ]
+    """
+
+    AND = 'AND'
+    OR = 'OR'
+
+    def __init__(self, *args, **kwargs):
+        for arg in args:
+            if not isinstance(arg, Q):
+                raise TypeError('Expected a Q, got %r' % (arg,))
+        self.connector = Q.AND
+        self.negated = False
+        self.children = list(args) + sorted(kwargs.items())
+
+    def _combine(self, other, connector):
+        if not isinstance(other, Q):
+            raise TypeError('Expected a Q, got %r' % (other,))
+        # An empty Q doesn't filter anything
+        if not other.children:
+            return self
+        if not self.children:
+            return other
+        q = Q()
+        q.connector = connector
+        q.children = [self, other]
+        return q
+
+    def __or__(self, other):
+        return self._combine(other, Q.OR)
+
+    def __and__(self, other):
+        return self._combine(other, Q.AND)
+
+    def __invert__(self):
+        q = Q(self)
+        q.negated = True
+        return q
+
+    def _key(self):
+        return self.connector, self.negated, tuple(
+            child._key() if isinstance(child, Q) else child for child in self.children)
+
+    def __eq__(self, other):
+        return isinstance(other, Q) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return '<Q: %r>' % (self.compile(),)
+
+    def conjuncts(self):
+        """
+        Split this into things that must all match: Predicates for plain
+        `key=value` filters, so they can be pushed down and indexed like
+        kwargs to filter(), and expressions for everything else
+        """
+        if self.negated or self.connector != Q.AND:
+            return [self.compile()]
+        conjuncts = []
+        for child in self.children:
+            if isinstance(child, Q):
+                conjuncts.extend(child.conjuncts())
+            else:
+                conjuncts.append(Predicate(*child))
+        return conjuncts
+
+    def compile(self):
+        "Compile into a tree of Predicates and All, Any and Not expressions"
+        children = [
+            child.compile() if isinstance(child, Q) else Predicate(*child)
+            for child in self.children]
+        if len(children) == 1:
+            node = children[0]
+        elif self.connector == Q.AND:
+            node = All(children)
+        else:
+            node = Any(children)
+        if self.negated:
+            node = Not(node)
+        return node
+
+
+class Query(object):
+    """
+    A compiled, reusable set of filters. All predicates must match, as
+    well as any `Q` expressions passed in.
+
+    Everything is evaluated in a single pass, checking the cheapest
+    comparisons first.
+
+    >>> running = ec2.models.Query(state='running')
+    >>> ec2.instances.filter(running)
+    [ ... ]
+    """
+
+    def __init__(self, *qs, **kwargs):
+        self.qs = qs
+        predicates = [Predicate(key, kwargs[key]) for key in sorted(kwargs)]
+        # Normalized values, so an `in` generator isn't used up when this
+        # is merged into another query
+        self.kwargs = dict((p.key, p.value) for p in predicates)
+        expressions = []
+        for q in qs:
+            if not isinstance(q, Q):
+                raise TypeError('Expected a Q, got %r' % (q,))
+            for conjunct in q.conjuncts():
+                if isinstance(conjunct, Predicate):
+                    predicates.append(conjunct)
+                else:
+                    expressions.append(conjunct)
+        self.predicates = tuple(predicates)
+        self.expressions = tuple(expressions)
+        self.conjuncts = tuple(sorted(self.predicates + self.expressions, key=_cost))
+
+    def __repr__(self):
+        return '<Query: %s>' % ', '.join(
+            ['%s=%r' % (p.key, p.value) for p in self.predicates] + map(repr, self.expressions))
+
+    def __call__(self, obj):
+        for conjunct in self.conjuncts:
+            if not conjunct(obj):
+                return False
+        return True
+
+    def pushdown(self, mapping, comparisons=None):
+        """
+        Translate predicates into EC2 API filters
+
+        `mapping` is a dict of field name -> API filter name, and
+        `comparisons` an optional dict of field name -> the comparisons its
+        API filter supports, for filters that don't take wildcards. Fields
+        not in it may use any comparison. Predicates
+        that can't be expressed as an API filter are left out, as is any
+        second predicate on the same API filter, since multiple values
+        are OR'ed together by EC2. All predicates still need to be checked
+        against the returned objects.
+
+        >>> Query(state='running', name__startswith='web').pushdown(InstanceManager.FILTERS)
+        {'instance-state-name': 'running', 'tag:Name': 'web*'}
+        """
+        filters = {}
+        for predicate in self.predicates:
+            name = mapping.get(predicate.field)
+            if name is None or name in filters:
+                continue
+            if comparisons and predicate.comp not in comparisons.get(predicate.field, PUSHDOWN):
+                continue
+            value = predicate.pushdown()
+            if value is not None:
+                filters[name] = value
+        return filters
+
+    def _plan(self, objects, indexes):
+        """
+        Return the objects worth checking, the predicates and expressions
+        to check them with, the one answered from an index, if any, and
+        the selectivity of those the indexes could tell.
+
+        If an `IndexSet` built over `objects` is passed, the most selective
+        indexed predicate or expression is answered from it, and only the
+        candidates it returns need checking, against all of them. Those are
+        then ordered by their rank, from how many objects the indexes or
+        the cache's statistics say they match, so the ones ruling out the
+        most objects for the least work are checked first.
+        """
+        conjuncts = self.conjuncts
+        indexed = None
+        estimates = {}
+        if indexes is not None and indexes.objects is objects:
+            best = None
+            total = float(len(objects)) or 1.0
+            for conjunct in conjuncts:
+                positions = conjunct.candidates(indexes)
+                if positions is None:
+                    continue
+                if isinstance(conjunct, Predicate):
+                    estimates[conjunct] = len(positions) / total
+                if best is None or len(positions) < len(best[1]):
+                    best = conjunct, positions
+            if best is not None:
+                indexed = best[0]
+                if len(best[1]) < len(objects):
+                    objects = [objects[i] for i in best[1]]
+                # Still checked against the candidates, which may have
+                # changed in place since they were indexed
+            if len(conjuncts) > 1 and len(objects) > indexes.statistics.sample_size:
+                conjuncts = self._order(conjuncts, indexes.statistics, estimates)
+        return objects, conjuncts, indexed, estimates
+
+    def _estimate(self, conjunct, statistics, estimates):
+        "Return the share of objects `conjunct` matches, and where that came from"
+        if conjunct in estimates:
+            return estimates[conjunct], 'index'
+        selectivity = statistics.selectivity(conjunct)
+        if selectivity is None:
+            return DEFAULT_SELECTIVITY, 'default'
+        return selectivity, 'sample'
+
+    def _order(self, conjuncts, statistics, estimates):
+        def key(conjunct):
+            return rank(conjunct.cost, self._estimate(conjunct, statistics, estimates)[0])
+        return tuple(sorted(conjuncts, key=key))
+
+    def _vectorize(self, objects, candidates, conjuncts, indexes):
+        "Whether the conjuncts are best checked as columns"
+        return (
+            conjuncts and candidates is objects and indexes is not None and
+            indexes.objects is objects and indexes.columns is not None and
+            len(objects) >= columns.MIN_OBJECTS)
+
+    def filter(self, objects, indexes=None, manager=None):
+        """
+        Return a list of all objects matching this query
+
+        Large lists that no index narrowed down are scanned as columns
+        instead of object by object, if the indexes have any. Metrics are
+        tagged with `manager`, and count the candidates left to check
+        after any index narrowed them down as scanned.
+        """
+        started = metrics.start()
+        candidates, conjuncts, _, _ = self._plan(objects, indexes)
+        matched = self._filter(objects, candidates, conjuncts, indexes)
+        if started is not None:
+            _record(started, manager, len(candidates), len(matched))
+        return matched
+
+    def _filter(self, objects, candidates, conjuncts, indexes):
+        if self._vectorize(objects, candidates, conjuncts, indexes):
+            matched = indexes.columns.filter(conjuncts)
+            if matched is not None:
+                return matched
+        if not conjuncts:
+            return list(candidates)
+        if len(conjuncts) == 1:
+            return [obj for obj in candidates if conjuncts[0](obj)]
+        return [obj for obj in candidates if all(c(obj) for c in conjuncts)]
+
+    def iterate(self, objects, indexes=None, manager=None):
+        """
+        Lazily yield the objects matching this query, so callers can stop
+        early. `objects` may be any iterable, including a generator. Like
+        filter(), records metrics, once iteration stops.
+        """
+        started = metrics.start()
+        objects, conjuncts, _, _ = self._plan(objects, indexes)
+        if started is None:
+            return (obj for obj in objects if all(c(obj) for c in conjuncts))
+        return self._iterate(objects, conjuncts, started, manager)
+
+    def _iterate(self, objects, conjuncts, started, manager):
+        scanned = matched = 0
+        try:
+            for obj in objects:
+                scanned += 1
+                if all(c(obj) for c in conjuncts):
+                    matched += 1
+                    yield obj
+        finally:
+            _record(started, manager, scanned, matched)
+
+    def explain(self, objects, indexes=None):
+        """
+        Describe how filter() evaluates this query against `objects`, as
+        a list of lines: the index used, if any, and each remaining check
+        in the order it's made, with its cost and estimated selectivity.
+        """
+        candidates, conjuncts, indexed, estimates = self._plan(objects, indexes)
+        lines = []
+        if indexed is not None:
+            lines.append('index: %r -> %d of %d objects' % (indexed, len(candidates), len(objects)))
+        if not conjuncts:
+            return lines
+        if self._vectorize(objects, candidates, conjuncts, indexes):
+            lines.append('scan: columns, %d objects' % len(candidates))
+        else:
+            lines.append('scan: row by row, %d objects' % len(candidates))
+        statistics = None
+        if indexes is not None and indexes.objects is objects:
+            statistics = indexes.statistics
+        for n, conjunct in enumerate(conjuncts):
+            if statistics is None:
+                lines.append('  %d. %r cost=%d' % (n + 1, conjunct, conjunct.cost))
+                continue
+            selectivity, source = self._estimate(conjunct, statistics, estimates)
+            lines.append('  %d. %r cost=%d selectivity=%.2f (%s)' % (n + 1, conjunct, conjunct.cost, selectivity, source))
+        return lines
+
+
+def _merge(merged, qs, kwargs):
+    "Merge `kwargs` into `merged`, AND'ing any colliding filter in as a Q"
+    for key, value in kwargs.items():
+        if key not in merged:
+            merged[key] = value
+        elif merged[key] is not value and merged[key] != value:
+            qs.append(Q(**{key: value}))
+
+
+def compile_filter(*queries, **kwargs):
+    """
+    Compile filter kwargs into a Query, merging any passed in Query and
+    Q objects. Filters on the same key with different values must all
+    match, like when chaining filter() calls.
+
+    Compiled queries are memoized when their values are hashable.
+
+    >>> q = ec2.models.compile_filter(name__startswith='production')
+    >>> q = ec2.models.compile_filter(Q(state='running') | Q(state='pending'))
+    """
+    if len(queries) == 1 and not kwargs and isinstance(queries[0], Query):
+        return queries[0]
+    merged = {}
+    qs = []
+    for query in queries:
+        if isinstance(query, Q):
+            qs.append(query)
+        elif isinstance(query, Query):
+            _merge(merged, qs, query.kwargs)
+            qs.extend(query.qs)
+        else:
+            raise TypeError('Expected a Query or Q, got %r' % (query,))
+    _merge(merged, qs, kwargs)
+    kwargs = merged
+    qs = tuple(qs)
+
+    try:
+        key = frozenset(kwargs.items()), qs
+        hash(key)
+    except TypeError:
+        return Query(*qs, **kwargs)
+    try:
+        return _compiled[key]
+    except KeyError:
+        pass
+    if len(_compiled) >= MAX_COMPILED_QUERIES:
+        _compiled.clear()
+    query = _compiled[key] = Query(*qs, **kwargs)
+    return query
@@ -0,0 +1,303 @@
+"""
+ec2.models.queryset
+~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from itertools import islice
+
+from . import relations
+from .indexes import _missing, resolve
+from .query import compile_filter
+
+
+def _value(obj, field):
+    "Look up `field` on `obj` like a filter would, None if it's missing"
+    value = resolve(obj, field)
+    if value is _missing:
+        return None
+    return value
+
+
+class QuerySet(object):
+    """
+    A lazy, chainable query against a manager's objects.
+
+    Nothing is evaluated until the results are needed, by iterating,
+    len(), indexing and so on, and then only once; the results are
+    memoized. Chaining returns a new QuerySet, and filtering or sorting
+    one that's already been evaluated works on its results instead of
+    running the whole query again.
+
+    >>> running = ec2.instances.filter(state='running')
+    >>> running.filter(name__startswith='web').exclude(instance_type='t1.micro').order_by('-launch_time')[:5]
+    [ ... ]
+    """
+
+    def __init__(self, manager, queries=(), excludes=(), ordering=(), limits=(None, None), prefetch=(), source=None):
+        self.manager = manager
+        # Objects to start from instead of the manager's, see _narrow()
+        self.source = source
+        self.queries = queries
+        self.excludes = excludes
+        self.ordering = ordering
+        self.limits = limits
+        self.prefetch = prefetch
+        self._result = None
+
+    def _clone(self, **kwargs):
+        kwargs.setdefault('queries', self.queries)
+        kwargs.setdefault('excludes', self.excludes)
+        kwargs.setdefault('ordering', self.ordering)
+        kwargs.setdefault('limits', self.limits)
+        kwargs.setdefault('prefetch', self.prefetch)
+        kwargs.setdefault('source', self.source)
+        return self.__class__(self.manager, **kwargs)
+
+    def _narrow(self, **kwargs):
+        """
+        A new QuerySet starting from the memoized results, which are
+        already filtered, sorted and prefetched
+        """
+        for name in ('queries', 'excludes', 'ordering', 'prefetch'):
+            kwargs.setdefault(name, ())
+        return self._clone(source=self._result, **kwargs)
+
+    def _check_limits(self, action):
+        if self.limits != (None, None):
+            raise TypeError('Cannot %s a query once a slice has been taken' % action)
+
+    def filter(self, *args, **kwargs):
+        "Return a new QuerySet also matching these filters"
+        self._check_limits('filter')
+        query = compile_filter(*args, **kwargs)
+        if self._result is not None:
+            return self._narrow(queries=(query,))
+        queries = self.queries
+        if queries and not set(queries[-1].kwargs) & set(query.kwargs):
+            # Evaluate as one query when they don't overlap, so all the
+            # filters can be pushed down or answered from indexes
+            queries = queries[:-1] + (compile_filter(queries[-1], query),)
+        else:
+            queries = queries + (query,)
+        return self._clone(queries=queries)
+
+    def exclude(self, *args, **kwargs):
+        "Return a new QuerySet leaving out objects matching all of these filters"
+        self._check_limits('exclude')
+        if self._result is not None:
+            return self._narrow(excludes=(compile_filter(*args, **kwargs),))
+        return self._clone(excludes=self.excludes + (compile_filter(*args, **kwargs),))
+
+    def order_by(self, *fields):
+        """
+        Return a new QuerySet sorted by `fields`, which may be attributes
+        or tags. Prefix a field with `-` to sort it in descending order.
+        """
+        self._check_limits('order')
+        if self._result is not None:
+            return self._narrow(ordering=fields)
+        return self._clone(ordering=fields)
+
+    def prefetch_related(self, *lookups):
+        """
+        Return a new QuerySet that fetches the objects related to its
+        results through `lookups` along with them, one describe call per
+        related manager, so following those relations is only a lookup in
+        a hash map afterwards. Lookups may span relations.
+
+        >>> web = ec2.instances.filter(name__startswith='web').prefetch_related('vpc', 'groups__vpc')
+        >>> [related(i, 'vpc').cidr_block for i in web]
+        ['10.10.0.0/16', ...]
+        """
+        return self._clone(prefetch=self.prefetch + lookups)
+
+    def _iterate(self):
+        "Lazily yield every match, ignoring ordering and slicing"
+        manager = self.manager
+        queries, excludes = self.queries, self.excludes
+        if self.source is not None:
+            objects = iter(self.source)
+        elif queries:
+            objects = queries[0].iterate(*manager._source(queries[0]), manager=manager)
+            queries = queries[1:]
+        else:
+            objects = iter(manager.all())
+        for obj in objects:
+            if all(q(obj) for q in queries) and not any(q(obj) for q in excludes):
+                yield obj
+
+    def _match(self):
+        "Return a list of every match, ignoring ordering and slicing"
+        queries, excludes = self.queries, self.excludes
+        if self.source is not None:
+            objects = list(self.source)
+        elif queries:
+            source, indexes = self.manager._source(queries[0])
+            objects = queries[0].filter(source, indexes, self.manager)
+            queries = queries[1:]
+        else:
+            objects = list(self.manager.all())
+        for query in queries:
+            objects = [obj for obj in objects if query(obj)]
+        for query in excludes:
+            objects = [obj for obj in objects if not query(obj)]
+        return objects
+
+    def _sort(self, objects):
+        # Sort by the least significant field first, relying on sorts
+        # being stable
+        for field in reversed(self.ordering):
+            reverse = field.startswith('-')
+            field = field.lstrip('-')
+            objects.sort(key=lambda obj: _value(obj, field), reverse=reverse)
+        return objects
+
+    def _fetch_all(self):
+        if self._result is None:
+            low, high = self.limits
+            if self.ordering:
+                result = self._sort(self._match())[low:high]
+            elif low is None and high is None:
+                result = self._match()
+            else:
+                result = list(islice(self._iterate(), low or 0, high))
+            if self.prefetch:
+                relations.prefetch(result, self.prefetch)
+            self._result = result
+        return self._result
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __nonzero__(self):
+        return bool(self._fetch_all())
+
+    def __contains__(self, obj):
+        return obj in self._fetch_all()
+
+    def __eq__(self, other):
+        if isinstance(other, QuerySet):
+            other = other._fetch_all()
+        return self._fetch_all() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._fetch_all())
+
+    def __getitem__(self, k):
+        """
+        Index into the results, or take a slice. Slices of a QuerySet that
+        hasn't been evaluated stay lazy, and only fetch what they need.
+        """
+        if self._result is not None or not isinstance(k, slice) or k.step is not None:
+            return self._fetch_all()[k]
+        if (k.start or 0) < 0 or (k.stop or 0) < 0:
+            raise ValueError('Negative indexing is not supported')
+        low, high = self.limits
+        start = (low or 0) + (k.start or 0)
+        if k.stop is None:
+            stop = high
+        else:
+            stop = (low or 0) + k.stop
+            if high is not None:
+                stop = min(stop, high)
+        return self._clone(limits=(start or None, stop))
+
+    def count(self):
+        "Number of matches, without keeping them around"
+        if self._result is not None:
+            return len(self._result)
+        low, high = self.limits
+        if low is None and high is None:
+            return len(self._match())
+        return sum(1 for _ in islice(self._iterate(), low or 0, high))
+
+    def exists(self):
+        "Whether anything matches, stopping at the first match"
+        if self._result is not None:
+            return bool(self._result)
+        return self.first() is not None
+
+    def first(self):
+        "Return the first match, or None"
+        if self._result is not None or self.ordering:
+            result = self._fetch_all()
+            return result[0] if result else None
+        for obj in islice(self._iterate(), self.limits[0] or 0, self.limits[1]):
+            return obj
+        return None
+
+    def explain(self):
+        """
+        Describe how this QuerySet is evaluated: where the objects come
+        from, the index used, and the order filters are checked in, with
+        their estimated selectivity. For debugging slow filters.
+
+        >>> print ec2.instances.filter(state='running', name__ilike='^web').explain()
+        source: cache, 5000 objects
+        filter: <Query: name__ilike='^web', state='running'>
+          scan: columns, 5000 objects
+            1. <Predicate: state='running'> cost=1 selectivity=0.30 (sample)
+            2. <Predicate: name__ilike='^web'> cost=10 selectivity=0.10 (sample)
+        """
+        manager = self.manager
+        queries = self.queries
+        lines = []
+        if self.source is not None:
+            lines.append('source: earlier results, %d objects' % len(self.source))
+            for query in queries:
+                lines.append('filter: %r' % (query,))
+        elif queries:
+            source, indexes = manager._source(queries[0])
+            if indexes is None:
+                lines.append('source: API, filters %r, %d objects' % (queries[0].pushdown(manager.FILTERS, manager.FILTER_COMPARISONS), len(source)))
+            else:
+                lines.append('source: cache, %d objects' % len(source))
+            lines.append('filter: %r' % (queries[0],))
+            lines.extend('  ' + line for line in queries[0].explain(source, indexes))
+            for query in queries[1:]:
+                lines.append('filter: %r' % (query,))
+        else:
+            lines.append('source: cache, %d objects' % len(manager.all()))
+        for query in self.excludes:
+            lines.append('exclude: %r' % (query,))
+        if self.ordering:
+            lines.append('order by: %s' % ', '.join(self.ordering))
+        low, high = self.limits
+        if low is not None or high is not None:
+            lines.append('slice: [%s:%s]' % (low or '', '' if high is None else high))
+        return '\n'.join(lines)
+
+    def values(self, *fields):
+        """
+        Return a dict of `fields` for each match
+
+        >>> ec2.instances.filter(state='running').values('id', 'name')
+        [{'id': 'i-abc0', 'name': 'production-web-01'}, ...]
+        """
+        return [dict((field, _value(obj, field)) for field in fields) for obj in self]
+
+    def values_list(self, *fields, **kwargs):
+        """
+        Return a tuple of `fields` for each match, or just the value
+        when `flat=True` is passed with a single field
+
+        >>> ec2.instances.filter(state='running').values_list('id', flat=True)
+        ['i-abc0', ...]
+        """
+        flat = kwargs.pop('flat', False)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments to values_list: %s' % ', '.join(kwargs))
+        if flat:
+            if len(fields) != 1:
+                raise TypeError('flat=True only works with a single field')
+            return [_value(obj, fields[0]) for obj in self]
+        return [tuple(_value(obj, field) for field in fields) for obj in self]
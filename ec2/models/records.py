@@ -0,0 +1,130 @@
+"""
+ec2.models.records
+~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from .helpers import snapshot
+
+# Pool of strings shared between records, see _intern()
+_strings = {}
+# boto class -> names a fresh instance of it has
+_model_names = {}
+
+
+def _intern(value):
+    "Share one copy of repetitive strings like states and tag keys"
+    if isinstance(value, basestring):
+        return _strings.setdefault(value, value)
+    return value
+
+
+def _names(model):
+    "Attribute names of `model`, including the ones only set by __init__"
+    try:
+        return _model_names[model]
+    except KeyError:
+        names = _model_names[model] = frozenset(dir(model()))
+        return names
+
+
+def is_loaded(obj, name):
+    "Whether looking `name` up on `obj` is free, rather than fetching the full object"
+    if not isinstance(obj, Record) or obj._full is not None or name in obj._fields:
+        return True
+    return obj._manager is None or name not in _names(obj._manager.MODEL)
+
+
+class NotLoaded(Exception):
+    "A filter needed a field that lite records don't keep"
+
+
+def attribute(obj, name, default=None):
+    """
+    getattr() for filters. They never fetch the full object behind a lite
+    record, which would be an API call per record, so fields it doesn't
+    keep raise NotLoaded instead.
+    """
+    if not is_loaded(obj, name):
+        raise NotLoaded("'%s' is not in %s.LITE_FIELDS, so lite records can't be filtered on it" % (
+            name, obj._manager.__name__))
+    return getattr(obj, name, default)
+
+
+class Record(object):
+    """
+    Compact, read-only stand-in for a cached boto object.
+
+    Only keeps the fields a manager lists in LITE_FIELDS, as a tuple of
+    values, and no connection. Filters work on those fields and tags like
+    they would on the boto object. Anything else that the boto object has,
+    like terminate() or update(), loads the full object from the API
+    the first time it's needed. See hydrate(). Filters never do that.
+    The only thing that can be set on a record is `region_name`, which
+    RegionSet tags everything with.
+    """
+
+    __slots__ = ('_fields', '_values', '_manager', '_full', '_tag_names', 'region_name')
+
+    def __init__(self, fields, values, manager=None):
+        # `fields` is a dict of field name -> index into `values`,
+        # shared by every record of a manager
+        self._fields = fields
+        self._values = values
+        self._manager = manager
+        self._full = self._tag_names = self.region_name = None
+
+    @classmethod
+    def from_object(cls, obj, fields, interned=(), manager=None):
+        values = [None] * len(fields)
+        for name, index in fields.items():
+            value = getattr(obj, name, None)
+            if name == 'tags':
+                if value:
+                    value = dict((_intern(k), v) for k, v in value.items())
+            elif name in interned:
+                value = _intern(value)
+            values[index] = value
+        return cls(fields, tuple(values), manager)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self._fields[name]]
+        except KeyError:
+            pass
+        if self._manager is not None and name in _names(self._manager.MODEL):
+            return getattr(self.hydrate(), name)
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # The manager is reattached when the record is cached again
+        return self._fields, self._values
+
+    def __setstate__(self, state):
+        self._fields, self._values = state
+        self._manager = self._full = self._tag_names = self.region_name = None
+
+    def __eq__(self, other):
+        # Values like groups are boto objects, which only equal themselves
+        return (
+            isinstance(other, Record) and
+            self._fields == other._fields and
+            snapshot(self._values) == snapshot(other._values))
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return '<Record: %s>' % (self.id,)
+
+    def hydrate(self):
+        "Return the full boto object for this record, fetching it once"
+        if self._full is None:
+            self._full = self._manager._hydrate(self.id)
+        return self._full
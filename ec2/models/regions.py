@@ -0,0 +1,61 @@
+"""
+ec2.models.regions
+~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from itertools import chain
+
+from .futures import bounded_map
+
+
+class RegionSet(object):
+    """
+    Query the same manager across several regions at once.
+
+    Each region is queried through its own regional manager, with its own
+    connection and cache, on a bounded pool of threads. Results are merged
+    in the order the regions were given, and each object is tagged with
+    the `region_name` it came from.
+
+    >>> ec2.instances.in_regions(['us-east-1', 'us-west-2']).filter(state='running')
+    [ ... ]
+    """
+
+    def __init__(self, manager, regions, max_workers=None):
+        self.managers = [manager.for_region(region) for region in regions]
+        self.max_workers = max_workers
+
+    def __repr__(self):
+        return '<RegionSet: %s>' % ', '.join(m.REGION_NAME for m in self.managers)
+
+    def _map(self, method, *args, **kwargs):
+        "Call `method` on every regional manager concurrently"
+        def call(manager):
+            results = getattr(manager, method)(*args, **kwargs)
+            for obj in results:
+                obj.region_name = manager.REGION_NAME
+            return results
+
+        return bounded_map(call, self.managers, self.max_workers)
+
+    def all(self):
+        return list(chain.from_iterable(self._map('all')))
+
+    def filter(self, *args, **kwargs):
+        return list(chain.from_iterable(self._map('filter', *args, **kwargs)))
+
+    def get(self, *args, **kwargs):
+        manager = self.managers[0]
+        things = self.filter(*args, **kwargs)
+        if len(things) > 1:
+            raise manager.MultipleObjectsReturned
+        elif len(things) == 0:
+            raise manager.DoesNotExist
+        return things[0]
+
+    def clear(self):
+        for manager in self.managers:
+            manager.clear()
@@ -0,0 +1,217 @@
+"""
+ec2.models.relations
+~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+from .records import attribute
+from ec2.connection import credentials
+
+# Manager name -> manager, for relations to refer to each other by name
+_managers = {}
+# boto class -> manager of objects of that class
+_models = {}
+# Every relation name of every registered manager
+NAMES = set()
+
+
+def register(manager):
+    "Make the RELATIONS of `manager` available to filters"
+    _managers[manager.__name__] = manager
+    if manager.MODEL is not None:
+        _models[manager.MODEL] = manager
+    NAMES.update(manager.RELATIONS)
+
+
+def manager_for(obj):
+    "The manager `obj` belongs to, in the region it came from, or None"
+    # Records know their manager, regional or not
+    manager = getattr(obj, '_manager', None)
+    if manager is not None:
+        return manager
+    for cls in type(obj).__mro__:
+        manager = _models.get(cls)
+        if manager is not None:
+            break
+    else:
+        return None
+    # boto objects know the region of the connection they came from
+    region_name = getattr(obj, 'region_name', None) or getattr(getattr(obj, 'region', None), 'name', None)
+    if region_name and region_name != (manager.REGION_NAME or credentials()['region_name']):
+        manager = manager.for_region(region_name)
+    return manager
+
+
+def follow(obj, name):
+    "Objects related to `obj` through its manager's relation `name`"
+    manager = manager_for(obj)
+    if manager is None or name not in manager.RELATIONS:
+        return []
+    return manager.RELATIONS[name].follow(obj, manager)
+
+
+def related(obj, name):
+    """
+    The object related to `obj` through relation `name`, or None, or a
+    list of objects for relations to many objects
+
+    >>> related(instance, 'vpc')
+    VPC:vpc-xxx
+    >>> related(instance, 'groups')
+    [SecurityGroup:production-web, ...]
+    """
+    manager = manager_for(obj)
+    if manager is None or name not in manager.RELATIONS:
+        raise AttributeError("No relation '%s'" % name)
+    relation = manager.RELATIONS[name]
+    objects = relation.follow(obj, manager)
+    if relation.many:
+        return objects
+    return objects[0] if objects else None
+
+
+def prefetch(objects, lookups):
+    """
+    Fetch everything `lookups` relate `objects` to up front, one describe
+    call per related manager, so following them afterwards is only a
+    lookup in a hash map. A lookup may span relations, like 'groups__vpc'.
+    """
+    for lookup in lookups:
+        level = objects
+        for name in lookup.split('__'):
+            targets = {}
+            for obj in level:
+                manager = manager_for(obj)
+                if manager is None or name not in manager.RELATIONS:
+                    raise AttributeError("No relation '%s'" % name)
+                target = manager.RELATIONS[name].target(manager)
+                if target is not None:
+                    targets[target] = True
+            for target in targets:
+                target.all()
+            following = []
+            for obj in level:
+                following.extend(follow(obj, name))
+            level = following
+
+
+class Relation(object):
+    "How objects of one manager relate to those of another"
+
+    # Whether an object can have more than one related object
+    many = False
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def target(self, source):
+        "The related manager, in the same region as the `source` manager"
+        target = _managers[self.manager]
+        if source.REGION_NAME and source.REGION_NAME != target.REGION_NAME:
+            target = target.for_region(source.REGION_NAME)
+        return target
+
+    def matching(self, source, predicate):
+        """
+        Related objects matching `predicate`. Everything is fetched once,
+        rather than a describe per filter, so joins share the one cache.
+        """
+        target = self.target(source)
+        target.all()
+        return target.filter(**{predicate.key: predicate.value})
+
+    def follow(self, obj, source):
+        raise NotImplementedError
+
+    def candidates(self, indexes, source, predicate):
+        """
+        Positions of exactly the objects in `indexes` with a related object
+        matching `predicate`, or None if that can't be looked up
+        """
+        return None
+
+
+class ForeignKey(Relation):
+    "The object whose id is in `attr`, like an instance's VPC"
+
+    def __init__(self, attr, manager):
+        super(ForeignKey, self).__init__(manager)
+        self.attr = attr
+
+    def follow(self, obj, source):
+        value = attribute(obj, self.attr)
+        if value is None:
+            return []
+        return self.target(source)._lookup('id', [value])
+
+    def candidates(self, indexes, source, predicate):
+        ids = [obj.id for obj in self.matching(source, predicate)]
+        return indexes.join(self.attr).lookup(ids)
+
+
+class ManyToMany(Relation):
+    "The objects whose ids are those of the items in `attr`, like an instance's security groups"
+
+    many = True
+
+    def __init__(self, attr, manager):
+        super(ManyToMany, self).__init__(manager)
+        self.attr = attr
+
+    def follow(self, obj, source):
+        ids = [item.id for item in attribute(obj, self.attr) or ()]
+        if not ids:
+            return []
+        return self.target(source)._lookup('id', ids)
+
+    def candidates(self, indexes, source, predicate):
+        ids = [obj.id for obj in self.matching(source, predicate)]
+        return indexes.join(self.attr, 'id').lookup(ids)
+
+
+class Reverse(Relation):
+    """
+    The objects of another manager referring to this one through `attr`,
+    or through the `key` of the items in `attr`, like a VPC's instances
+    """
+
+    many = True
+
+    def __init__(self, manager, attr, key=None):
+        super(Reverse, self).__init__(manager)
+        self.attr = attr
+        self.key = key
+
+    def follow(self, obj, source):
+        return self.target(source)._lookup(self.attr, [obj.id], self.key)
+
+    def candidates(self, indexes, source, predicate):
+        ids = set()
+        for obj in self.matching(source, predicate):
+            value = attribute(obj, self.attr)
+            if self.key is None:
+                ids.add(value)
+            else:
+                ids.update(getattr(item, self.key, None) for item in value or ())
+        return indexes.join('id').lookup(ids)
+
+
+class Embedded(Relation):
+    """
+    Objects held right in `attr`, like a reservation's instances. Lite
+    records only hold them if `attr` is in LITE_FIELDS.
+    """
+
+    many = True
+
+    def __init__(self, attr):
+        super(Embedded, self).__init__(None)
+        self.attr = attr
+
+    def target(self, source):
+        return None
+
+    def follow(self, obj, source):
+        return list(attribute(obj, self.attr) or ())
@@ -0,0 +1,62 @@
+"""
+ec2.models.tags
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+
+def fold(tags):
+    "Map each lowercased tag name to the first tag with that name"
+    names = {}
+    for tag in tags:
+        names.setdefault(tag.lower(), tag)
+    return names
+
+
+def tag_names(obj, tags):
+    """
+    The folded names of `tags`, which belong to `obj`. They're kept on
+    the object, and folded again once its tags are replaced or grow or
+    shrink, or the models' add_tags() and remove_tags() reset them.
+    """
+    cached = getattr(obj, '_tag_names', None)
+    if cached is not None and cached[0] is tags and cached[1] == len(tags):
+        return cached[2]
+    names = fold(tags)
+    try:
+        obj._tag_names = tags, len(tags), names
+    except AttributeError:
+        # Not everything can carry it around
+        pass
+    return names
+
+
+def tag_value(obj, field, default=None):
+    """
+    Value of the first tag on `obj` named `field` case insensitively,
+    like filters fall back to, or `default` if there is none
+    """
+    tags = getattr(obj, 'tags', None)
+    if not tags:
+        return default
+    tag = tag_names(obj, tags).get(field)
+    if tag is None:
+        return default
+    try:
+        return tags[tag]
+    except KeyError:
+        # Renamed in place, so fold them again
+        obj._tag_names = None
+        return tag_value(obj, field, default)
+
+
+def fold_all(objects):
+    "Fold the tags of every object ahead of time, returning all the names seen"
+    seen = set()
+    for obj in objects:
+        tags = getattr(obj, 'tags', None)
+        if tags:
+            seen.update(tag_names(obj, tags))
+    return seen
@@ -0,0 +1,153 @@
+"""
+ec2.ratelimit
+~~~~~~~~~~~~~
+
+:copyright: (c) 2014 by Matt Robenolt.
+:license: BSD, see LICENSE for more details.
+"""
+
+import random
+import threading
+import time
+
+from . import metrics
+
+# Default budget for an API action: calls per second, and how many
+# calls may be made at once after a quiet period
+RATE = 10.0
+BURST = 20
+# action -> (rate, burst), for actions with a tighter budget than the
+# default. Mutating calls are throttled sooner by EC2 than reads.
+BUDGETS = {
+    'create_security_group': (2.0, 5),
+    'delete_security_group': (2.0, 5),
+    'create_vpc': (1.0, 2),
+    'delete_vpc': (1.0, 2),
+}
+# Retries of a throttled call before giving up
+MAX_RETRIES = 5
+# Seconds to back off after the first throttled call, doubling after each
+BASE_DELAY = 0.5
+MAX_DELAY = 20.0
+# A throttled bucket never slows down below this fraction of its budget
+MIN_RATE_FACTOR = 0.1
+
+THROTTLING_ERRORS = frozenset(['RequestLimitExceeded', 'Throttling', 'ThrottlingException'])
+
+
+def is_throttling(error):
+    "Whether `error` is EC2 telling us to slow down"
+    return getattr(error, 'error_code', None) in THROTTLING_ERRORS
+
+
+def backoff(attempt):
+    """
+    Seconds to wait before retrying after `attempt` throttled calls,
+    exponential with full jitter, so clients don't retry in lockstep.
+    """
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` calls per second on average, and up to `burst` at
+    once. When calls get throttled anyway, the rate is halved, and it
+    then creeps back up towards `rate` with every successful call.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # The clock may go backwards, which mustn't take tokens away
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        "Take a token, sleeping until one is available. Returns the seconds slept."
+        with self._lock:
+            self._refill(time.time())
+            # Taking the token right away reserves it, so concurrent
+            # callers queue up behind each other instead of all waking
+            # up at once
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * MIN_RATE_FACTOR)
+
+
+class RateLimiter(object):
+    """
+    Client side rate limiting for API calls, shared by every thread,
+    with a token bucket per account, region and action.
+
+    Throttled calls are retried up to `max_retries` times, backing off
+    exponentially, before their error is raised.
+
+    >>> ec2.ratelimit.limiter.budgets['get_all_instances'] = (5.0, 10)
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, budgets=None, max_retries=MAX_RETRIES):
+        self.rate = rate
+        self.burst = burst
+        self.budgets = dict(BUDGETS if budgets is None else budgets)
+        self.max_retries = max_retries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        "The bucket for a key of (account, region, action)"
+        try:
+            return self._buckets[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._buckets:
+                    rate, burst = self.budgets.get(key[-1], (self.rate, self.burst))
+                    self._buckets[key] = TokenBucket(rate, burst)
+                return self._buckets[key]
+
+    def call(self, key, func, *args, **kwargs):
+        "Call `func` once the bucket for `key` allows it, retrying if throttled"
+        bucket = self.bucket(key)
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                metrics.stop(time.time() - waited, 'ratelimit.wait', action=key[-1])
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_throttling(e) or attempt >= self.max_retries:
+                    raise
+                metrics.incr('api.throttled', action=key[-1])
+                bucket.throttled()
+                time.sleep(backoff(attempt))
+                attempt += 1
+                continue
+            bucket.succeeded()
+            return result
+
+    def clear(self):
+        "Forget every bucket, so budgets are applied afresh"
+        with self._lock:
+            self._buckets.clear()
+
+
+limiter = RateLimiter()
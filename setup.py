@@ -15,6 +15,10 @@ install_requires = [
     'boto',
 ]
 
+extras_require = {
+    'numpy': ['numpy'],
+}
+
 tests_require = [
     'mock',
     'pytest',
@@ -41,8 +45,9 @@ setup(
     url='https://github.com/mattrobenolt/ec2',
     description='Query for AWS EC2 instances, security groups, and VPCs simply',
     long_description=__doc__,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
     install_requires=install_requires,
+    extras_require=extras_require,
     tests_require=tests_require,
     license='BSD',
     cmdclass={'test': PyTest},
@@ -6,6 +6,11 @@ from mock import MagicMock, patch
 import unittest
 
 import ec2
+from ec2.models.managers import (
+    InstanceManager,
+    ReservationManager,
+    SecurityGroupManager,
+    VPCManager)
 
 RUNNING_STATE = InstanceState(16, 'running')
 STOPPED_STATE = InstanceState(64, 'stopped')
@@ -32,7 +37,7 @@ class BaseTestCase(unittest.TestCase):
             i2.tags = {'Name': 'instance-%d' % instance_count}
             instance_count += 1
             reservation = MagicMock()
-            reservation.instances.__iter__ = MagicMock(return_value=iter([i1, i2]))
+            reservation.instances.__iter__ = MagicMock(side_effect=lambda i1=i1, i2=i2: iter([i1, i2]))
             reservations.append(reservation)
 
         security_groups = []
@@ -91,9 +96,10 @@ class BaseTestCase(unittest.TestCase):
         ec2.credentials.ACCESS_KEY_ID = None
         ec2.credentials.SECRET_ACCESS_KEY = None
         ec2.credentials.REGION_NAME = 'us-east-1'
-        # ec2.instances.clear()
-        # ec2.security_groups.clear()
-        # ec2.vpcs.clear()
+        for manager in (InstanceManager, ReservationManager, SecurityGroupManager, VPCManager):
+            manager.clear()
+        ec2.connection.pool.clear()
+        ec2.ratelimit.limiter.clear()
 
     def _patch_connection(self):
         return patch('ec2.models.managers.get_connection', return_value=self.connection)
@@ -0,0 +1,150 @@
+from ..base import RUNNING_STATE
+from boto.ec2.connection import EC2Connection
+from boto.ec2.instance import Instance
+from mock import MagicMock, patch
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from ec2.models.cache import (
+    DictClient,
+    FileBackend,
+    KeyValueBackend,
+    MemoryBackend,
+    ResultCache,
+    dumps,
+    loads,
+    make_key)
+
+
+class MakeKeyTests(unittest.TestCase):
+    def test_normalized(self):
+        self.assertEquals(
+            make_key({'b': ['2', '1'], 'a': '1'}, ['i-2', 'i-1']),
+            make_key({'a': '1', 'b': ('1', '2')}, ('i-1', 'i-2')))
+        self.assertEquals(((), ()), make_key())
+        hash(make_key({'a': ['1']}))
+
+
+class ResultCacheTests(unittest.TestCase):
+    def test_get_set(self):
+        cache = ResultCache()
+        self.assertEquals(None, cache.get('a'))
+        cache.set('a', [1], 60)
+        self.assertEquals([1], cache.get('a'))
+        self.assertEquals({'hits': 1, 'misses': 1, 'size': 1, 'max_size': 128}, cache.stats())
+
+    def test_ttl(self):
+        cache = ResultCache()
+        with patch('time.time', return_value=1000):
+            cache.set('a', [1], 60)
+        with patch('time.time', return_value=1059):
+            self.assertEquals([1], cache.get('a'))
+        with patch('time.time', return_value=1061):
+            self.assertEquals(None, cache.get('a'))
+        self.assertEquals(0, len(cache))
+
+    def test_lru(self):
+        cache = ResultCache(max_size=2)
+        cache.set('a', [1], 60)
+        cache.set('b', [2], 60)
+        cache.get('a')
+        cache.set('c', [3], 60)
+        self.assertEquals(None, cache.get('b'))
+        self.assertEquals([1], cache.get('a'))
+        self.assertEquals([3], cache.get('c'))
+
+    def test_clear(self):
+        cache = ResultCache()
+        cache.set('a', [1], 60)
+        cache.clear()
+        self.assertEquals(None, cache.get('a'))
+
+
+class SerializerTests(unittest.TestCase):
+    def test_roundtrip(self):
+        connection = EC2Connection(aws_access_key_id='abc', aws_secret_access_key='xyz')
+        instance = Instance(connection)
+        instance.id = 'i-abc'
+        instance._state = RUNNING_STATE
+        instance.tags = {'Name': 'awesome'}
+
+        data = dumps([instance])
+        self.assertFalse('xyz' in zlib.decompress(data))
+
+        other = object()
+        loaded, = loads(data, lambda: other)
+        self.assertTrue(isinstance(loaded, Instance))
+        self.assertEquals(('i-abc', 'running', {'Name': 'awesome'}), (loaded.id, loaded.state, loaded.tags))
+        self.assertTrue(loaded.connection is other)
+
+    def test_no_connection(self):
+        connect = MagicMock()
+        self.assertEquals([{'a': 1}], loads(dumps([{'a': 1}]), connect))
+        self.assertFalse(connect.called)
+
+
+class FileBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = FileBackend(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_set(self):
+        self.assertEquals(None, self.backend.get('Manager-us-east-1'))
+        self.backend.set('Manager-us-east-1', 1000.0, 'data')
+        self.assertEquals((1000.0, 'data'), self.backend.get('Manager-us-east-1'))
+        self.backend.set('Manager-us-east-1', 1001.0, 'new')
+        self.assertEquals((1001.0, 'new'), self.backend.get('Manager-us-east-1'))
+        self.backend.delete('Manager-us-east-1')
+        self.assertEquals(None, self.backend.get('Manager-us-east-1'))
+
+    def test_bad_files(self):
+        self.backend.set('key', 1000.0, 'data')
+        with patch('ec2.models.cache.FORMAT_VERSION', 2):
+            self.assertEquals(None, self.backend.get('key'))
+        with open(self.backend._path('key'), 'wb') as f:
+            f.write('garbage')
+        self.assertEquals(None, self.backend.get('key'))
+
+
+class MemoryBackendTests(unittest.TestCase):
+    def test_get_set(self):
+        backend = MemoryBackend()
+        self.assertEquals(None, backend.get('key'))
+        backend.set('key', 1000.0, 'data')
+        self.assertEquals((1000.0, 'data'), backend.get('key'))
+        backend.delete('key')
+        self.assertEquals(None, backend.get('key'))
+
+
+class KeyValueBackendTests(unittest.TestCase):
+    def test_get_set(self):
+        client = DictClient()
+        backend = KeyValueBackend(client)
+        self.assertEquals(None, backend.get('key'))
+        backend.set('key', 1000.0, 'data')
+        self.assertEquals((1000.0, 'data'), backend.get('key'))
+        self.assertTrue(client.get('ec2:key') is not None)
+        backend.delete('key')
+        self.assertEquals(None, backend.get('key'))
+
+    def test_timeout(self):
+        client = MagicMock()
+        KeyValueBackend(client, prefix='p:', timeout=60).set('key', 1000.0, 'data')
+        self.assertEquals(('p:key', 60), (client.set.call_args[0][0], client.set.call_args[0][2]))
+
+        client = DictClient()
+        with patch('time.time', return_value=1000):
+            KeyValueBackend(client, timeout=60).set('key', 1000.0, 'data')
+        with patch('time.time', return_value=1061):
+            self.assertEquals(None, KeyValueBackend(client).get('key'))
+
+    def test_garbage(self):
+        client = DictClient()
+        client.set('ec2:key', 'garbage')
+        self.assertEquals(None, KeyValueBackend(client).get('key'))
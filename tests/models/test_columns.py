@@ -0,0 +1,109 @@
+from ..base import RUNNING_STATE, STOPPED_STATE
+from boto.ec2.instance import Instance
+from mock import patch
+import unittest
+
+from ec2.models import columns
+from ec2.models.columns import ColumnSet
+from ec2.models.indexes import IndexSet
+from ec2.models.query import Q, Query
+
+QUERIES = [
+    {'state': 'running'},
+    {'name': 'web-01'},
+    {'name__iexact': 'WEB-02'},
+    {'name__contains': 'eb'},
+    {'name__icontains': 'EB'},
+    {'name__startswith': 'web'},
+    {'name__istartswith': 'WEB'},
+    {'name__endswith': '01'},
+    {'name__iendswith': '-01'},
+    {'name__like': r'^[a-z]+-\d+$'},
+    {'name__ilike': r'^web'},
+    {'name__isnull': True},
+    {'name__isnull': False},
+    {'role__isnull': True},
+    {'role__isnull': False},
+    {'role': 'db'},
+    # None attribute, so the tag is checked
+    {'private_ip_address__startswith': '10.'},
+    {'private_ip_address__isnull': True},
+    {'state': 'stopped', 'name__startswith': 'web'},
+    {'id__in': ['i-abc0', 'i-abc3']},
+    {'private_ip_address__gte': '10.0.0.1'},
+    {'private_ip_address__range': ('10.0.0.0', '10.1')},
+]
+
+
+@unittest.skipIf(columns.numpy is None, 'NumPy is not installed')
+class ColumnTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        names = ('web-01', 'Web-02', 'db-01', None, 'web-01')
+        for n, name in enumerate(names):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i._state = n % 2 and STOPPED_STATE or RUNNING_STATE
+            i.private_ip_address = n < 2 and '10.0.0.%d' % n or None
+            i.tags = name and {'Name': name} or {}
+            if n == 2:
+                i.tags['Role'] = 'db'
+                i.tags['private_ip_address'] = '10.1.0.2'
+            if n == 3:
+                i.tags['role'] = None
+            self.instances.append(i)
+        self.columns = ColumnSet(self.instances)
+
+    def test_same_as_row_wise(self):
+        for kwargs in QUERIES:
+            query = Query(**kwargs)
+            expected = [i.id for i in self.instances if query(i)]
+            self.assertEquals(expected, [i.id for i in self.columns.filter(query.predicates)], kwargs)
+
+    def test_dictionary(self):
+        column = self.columns.column('name')
+        self.assertEquals(4, len(column.cells))
+        self.assertEquals(list(column.codes), [0, 1, 2, 3, 0])
+
+    def test_expressions(self):
+        queries = (
+            Query(Q(name='web-01') | Q(role='db')),
+            Query(~Q(name__istartswith='web'), state='running'),
+            Query(~(Q(role__isnull=True) | Q(state='stopped')) | Q(name__endswith='02')),
+        )
+        for query in queries:
+            expected = [i.id for i in self.instances if query(i)]
+            self.assertEquals(expected, [i.id for i in self.columns.filter(query.conjuncts)], query)
+
+    def test_changed_in_place(self):
+        query = Query(name='web-01')
+        self.assertEquals(['i-abc0', 'i-abc4'], [i.id for i in self.columns.filter(query.predicates)])
+        self.instances[0].tags['Name'] = 'renamed'
+        self.assertEquals(['i-abc4'], [i.id for i in self.columns.filter(query.predicates)])
+
+    def test_unhashable(self):
+        self.instances[1].groups = [['sg-abc0']]
+        query = Query(groups__contains=['sg-abc0'])
+        self.assertEquals(None, self.columns.filter(query.predicates))
+
+    def test_query_filter(self):
+        indexes = IndexSet(self.instances, ('id',))
+        query = Query(name__endswith='01')
+        with patch.object(columns, 'MIN_OBJECTS', 0):
+            with patch.object(ColumnSet, 'filter', wraps=indexes.columns.filter) as vectorized:
+                self.assertEquals(['i-abc0', 'i-abc2', 'i-abc4'], [i.id for i in query.filter(self.instances, indexes)])
+                self.assertEquals(1, vectorized.call_count)
+                # An index narrows it down first
+                self.assertEquals(['i-abc4'], [i.id for i in Query(id='i-abc4', name='web-01').filter(self.instances, indexes)])
+                self.assertEquals(1, vectorized.call_count)
+
+
+class WithoutNumpyTests(unittest.TestCase):
+    def test_fallback(self):
+        instance = Instance()
+        instance.id = 'i-abc0'
+        with patch.object(columns, 'numpy', None):
+            indexes = IndexSet([instance], ())
+            self.assertEquals(None, indexes.columns)
+            with patch.object(columns, 'MIN_OBJECTS', 0):
+                self.assertEquals([instance], Query(id='i-abc0').filter(indexes.objects, indexes))
@@ -0,0 +1,86 @@
+from ..base import BaseTestCase
+from threading import Event, Lock, Thread
+import time
+import unittest
+
+from ec2.models import futures
+from ec2.models.managers import InstanceManager, VPCManager
+
+
+class SubmitTests(unittest.TestCase):
+    def test_shared_while_running(self):
+        started, release = Event(), Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(calls)
+
+        first = futures.submit('slow', slow)
+        started.wait(5)
+        self.assertTrue(futures.submit('slow', slow) is first)
+        self.assertFalse(futures.submit(None, lambda: 'other') is first)
+        release.set()
+        self.assertEquals(1, first.get(5))
+        self.assertEquals(2, futures.submit('slow', slow).get(5))
+
+    def test_unhashable_key(self):
+        self.assertEquals(3, futures.submit(('sum', [1, 2]), sum, [1, 2]).get(5))
+
+    def test_exceptions(self):
+        def fail():
+            raise KeyError('nope')
+        self.assertRaises(KeyError, futures.submit('fail', fail).get, 5)
+        self.assertFalse('fail' in futures._inflight)
+
+    def test_bounded_map(self):
+        running, most = [0], [0]
+        lock = Lock()
+
+        def call(n):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return n * 2
+
+        self.assertEquals([0, 2, 4, 6, 8, 10], futures.bounded_map(call, xrange(6), 2))
+        self.assertTrue(most[0] <= 2)
+        self.assertEquals([], futures.bounded_map(call, []))
+
+
+class ManagerFuturesTestCase(BaseTestCase):
+    def test_aall(self):
+        with self._patch_connection():
+            self.assertEquals(4, len(InstanceManager.aall().get(5)))
+            self.assertEquals(1, len(InstanceManager.afilter(id='i-abc0').get(5)))
+            self.assertEquals('i-abc1', InstanceManager.aget(id='i-abc1').get(5).id)
+            self.assertRaises(InstanceManager.DoesNotExist, InstanceManager.aget(id='i-nope').get, 5)
+            # All of the above shared the one cache
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+
+    def test_acreate(self):
+        with self._patch_vpc_connection():
+            self.assertEquals('vpc-xyz0', VPCManager.acreate('10.10.10.0/16').get(5).id)
+            self.assertTrue(VPCManager.adelete('vpc-xyz0').get(5))
+
+    def test_single_refresh(self):
+        reservations = self.connection.get_all_instances()
+
+        def slow_fetch(**kwargs):
+            time.sleep(0.05)
+            return reservations
+        self.connection.get_all_instances.reset_mock()
+        self.connection.get_all_instances.side_effect = slow_fetch
+
+        with self._patch_connection():
+            threads = [Thread(target=InstanceManager.all) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
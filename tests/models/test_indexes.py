@@ -0,0 +1,125 @@
+from ..base import RUNNING_STATE, STOPPED_STATE
+from boto.ec2.instance import Instance
+from datetime import datetime
+import unittest
+
+from ec2.models.indexes import IndexSet, Statistics
+from ec2.models.managers import InstanceManager
+from ec2.models.query import Predicate, Query
+from ec2.models.records import Record
+
+
+class IndexTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n, name in enumerate(('web-01', 'Web-02', 'db-01', None)):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i._state = n % 2 and STOPPED_STATE or RUNNING_STATE
+            i.private_ip_address = n < 3 and '10.0.0.%d' % n or None
+            i.tags = name and {'Name': name} or {}
+            self.instances.append(i)
+        self.indexes = IndexSet(self.instances, ('id', 'private_ip_address', 'name'))
+
+    def test_exact(self):
+        self.assertEquals([1], self.indexes.positions('id', 'exact', 'i-abc1'))
+        self.assertEquals([], self.indexes.positions('id', 'exact', 'i-nope'))
+        self.assertEquals([3], self.indexes.positions('private_ip_address', 'exact', None))
+        self.assertEquals([2], self.indexes.positions('name', 'exact', 'db-01'))
+
+    def test_iexact(self):
+        self.assertEquals([1], self.indexes.positions('name', 'iexact', 'WEB-02'))
+
+    def test_startswith(self):
+        self.assertEquals([0], self.indexes.positions('name', 'startswith', 'web'))
+        self.assertEquals([0, 1], self.indexes.positions('name', 'istartswith', 'WEB'))
+        self.assertEquals([0, 1, 2], self.indexes.positions('private_ip_address', 'startswith', '10.0.0.'))
+
+    def test_tags(self):
+        self.instances[0].tags['Environment'] = 'prod'
+        self.instances[2].tags['environment'] = 'prod'
+        self.instances[2].tags['ENVIRONMENT'] = 'dev'
+        indexes = IndexSet(self.instances, ())
+        self.assertTrue('environment' in indexes.tag_names)
+        self.assertFalse('environment' in indexes)
+        self.assertEquals(Query(environment='prod').filter(self.instances), [self.instances[i] for i in indexes.positions('environment', 'exact', 'prod')])
+        self.assertTrue('environment' in indexes)
+        self.assertEquals([0, 1], indexes.positions('name', 'istartswith', 'web'))
+        self.assertEquals(None, indexes.positions('owner', 'exact', 'bob'))
+
+    def test_ranges(self):
+        for n, i in enumerate(self.instances):
+            i.launch_time = '2014-03-0%dT12:00:00.000Z' % (n + 1)
+            i.ami_launch_index = n
+        self.instances[3].ami_launch_index = None
+        self.instances[2].tags['Size'] = '10'
+        self.instances[3].tags['Size'] = '2'
+        indexes = IndexSet(self.instances, ('id', 'launch_time', 'ami_launch_index', 'size'))
+        self.assertEquals([1, 3], indexes.positions('id', 'in', ['i-abc1', 'i-abc3', 'i-nope']))
+        self.assertEquals([2, 3], indexes.positions('launch_time', 'gte', datetime(2014, 3, 3)))
+        self.assertEquals([0, 1], indexes.positions('launch_time', 'lt', datetime(2014, 3, 3)))
+        self.assertEquals([1, 2], indexes.positions('launch_time', 'range', (datetime(2014, 3, 2), datetime(2014, 3, 3, 12))))
+        self.assertEquals([2], indexes.positions('ami_launch_index', 'gt', 1))
+        self.assertEquals([0, 1], indexes.positions('ami_launch_index', 'lte', 1.5))
+        self.assertEquals([2], indexes.positions('size', 'gt', 5))
+        self.assertEquals(None, indexes.positions('id', 'gt', None))
+        queries = (
+            Query(launch_time__gt=datetime(2014, 3, 2, 12)),
+            Query(launch_time__lte='2014-03-02T12:00:00.000Z'),
+            Query(ami_launch_index__range=(1, 2)),
+            Query(ami_launch_index__lt=2),
+            Query(size__gte=2),
+            Query(size__in=['2', '10']),
+            Query(id__in=['i-abc0'], ami_launch_index__gte=0),
+        )
+        for query in queries:
+            self.assertEquals(query.filter(self.instances), query.filter(self.instances, indexes), query)
+
+    def test_unsupported(self):
+        self.assertEquals(None, self.indexes.positions('state', 'exact', 'running'))
+        self.assertEquals(None, self.indexes.positions('name', 'contains', 'web'))
+        self.assertEquals(None, self.indexes.positions('id', 'exact', ['unhashable']))
+
+    def test_query_matches_scan(self):
+        queries = (
+            Query(name__istartswith='web', state='running'),
+            Query(name='db-01'),
+            Query(id__iexact='I-ABC3', private_ip_address=None),
+            Query(name__startswith='nope'),
+            Query(state='stopped'),
+        )
+        for query in queries:
+            self.assertEquals(query.filter(self.instances), query.filter(self.instances, self.indexes))
+
+    def test_other_objects_ignored(self):
+        other = self.instances[:2]
+        self.assertEquals([], Query(id='i-abc2').filter(other, self.indexes))
+
+
+class StatisticsTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n in xrange(1000):
+            i = Instance()
+            i.id = 'i-%04d' % n
+            i._state = n % 10 and STOPPED_STATE or RUNNING_STATE
+            self.instances.append(i)
+
+    def test_selectivity(self):
+        statistics = Statistics(self.instances)
+        self.assertEquals(100, len(statistics.sample()))
+        running = Predicate('state', 'running')
+        self.assertTrue(0.02 < statistics.selectivity(running) < 0.2)
+        self.assertEquals(0, statistics.selectivity(Predicate('id', 'i-nope')))
+        self.assertEquals(1, statistics.selectivity(Predicate('id__startswith', 'i-')))
+        self.assertEquals(None, statistics.selectivity(Predicate('id__contains', 1)))
+        # Memoized
+        statistics._sample = []
+        self.assertTrue(0.02 < statistics.selectivity(running) < 0.2)
+
+    def test_records_not_hydrated(self):
+        fields = {'id': 0, 'tags': 1}
+        records = [Record.from_object(i, fields, manager=InstanceManager) for i in self.instances]
+        statistics = Statistics(records)
+        self.assertEquals(None, statistics.selectivity(Predicate('state', 'running')))
+        self.assertEquals(1, statistics.selectivity(Predicate('id__startswith', 'i-')))
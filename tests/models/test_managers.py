@@ -1,5 +1,20 @@
-from ..base import BaseTestCase
-
+from ..base import BaseTestCase, STOPPED_STATE
+from boto.ec2.group import Group
+from boto.ec2.instance import Instance
+from boto.regioninfo import RegionInfo
+from copy import copy
+from datetime import datetime, timedelta
+from mock import MagicMock, patch
+import os
+import shutil
+import tempfile
+import time
+
+from ec2.models import compile_filter
+from ec2.models.base import Diff
+from ec2.models.cache import DictClient, FileBackend, KeyValueBackend, MemoryBackend
+from ec2.models.models import SecurityGroup
+from ec2.models.records import NotLoaded, Record
 from ec2.models.managers import (
     InstanceManager,
     SecurityGroupManager,
@@ -72,6 +87,79 @@ class InstancesTestCase(BaseTestCase):
             instances = InstanceManager.filter(id__isnull=True)
             self.assertEquals(0, len(instances))
 
+    def test_filter_pushdown(self):
+        with self._patch_connection():
+            instances = InstanceManager.filter(state='running', name__startswith='instance-', id__iendswith='0')
+            self.assertEquals(['i-abc0'], [i.id for i in instances])
+            self.connection.get_all_instances.assert_called_once_with(
+                filters={'instance-state-name': 'running', 'tag:Name': 'instance-*'})
+
+            # Nothing to push down fills the cache, which is used from then on
+            list(InstanceManager.filter(id__iendswith='0'))
+            self.connection.get_all_instances.assert_called_with(filters=None)
+            self.assertEquals(1, len(InstanceManager.filter(state='stopped', name='instance-1')))
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def test_filter_result_cache(self):
+        with self._patch_connection():
+            before = InstanceManager.cache_stats()
+            self.assertEquals(2, len(InstanceManager.filter(state='running')))
+            self.assertEquals(2, len(InstanceManager.filter(state__exact='running')))
+            self.assertEquals(1, len(InstanceManager.filter(state='running', id__iendswith='2')))
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+            stats = InstanceManager.cache_stats()
+            self.assertEquals(2, stats['hits'] - before['hits'])
+            self.assertEquals(1, stats['misses'] - before['misses'])
+            self.assertEquals(1, stats['size'])
+
+            InstanceManager.clear()
+            list(InstanceManager.filter(state='running'))
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def _paginate(self, pages=2):
+        "Serve the fixture's reservations one per page"
+        reservations = self.connection.get_all_instances()
+        self.connection.get_all_instances.reset_mock()
+
+        def get_all_reservations(filters=None, max_results=None, next_token=None):
+            n = int(next_token or 0)
+            page = MagicMock()
+            page.__iter__ = MagicMock(return_value=iter([reservations[n]]))
+            page.next_token = n + 1 < pages and str(n + 1) or None
+            return page
+        self.connection.get_all_reservations = MagicMock(side_effect=get_all_reservations)
+
+    def test_iter_all(self):
+        self._paginate()
+        with self._patch_connection():
+            self.assertEquals(['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3'], [i.id for i in InstanceManager.iter_all()])
+            self.assertEquals(2, self.connection.get_all_reservations.call_count)
+            self.connection.get_all_reservations.assert_called_with(filters=None, max_results=1000, next_token='1')
+            self.assertFalse(InstanceManager.is_cached())
+            self.assertFalse(self.connection.get_all_instances.called)
+
+    def test_iter_filter(self):
+        self._paginate()
+        with self._patch_connection():
+            instances = InstanceManager.iter_filter(state='stopped', id__iendswith='3')
+            self.assertEquals(['i-abc3'], [i.id for i in instances])
+            self.connection.get_all_reservations.assert_called_with(
+                filters={'instance-state-name': 'stopped'}, max_results=1000, next_token='1')
+
+            # With a warm cache, nothing is fetched
+            InstanceManager.all()
+            self.connection.get_all_reservations.reset_mock()
+            self.assertEquals(['i-abc1', 'i-abc3'], [i.id for i in InstanceManager.iter_filter(state='stopped')])
+            self.assertFalse(self.connection.get_all_reservations.called)
+
+    def test_first(self):
+        self._paginate()
+        with self._patch_connection():
+            self.assertEquals('i-abc1', InstanceManager.first(id__iendswith='1').id)
+            # The match was on the first page, so the second is never fetched
+            self.assertEquals(1, self.connection.get_all_reservations.call_count)
+            self.assertEquals(None, InstanceManager.first(id__iendswith='9'))
+
     def test_get_raises(self):
         with self._patch_connection():
             self.assertRaises(
@@ -233,6 +321,14 @@ class VPCTestCase(BaseTestCase):
             groups = VPCManager.filter(id__isnull=True)
             self.assertEquals(0, len(groups))
 
+    def test_cidr_block_pushdown(self):
+        with self._patch_vpc_connection():
+            self.assertEquals(1, len(VPCManager.filter(cidr_block='10.1.0.0/16')))
+            self.vpc_connection.get_all_vpcs.assert_called_once_with(filters={'cidr': '10.1.0.0/16'})
+            # EC2 doesn't match CIDR blocks by wildcard, so these are checked in Python
+            self.assertEquals(['vpc-abc1'], [v.id for v in VPCManager.filter(cidr_block__startswith='10.1.')])
+            self.vpc_connection.get_all_vpcs.assert_called_with(filters=None)
+
     def test_get_raises(self):
         with self._patch_vpc_connection():
             self.assertRaises(
@@ -260,3 +356,401 @@ class VPCTestCase(BaseTestCase):
         with self._patch_vpc_connection():
             vpc = VPCManager.create('10.10.10.0/16')
             self.assertTrue(VPCManager.delete(vpc.id))
+
+
+class IndexedFilterTestCase(BaseTestCase):
+    def test_indexes_follow_cache(self):
+        with self._patch_connection():
+            instances = InstanceManager.all()
+            self.assertTrue(InstanceManager._indexes.objects is instances)
+            self.assertEquals([instances[2]], InstanceManager.filter(name='instance-2'))
+            self.assertEquals(instances[:2], InstanceManager.filter(id__startswith='i-abc', name__like=r'^instance-[01]$'))
+
+            InstanceManager.clear()
+            self.assertEquals(None, InstanceManager._indexes)
+
+            SecurityGroupManager.create('sg-99', 'Group 99')
+            self.assertEquals(None, SecurityGroupManager._indexes)
+            self.assertEquals('sg-abc1', SecurityGroupManager.get(name='group-1').id)
+
+    def test_changed_in_place(self):
+        with self._patch_connection():
+            instances = InstanceManager.all()
+            instances[0].tags['Name'] = 'renamed'
+            self.assertEquals([], InstanceManager.filter(name='instance-0'))
+            self.assertEquals([], InstanceManager.filter(id='i-abc0', state='stopped'))
+
+
+class CacheTTLTestCase(BaseTestCase):
+    def tearDown(self):
+        super(CacheTTLTestCase, self).tearDown()
+        InstanceManager.SOFT_TTL = None
+
+    def _age_cache(self, seconds):
+        InstanceManager._cached_at = datetime.utcnow() - timedelta(seconds=seconds)
+
+    def test_hard_ttl(self):
+        with self._patch_connection():
+            first = InstanceManager.all()
+            self._age_cache(InstanceManager.HARD_TTL - 10)
+            self.assertTrue(InstanceManager.all() is first)
+            self._age_cache(InstanceManager.HARD_TTL + 10)
+            self.assertTrue(InstanceManager.is_cache_expired())
+            self.assertFalse(InstanceManager.all() is first)
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def test_stale_while_revalidate(self):
+        InstanceManager.SOFT_TTL = 60
+        with self._patch_connection():
+            first = InstanceManager.all()
+            self._age_cache(30)
+            self.assertFalse(InstanceManager.is_cache_stale())
+            self.assertTrue(InstanceManager.all() is first)
+
+            self._age_cache(90)
+            self.assertTrue(InstanceManager.is_cache_stale())
+            # The stale cache is served while it's refreshed in the background
+            self.assertTrue(InstanceManager.all() is first)
+            deadline = time.time() + 5
+            while InstanceManager._cache is first and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(InstanceManager.is_cache_stale())
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+
+class IncrementalRefreshTestCase(BaseTestCase):
+    def tearDown(self):
+        super(IncrementalRefreshTestCase, self).tearDown()
+        VPCManager.INCREMENTAL = False
+
+    def _fetch(self, *vpcs):
+        self.vpc_connection.get_all_vpcs.return_value = list(vpcs)
+
+    def test_refresh(self):
+        with self._patch_vpc_connection():
+            vpcs = VPCManager.all()
+            first, second = vpcs
+
+            changed = copy(first)
+            changed.state = 'deleting'
+            self._fetch(changed, copy(second), self.vpc_connection.create_vpc.return_value)
+
+            diff = VPCManager.refresh()
+            self.assertEquals(['vpc-xyz0'], [v.id for v in diff.added])
+            self.assertEquals([first], diff.changed)
+            self.assertEquals([], diff.removed)
+            self.assertTrue(diff is VPCManager.last_diff)
+            # Cached objects are updated in place, the list is replaced
+            self.assertEquals('deleting', first.state)
+            self.assertEquals([first, second], vpcs)
+            self.assertEquals(['vpc-abc0', 'vpc-abc1', 'vpc-xyz0'], [v.id for v in VPCManager.all()])
+            self.assertTrue(VPCManager._indexes.objects is VPCManager.all())
+
+            self._fetch(copy(second))
+            diff = VPCManager.refresh()
+            self.assertEquals(([], []), (diff.added, diff.changed))
+            self.assertEquals(['vpc-abc0', 'vpc-xyz0'], [v.id for v in diff.removed])
+            self.assertEquals([second], VPCManager.all())
+            self.assertEquals(second, VPCManager.get(id='vpc-abc1'))
+            self.assertRaises(VPCManager.DoesNotExist, VPCManager.get, id='vpc-abc0')
+
+    def test_refresh_copy_on_write(self):
+        with self._patch_vpc_connection():
+            vpcs = VPCManager.all()
+            indexes = VPCManager._indexes
+            self._fetch(copy(vpcs[1]))
+            VPCManager.refresh()
+            # Readers still holding the old list and its indexes agree
+            self.assertEquals(['vpc-abc0', 'vpc-abc1'], [v.id for v in vpcs])
+            self.assertEquals([vpcs[1]], compile_filter(id='vpc-abc1').filter(vpcs, indexes))
+            self.assertEquals(['vpc-abc1'], [v.id for v in VPCManager.filter(id='vpc-abc1')])
+
+    def test_refresh_cold(self):
+        with self._patch_vpc_connection():
+            diff = VPCManager.refresh()
+            self.assertEquals(2, len(diff.added))
+            self.assertEquals(diff.added, VPCManager.all())
+
+    def test_incremental_expiry(self):
+        VPCManager.INCREMENTAL = True
+        with self._patch_vpc_connection():
+            vpcs = VPCManager.all()
+            VPCManager._cached_at = datetime.utcnow() - timedelta(seconds=VPCManager.HARD_TTL + 1)
+            self.assertTrue(all(a is b for a, b in zip(VPCManager.all(), vpcs)))
+            self.assertEquals(Diff([], [], []), VPCManager.last_diff)
+
+
+class CacheBackendTestCase(BaseTestCase):
+    def setUp(self):
+        super(CacheBackendTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        InstanceManager.CACHE_BACKEND = FileBackend(self.directory)
+
+    def tearDown(self):
+        super(CacheBackendTestCase, self).tearDown()
+        InstanceManager.CACHE_BACKEND = None
+        InstanceManager.SOFT_TTL = None
+        shutil.rmtree(self.directory)
+
+    def test_snapshot(self):
+        with self._patch_connection():
+            self.assertEquals(4, len(InstanceManager.all()))
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+            self.assertTrue(os.path.exists(os.path.join(self.directory, 'InstanceManager-us-east-1-abc.cache')))
+
+            # A fresh process would start from the snapshot
+            InstanceManager._forget()
+            self.assertEquals(['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3'], [g.id for g in InstanceManager.all()])
+            self.assertEquals(1, self.connection.get_all_instances.call_count)
+
+            # Unless it's too old
+            InstanceManager._forget()
+            with patch('time.time', return_value=time.time() + InstanceManager.HARD_TTL + 1):
+                InstanceManager.all()
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def test_snapshot_age(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            InstanceManager._forget()
+            with patch('time.time', return_value=time.time() - 60):
+                InstanceManager.refresh()
+            InstanceManager._forget()
+            InstanceManager.all()
+            # The cache is only as fresh as the snapshot it was loaded from
+            self.assertTrue(InstanceManager._cached_at < datetime.utcnow() - timedelta(seconds=59))
+
+    def test_stale_snapshot(self):
+        InstanceManager.SOFT_TTL = 60
+        with self._patch_connection():
+            with patch('time.time', return_value=time.time() - 90):
+                InstanceManager.refresh()
+            InstanceManager._forget()
+            first = InstanceManager.all()
+            self.assertTrue(InstanceManager.is_cache_stale())
+            self.assertTrue(InstanceManager.all() is first)
+            # The background refresh goes to the API, not the same stale snapshot
+            deadline = time.time() + 5
+            while InstanceManager._cache is first and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(InstanceManager.is_cache_stale())
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+    def test_shared_backend(self):
+        InstanceManager.CACHE_BACKEND = KeyValueBackend(DictClient())
+        regional = InstanceManager.for_region('us-west-2')
+        with patch('ec2.models.managers.get_connection', return_value=self.connection):
+            InstanceManager.all()
+            regional.all()
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+            # Other workers pick up the shared snapshots
+            InstanceManager._forget()
+            regional._forget()
+            self.assertEquals(4, len(InstanceManager.all()))
+            self.assertEquals(4, len(regional.all()))
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+        regional.clear()
+
+    def test_clear(self):
+        InstanceManager.CACHE_BACKEND = MemoryBackend()
+        with self._patch_connection():
+            InstanceManager.all()
+            self.connection.get_all_instances.return_value = self.connection.get_all_instances.return_value[:1]
+            # The snapshot is known to be wrong too, so it goes as well
+            InstanceManager.clear()
+            self.assertEquals(['i-abc0', 'i-abc1'], [i.id for i in InstanceManager.all()])
+            self.assertEquals(2, self.connection.get_all_instances.call_count)
+
+
+class LiteTestCase(BaseTestCase):
+    def setUp(self):
+        super(LiteTestCase, self).setUp()
+        InstanceManager.LITE = True
+
+    def tearDown(self):
+        super(LiteTestCase, self).tearDown()
+        InstanceManager.LITE = False
+
+    def test_records(self):
+        with self._patch_connection():
+            instances = InstanceManager.all()
+            self.assertTrue(all(isinstance(i, Record) for i in instances))
+            self.assertEquals(['i-abc0', 'i-abc2'], [i.id for i in InstanceManager.filter(state='running')])
+            self.assertEquals('i-abc1', InstanceManager.get(name='instance-1').id)
+            self.assertEquals('i-abc3', InstanceManager.get(name__iexact='INSTANCE-3').id)
+
+            self.connection.get_only_instances.return_value = [Instance()]
+            instances[0].update
+            self.connection.get_only_instances.assert_called_once_with(instance_ids=['i-abc0'])
+            self.connection.get_only_instances.return_value = []
+            self.assertRaises(InstanceManager.DoesNotExist, getattr, instances[1], 'update')
+
+    def test_filter_not_loaded(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            # Filters never fetch full objects, one API call per record
+            self.assertRaises(NotLoaded, list, InstanceManager.filter(architecture='x86_64'))
+            self.assertRaises(NotLoaded, InstanceManager.get, architecture='x86_64')
+            self.assertFalse(self.connection.get_only_instances.called)
+            # Tags that aren't boto attributes are fine
+            self.assertEquals([], list(InstanceManager.filter(environment='production')))
+
+    def test_refresh(self):
+        with self._patch_connection():
+            first = InstanceManager.all()[0]
+            reservation = self.connection.get_all_instances.return_value[0]
+            original = list(reservation.instances)[0]
+            original._state = STOPPED_STATE
+            diff = InstanceManager.refresh()
+            # Records are updated in place too
+            self.assertEquals([first], diff.changed)
+            self.assertEquals('stopped', first.state)
+            self.assertTrue(first._manager is InstanceManager)
+
+    def test_refresh_unchanged(self):
+        original = list(self.connection.get_all_instances.return_value[0].instances)[0]
+        with self._patch_connection():
+            original.groups = [Group()]
+            original.groups[0].id = 'sg-abc0'
+            InstanceManager.all()
+            # Fetched again, as new boto objects
+            original.groups = [Group()]
+            original.groups[0].id = 'sg-abc0'
+            self.assertEquals([], InstanceManager.refresh().changed)
+
+
+class BulkTestCase(BaseTestCase):
+    def test_bulk_create(self):
+        def create_security_group(name, description, vpc_id=None, dry_run=False):
+            if name == 'bad':
+                raise ValueError(name)
+            return name
+        self.connection.create_security_group.side_effect = create_security_group
+        with self._patch_connection():
+            SecurityGroupManager.all()
+            results = SecurityGroupManager.bulk_create([('a', 'A'), {'name': 'bad', 'description': 'Bad'}, ('c', 'C')], max_workers=2)
+            self.assertEquals(['a', None, 'c'], [r.result for r in results])
+            self.assertTrue(isinstance(results[1].error, ValueError))
+            self.assertEquals({'name': 'bad', 'description': 'Bad'}, results[1].kwargs)
+            self.assertEquals(3, len(self.connection.create_security_group.call_args_list))
+            # The cache is refetched once, not after every call
+            SecurityGroupManager.all()
+            self.assertEquals(2, self.connection.get_all_security_groups.call_count)
+
+    def test_bulk_delete(self):
+        with self._patch_vpc_connection():
+            VPCManager.all()
+            results = VPCManager.bulk_delete(['vpc-abc0', 'vpc-abc1'])
+            self.assertEquals([('vpc-abc0',), ('vpc-abc1',)], [r.args for r in results])
+            self.assertEquals(2, len(self.vpc_connection.delete_vpc.call_args_list))
+            # Both are removed from the cache in one go
+            self.assertEquals([], VPCManager.all())
+            self.assertEquals(1, self.vpc_connection.get_all_vpcs.call_count)
+
+    def test_bulk_failed(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            results = InstanceManager.bulk_delete(['i-abc0'])
+            self.assertTrue(isinstance(results[0].error, NotImplementedError))
+            # Nothing changed, so the cache is kept
+            self.assertTrue(InstanceManager.is_cached())
+
+
+class WriteThroughTestCase(BaseTestCase):
+    def test_create(self):
+        with self._patch_vpc_connection():
+            vpcs = VPCManager.all()
+            vpc = VPCManager.create('10.10.10.0/16')
+            self.assertEquals(['vpc-abc0', 'vpc-abc1', 'vpc-xyz0'], [v.id for v in VPCManager.all()])
+            self.assertTrue(VPCManager.get(cidr_block='10.10.10.0/16') is vpc)
+            self.assertEquals(1, self.vpc_connection.get_all_vpcs.call_count)
+            # The list that was cached is left alone
+            self.assertEquals(2, len(vpcs))
+
+    def test_copy_on_write(self):
+        with self._patch_vpc_connection():
+            query = compile_filter(cidr_block='10.1.0.0/16')
+            objects, indexes = VPCManager._source(query)
+            VPCManager._write(removed=['vpc-abc0'])
+            # Readers still holding the old list and its indexes agree
+            self.assertEquals(['vpc-abc1'], [v.id for v in query.filter(objects, indexes)])
+            self.assertEquals(['vpc-abc1'], [v.id for v in VPCManager.filter(query)])
+
+    def test_snapshot(self):
+        VPCManager.CACHE_BACKEND = MemoryBackend()
+        for vpc in self.vpc_connection.get_all_vpcs.return_value:
+            # Mocks can't be pickled into a snapshot
+            del vpc.delete
+        try:
+            with self._patch_vpc_connection():
+                VPCManager.all()
+                VPCManager.delete('vpc-abc0')
+                cached_at = VPCManager._cached_at
+                # A fresh process starts from the snapshot written through
+                VPCManager._forget()
+                self.assertEquals(['vpc-abc1'], [v.id for v in VPCManager.all()])
+                self.assertEquals(cached_at, VPCManager._cached_at)
+                self.assertEquals(1, self.vpc_connection.get_all_vpcs.call_count)
+
+                # Nothing cached here, so the snapshot goes
+                VPCManager._forget()
+                VPCManager.create('10.10.10.0/16')
+                VPCManager.all()
+                self.assertEquals(2, self.vpc_connection.get_all_vpcs.call_count)
+        finally:
+            VPCManager.CACHE_BACKEND = None
+
+    def test_create_ambiguous(self):
+        self.vpc_connection.create_vpc.return_value = None
+        with self._patch_vpc_connection():
+            VPCManager.all()
+            VPCManager.create('10.10.10.0/16')
+            self.assertFalse(VPCManager.is_cached())
+
+    def test_delete(self):
+        with self._patch_vpc_connection():
+            VPCManager.all()
+            self.assertTrue(VPCManager.delete('vpc-abc0'))
+            self.assertEquals(['vpc-abc1'], [v.id for v in VPCManager.all()])
+            self.assertRaises(VPCManager.DoesNotExist, VPCManager.get, cidr_block='10.0.0.0/16')
+            self.assertEquals(1, self.vpc_connection.get_all_vpcs.call_count)
+
+            self.vpc_connection.delete_vpc.return_value = False
+            self.assertFalse(VPCManager.delete('vpc-abc1'))
+            self.assertFalse(VPCManager.is_cached())
+
+    def test_delete_by_name(self):
+        with self._patch_connection():
+            SecurityGroupManager.all()
+            SecurityGroupManager.delete(name='group-0')
+            self.assertEquals(['sg-abc1'], [g.id for g in SecurityGroupManager.all()])
+            SecurityGroupManager.delete(name='group-9')
+            self.assertFalse(SecurityGroupManager.is_cached())
+
+    def test_model_delete(self):
+        self.connection.delete_security_group.return_value = True
+        self.connection.region = RegionInfo(name='us-east-1')
+        with self._patch_connection():
+            group = SecurityGroup(connection=self.connection)
+            group.id, group.name = 'sg-abc0', 'group-0'
+            SecurityGroupManager.all()
+            self.assertTrue(group.delete())
+            self.assertEquals(['sg-abc1'], [g.id for g in SecurityGroupManager.all()])
+            self.assertEquals(1, self.connection.get_all_security_groups.call_count)
+
+    def test_model_delete_regional(self):
+        self.connection.delete_security_group.return_value = True
+        self.connection.region = RegionInfo(name='us-west-2')
+        regional = SecurityGroupManager.for_region('us-west-2')
+        with self._patch_connection():
+            group = SecurityGroup(connection=self.connection)
+            group.id, group.name = 'sg-abc0', 'group-0'
+            regional.all()
+            SecurityGroupManager.all()
+            self.assertTrue(group.delete())
+            self.assertEquals(['sg-abc1'], [g.id for g in regional.all()])
+            self.assertEquals(['sg-abc0', 'sg-abc1'], [g.id for g in SecurityGroupManager.all()])
+            self.connection.delete_security_group.return_value = False
+            self.assertFalse(group.delete())
+            self.assertFalse(regional.is_cached())
+            self.assertTrue(SecurityGroupManager.is_cached())
@@ -0,0 +1,250 @@
+from ..base import RUNNING_STATE, STOPPED_STATE
+from boto.ec2.instance import Instance
+from datetime import datetime, timedelta, tzinfo
+import unittest
+import re
+
+from ec2.models.indexes import IndexSet
+from ec2.models.query import MAX_FILTER_VALUES, Predicate, Q, Query, compile_filter
+
+
+class QueryTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance._state = RUNNING_STATE
+        self.instance.id = 'i-abc'
+        self.instance.tags = {'Name': 'Awesome'}
+
+        self.other = Instance()
+        self.other._state = STOPPED_STATE
+        self.other.id = 'i-xyz'
+        self.other.tags = {}
+
+    def test_bad_comparison(self):
+        self.assertRaises(AttributeError, Predicate, 'state__nope', 'running')
+
+    def test_predicate(self):
+        i = self.instance
+        self.assertTrue(Predicate('state', 'running')(i))
+        self.assertTrue(Predicate('state__iexact', 'RUNNING')(i))
+        self.assertTrue(Predicate('name__istartswith', 'awe')(i))
+        self.assertTrue(Predicate('name__iendswith', 'SOME')(i))
+        self.assertTrue(Predicate('name__icontains', 'WES')(i))
+        self.assertTrue(Predicate('name__like', r'^A.+e$')(i))
+        self.assertTrue(Predicate('name__ilike', re.compile(r'^a.+E$'))(i))
+        self.assertFalse(Predicate('name__startswith', 'awe')(i))
+        self.assertFalse(Predicate('lol', 'foo')(i))
+
+    def test_isnull(self):
+        i = self.instance
+        self.assertTrue(Predicate('foo__isnull', True)(i))
+        self.assertFalse(Predicate('foo__isnull', False)(i))
+        self.assertTrue(Predicate('id__isnull', False)(i))
+        self.assertFalse(Predicate('name__isnull', True)(i))
+
+    def test_query(self):
+        query = Query(state='running', name__startswith='Awe')
+        self.assertTrue(query(self.instance))
+        self.assertFalse(query(self.other))
+        self.assertEquals([self.instance], query.filter([self.instance, self.other]))
+        self.assertEquals([self.instance, self.other], Query().filter([self.instance, self.other]))
+
+    def test_compile_filter(self):
+        query = compile_filter(state='running')
+        self.assertTrue(query is compile_filter(state='running'))
+        self.assertTrue(query is compile_filter(query))
+
+        merged = compile_filter(query, id='i-xyz')
+        self.assertEquals({'state': 'running', 'id': 'i-xyz'}, merged.kwargs)
+        self.assertEquals([], merged.filter([self.instance, self.other]))
+
+        # Colliding filters must both match
+        self.assertEquals([], compile_filter(query, state='stopped').filter([self.instance, self.other]))
+        self.assertEquals([self.instance], compile_filter(query, state='running').filter([self.instance, self.other]))
+
+        self.assertRaises(TypeError, compile_filter, {'state': 'running'})
+
+    def test_pushdown(self):
+        mapping = {'state': 'instance-state-name', 'name': 'tag:Name', 'id': 'instance-id'}
+        query = Query(state='running', name__startswith='web*', id__iexact='I-ABC', image_id='ami-1')
+        self.assertEquals({'instance-state-name': 'running', 'tag:Name': 'web\\**'}, query.pushdown(mapping))
+
+        query = Query(name__contains='web', name__endswith='01')
+        self.assertEquals({'tag:Name': '*web*'}, query.pushdown(mapping))
+
+        self.assertEquals({}, Query(state__isnull=True, id=None).pushdown(mapping))
+
+        comparisons = {'name': ('exact',)}
+        self.assertEquals({'tag:Name': 'web'}, Query(name='web').pushdown(mapping, comparisons))
+        self.assertEquals({'instance-state-name': '*run*'}, Query(name__startswith='web', state__contains='run').pushdown(mapping, comparisons))
+
+    def test_iterate(self):
+        def objects():
+            yield self.instance
+            yield self.other
+            raise AssertionError('Iterated too far')
+
+        matches = Query(state__startswith='r').iterate(objects())
+        self.assertTrue(next(matches) is self.instance)
+
+
+class UTCPlusOne(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(hours=1)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class ComparisonTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance.id = 'i-abc'
+        self.instance.launch_time = '2014-03-01T12:30:00.000Z'
+        self.instance.ami_launch_index = 2
+        self.instance.tags = {'Size': '500'}
+
+    def test_in(self):
+        i = self.instance
+        self.assertTrue(Predicate('id__in', ['i-abc', 'i-xyz'])(i))
+        self.assertTrue(Predicate('id__in', (x for x in ['i-abc']))(i))
+        self.assertFalse(Predicate('id__in', [])(i))
+        self.assertTrue(Predicate('size__in', ['500'])(i))
+        self.assertFalse(Predicate('nope__in', [None])(i))
+        self.assertTrue(Predicate('id__in', [['unhashable'], 'i-abc'])(i))
+        self.assertRaises(TypeError, Predicate, 'id__in', 'i-abc')
+
+    def test_ordering(self):
+        i = self.instance
+        self.assertTrue(Predicate('ami_launch_index__gt', 1)(i))
+        self.assertFalse(Predicate('ami_launch_index__gt', 2)(i))
+        self.assertTrue(Predicate('ami_launch_index__gte', 2)(i))
+        self.assertTrue(Predicate('ami_launch_index__lt', 2.5)(i))
+        self.assertFalse(Predicate('ami_launch_index__lte', 1)(i))
+        self.assertTrue(Predicate('ami_launch_index__range', (2, 3))(i))
+        self.assertTrue(Predicate('id__gte', 'i-a')(i))
+        # Numeric tags are compared as numbers
+        self.assertTrue(Predicate('size__gte', 100)(i))
+        self.assertFalse(Predicate('size__gte', 1000)(i))
+        # Things that can't be compared don't match
+        self.assertFalse(Predicate('id__gt', 1)(i))
+        self.assertFalse(Predicate('nope__lt', 1)(i))
+        self.assertFalse(Predicate('private_ip_address__lt', '10.')(i))
+
+    def test_range(self):
+        i = self.instance
+        self.assertTrue(Predicate('size__range', (100, 500.0))(i))
+        self.assertFalse(Predicate('size__range', (1, 3))(i))
+        self.assertTrue(Predicate('id__range', ('i-a', 'i-b'))(i))
+        # Bounds of different kinds can't be compared consistently
+        self.assertRaises(TypeError, Predicate, 'size__range', (1, '3'))
+        self.assertRaises(TypeError, Query, launch_time__range=(datetime(2014, 3, 1), 3))
+
+    def test_dates(self):
+        i = self.instance
+        self.assertTrue(Predicate('launch_time__gt', datetime(2014, 3, 1, 12))(i))
+        self.assertFalse(Predicate('launch_time__gt', datetime(2014, 3, 1, 13))(i))
+        self.assertTrue(Predicate('launch_time__lt', datetime(2014, 3, 1, 14, tzinfo=UTCPlusOne()))(i))
+        self.assertFalse(Predicate('launch_time__lt', datetime(2014, 3, 1, 13, 30, tzinfo=UTCPlusOne()))(i))
+        self.assertTrue(Predicate('launch_time__range', (datetime(2014, 3, 1).date(), datetime(2014, 3, 2)))(i))
+        self.assertFalse(Predicate('size__gt', datetime(2014, 3, 1))(i))
+
+    def test_pushdown(self):
+        mapping = {'id': 'instance-id', 'state': 'instance-state-name'}
+        self.assertEquals({'instance-id': ['i-abc', 'i-x\\*']}, Query(id__in=['i-abc', 'i-x*']).pushdown(mapping))
+        self.assertEquals({}, Query(id__in=[], state__in=['running', None]).pushdown(mapping))
+        ids = ['i-%03d' % n for n in xrange(MAX_FILTER_VALUES + 1)]
+        self.assertEquals(MAX_FILTER_VALUES, len(Query(id__in=ids[1:]).pushdown(mapping)['instance-id']))
+        # More than EC2 takes are checked in Python instead
+        self.assertEquals({}, Query(id__in=ids).pushdown(mapping))
+        self.assertEquals({}, Query(id__gt='i-abc').pushdown(mapping))
+
+
+class QTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n, name in enumerate(('web-01', 'api-01', 'db-01', None)):
+            i = Instance()
+            i.id = 'i-abc%d' % n
+            i._state = n % 2 and STOPPED_STATE or RUNNING_STATE
+            i.tags = name and {'Name': name} or {}
+            self.instances.append(i)
+
+    def ids(self, *args, **kwargs):
+        return [i.id for i in Query(*args, **kwargs).filter(self.instances)]
+
+    def test_or(self):
+        self.assertEquals(['i-abc0', 'i-abc1'], self.ids(Q(name__startswith='web') | Q(name__startswith='api')))
+        self.assertEquals(['i-abc0', 'i-abc1'], self.ids(Q(name='web-01') | Q(state='stopped', name__endswith='01')))
+
+    def test_and(self):
+        self.assertEquals(['i-abc2'], self.ids(Q(state='running') & Q(name__endswith='01'), name__startswith='d'))
+        # Plain and-ed filters are treated like kwargs
+        query = Query(Q(state='running') & Q(name='db-01'))
+        self.assertEquals(['name', 'state'], sorted(p.field for p in query.predicates))
+        self.assertEquals((), query.expressions)
+
+    def test_not(self):
+        self.assertEquals(['i-abc1', 'i-abc2', 'i-abc3'], self.ids(~Q(name='web-01')))
+        self.assertEquals([], self.ids(~(Q(name__isnull=True) | Q(name__contains='-'))))
+        self.assertEquals(['i-abc3'], self.ids(~Q(name__contains='-'), ~Q(id='i-abc0')))
+
+    def test_empty(self):
+        self.assertEquals(4, len(self.ids(Q())))
+        self.assertEquals(['i-abc1'], self.ids(Q() | Q(name='api-01')))
+        self.assertRaises(TypeError, Q, {'name': 'web-01'})
+        self.assertRaises(TypeError, lambda: Q(name='web-01') | {'name': 'api-01'})
+
+    def test_short_circuit(self):
+        expression = Query(Q(name__like=r'^web') | Q(state='running')).expressions[0]
+        self.assertEquals(['state', 'name'], [p.field for p in expression.children])
+
+    def test_compile_filter(self):
+        q = Q(name='web-01') | Q(name='api-01')
+        query = compile_filter(q, state='running')
+        self.assertTrue(query is compile_filter(Q(name='web-01') | Q(name='api-01'), state='running'))
+        self.assertEquals(['i-abc0'], [i.id for i in compile_filter(query, id__startswith='i-').filter(self.instances)])
+        self.assertEquals(query.kwargs, {'state': 'running'})
+        self.assertEquals((q,), query.qs)
+
+    def test_indexes(self):
+        indexes = IndexSet(self.instances, ('name',))
+        queries = (
+            Query(Q(name='web-01') | Q(name__startswith='db')),
+            Query(Q(name='web-01') | Q(state='stopped')),
+            Query(~Q(name='web-01'), state='running'),
+        )
+        for query in queries:
+            self.assertEquals(query.filter(self.instances), query.filter(self.instances, indexes))
+        self.assertEquals([0, 2], queries[0].expressions[0].candidates(indexes))
+        self.assertEquals(None, queries[1].expressions[0].candidates(indexes))
+
+
+class PlanTests(unittest.TestCase):
+    def setUp(self):
+        self.instances = []
+        for n in xrange(1000):
+            i = Instance()
+            i.id = 'i-%04d' % n
+            i._state = n % 10 and STOPPED_STATE or RUNNING_STATE
+            i.tags = {'Name': 'web-%04d' % n}
+            self.instances.append(i)
+        self.indexes = IndexSet(self.instances, ('id',))
+
+    def test_selective_first(self):
+        query = Query(state='stopped', name__icontains='WEB-000', id__contains='-')
+        _, conjuncts, indexed, _ = query._plan(self.instances, self.indexes)
+        self.assertEquals(None, indexed)
+        self.assertEquals(['name__icontains', 'state', 'id__contains'], [c.key for c in conjuncts])
+        # Without statistics, the cheapest go first
+        _, conjuncts, _, _ = query._plan(self.instances, None)
+        self.assertEquals(['state', 'id__contains', 'name__icontains'], [c.key for c in conjuncts])
+
+    def test_explain(self):
+        query = Query(id='i-0010', state='running', name__endswith='0')
+        lines = query.explain(self.instances, self.indexes)
+        self.assertEquals("index: <Predicate: id='i-0010'> -> 1 of 1000 objects", lines[0])
+        self.assertEquals('scan: row by row, 1 objects', lines[1])
+        self.assertEquals(5, len(lines))
+        self.assertTrue('selectivity=' in lines[2])
+        self.assertEquals(query.filter(self.instances), query.filter(self.instances, self.indexes))
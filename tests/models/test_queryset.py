@@ -0,0 +1,106 @@
+from ..base import BaseTestCase
+
+from ec2.models import Q
+from ec2.models.managers import InstanceManager
+from ec2.models.queryset import QuerySet
+
+
+class QuerySetTestCase(BaseTestCase):
+    def ids(self, things):
+        return [i.id for i in things]
+
+    def test_lazy(self):
+        with self._patch_connection():
+            running = InstanceManager.filter(state='running')
+            self.assertTrue(isinstance(running, QuerySet))
+            self.assertFalse(self.connection.get_all_instances.called)
+            self.assertEquals(['i-abc0', 'i-abc2'], self.ids(running))
+            self.assertEquals(2, len(running))
+            self.assertTrue(running[0] is InstanceManager.get(id='i-abc0'))
+            self.assertEquals(running, InstanceManager.filter(state='running'))
+
+    def test_memoized(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            running = InstanceManager.filter(state='running')
+            first = list(running)
+            InstanceManager._cache.pop(0)
+            self.assertEquals(first, list(running))
+            self.assertEquals(['i-abc2'], self.ids(InstanceManager.filter(state='running')))
+            # Chaining narrows down the memoized results
+            self.assertEquals(['i-abc0'], self.ids(running.filter(name='instance-0')))
+            self.assertEquals(['i-abc2'], self.ids(running.exclude(name='instance-0')))
+            self.assertEquals(['i-abc2', 'i-abc0'], self.ids(running.order_by('-id').filter(id__startswith='i-')))
+            self.assertEquals('source: earlier results, 2 objects', running.filter(name='instance-0').explain().splitlines()[0])
+
+    def test_chaining(self):
+        with self._patch_connection():
+            running = InstanceManager.filter(state='running')
+            self.assertEquals(['i-abc2'], self.ids(running.filter(name='instance-2')))
+            # Filters on the same field are AND'ed together
+            self.assertEquals(['i-abc2'], self.ids(running.filter(id__startswith='i-').filter(id__endswith='2')))
+            self.assertEquals([], self.ids(running.filter(name='instance-0').filter(name='instance-2')))
+            self.assertEquals(['i-abc0'], self.ids(running.exclude(name='instance-2')))
+            self.assertEquals(['i-abc2'], self.ids(running.filter(id__in=(i for i in ['i-abc1', 'i-abc2']))))
+            self.assertEquals(['i-abc0', 'i-abc1', 'i-abc2'], self.ids(InstanceManager.exclude(id='i-abc3')))
+
+    def test_q(self):
+        with self._patch_connection():
+            either = Q(name='instance-0') | Q(name='instance-3')
+            self.assertEquals(['i-abc0', 'i-abc3'], self.ids(InstanceManager.filter(either)))
+            self.assertEquals(['i-abc0'], self.ids(InstanceManager.filter(either, state='running')))
+            self.assertEquals(['i-abc3'], self.ids(InstanceManager.filter(either).exclude(Q(state='running'))))
+            self.assertEquals(['i-abc1', 'i-abc2'], self.ids(InstanceManager.exclude(either)))
+            self.assertEquals('i-abc3', InstanceManager.get(either, ~Q(state='running')).id)
+
+    def test_explain(self):
+        with self._patch_connection():
+            explained = InstanceManager.filter(state='running').explain().splitlines()
+            self.assertEquals("source: API, filters {'instance-state-name': 'running'}, 4 objects", explained[0])
+            InstanceManager.all()
+            explained = InstanceManager.filter(id='i-abc0').exclude(state='stopped').order_by('id')[:1].explain().splitlines()
+            self.assertEquals([
+                'source: cache, 4 objects',
+                "filter: <Query: id='i-abc0'>",
+                "  index: <Predicate: id='i-abc0'> -> 1 of 4 objects",
+                '  scan: row by row, 1 objects',
+                "    1. <Predicate: id='i-abc0'> cost=1 selectivity=0.25 (index)",
+                "exclude: <Query: state='stopped'>",
+                'order by: id',
+                'slice: [:1]',
+            ], explained)
+
+    def test_order_by(self):
+        with self._patch_connection():
+            self.assertEquals(['i-abc3', 'i-abc2', 'i-abc1', 'i-abc0'], self.ids(InstanceManager.filter().order_by('-name')))
+            self.assertEquals(['i-abc1', 'i-abc3', 'i-abc0', 'i-abc2'], self.ids(InstanceManager.filter().order_by('-state', 'id')))
+
+    def test_slicing(self):
+        with self._patch_connection():
+            things = InstanceManager.filter(id__startswith='i-')
+            self.assertEquals(['i-abc1', 'i-abc2'], self.ids(things[1:3]))
+            self.assertEquals(['i-abc2'], self.ids(things[1:3][1:]))
+            self.assertEquals(['i-abc0', 'i-abc2'], self.ids(things[::2]))
+            self.assertEquals('i-abc3', things.order_by('-id')[0].id)
+            self.assertRaises(TypeError, InstanceManager.filter()[1:].filter, state='running')
+            self.assertRaises(ValueError, InstanceManager.filter().__getitem__, slice(-1, None))
+
+    def test_count_exists_first(self):
+        with self._patch_connection():
+            stopped = InstanceManager.filter(state='stopped')
+            self.assertEquals(2, stopped.count())
+            self.assertEquals(1, stopped[1:].count())
+            self.assertTrue(stopped.exists())
+            self.assertFalse(stopped.filter(name='instance-0').exists())
+            self.assertEquals('i-abc1', stopped.first().id)
+            self.assertEquals('i-abc3', stopped.order_by('-id').first().id)
+            self.assertEquals(None, stopped.filter(name='nope').first())
+
+    def test_values(self):
+        with self._patch_connection():
+            stopped = InstanceManager.filter(state='stopped')
+            self.assertEquals([{'id': 'i-abc1', 'name': 'instance-1'}, {'id': 'i-abc3', 'name': 'instance-3'}], stopped.values('id', 'name'))
+            self.assertEquals([('i-abc1', 'stopped'), ('i-abc3', 'stopped')], stopped.values_list('id', 'state'))
+            self.assertEquals(['i-abc1', 'i-abc3'], stopped.values_list('id', flat=True))
+            self.assertEquals([None, None], stopped.values_list('nope', flat=True))
+            self.assertRaises(TypeError, stopped.values_list, 'id', 'name', flat=True)
@@ -0,0 +1,66 @@
+from ..base import RUNNING_STATE
+from boto.ec2.instance import Instance
+from mock import MagicMock
+import pickle
+import unittest
+
+from ec2.models.records import NotLoaded, Record, attribute
+
+FIELDS = {'id': 0, 'state': 1, 'tags': 2}
+
+
+class RecordTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance.id = 'i-abc0'
+        self.instance._state = RUNNING_STATE
+        self.instance.tags = {'Name': 'instance-0'}
+
+    def test_from_object(self):
+        record = Record.from_object(self.instance, FIELDS, ('state',))
+        self.assertEquals('i-abc0', record.id)
+        self.assertEquals('running', record.state)
+        self.assertEquals({'Name': 'instance-0'}, record.tags)
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertRaises(AttributeError, getattr, record, 'ip_address')
+        self.assertRaises(AttributeError, setattr, record, 'ip_address', '1.2.3.4')
+
+    def test_interned(self):
+        other = Instance()
+        other.id = 'i-abc1'
+        other._state = RUNNING_STATE
+        other.tags = {''.join(['Na', 'me']): 'instance-1'}
+        a = Record.from_object(self.instance, FIELDS, ('state',))
+        b = Record.from_object(other, FIELDS, ('state',))
+        self.assertTrue(a.state is b.state)
+        self.assertTrue(list(a.tags)[0] is list(b.tags)[0])
+
+    def test_hydrate(self):
+        manager = MagicMock()
+        manager.MODEL = Instance
+        manager._hydrate.return_value = self.instance
+        record = Record.from_object(self.instance, FIELDS, manager=manager)
+        self.assertEquals('running', record.state)
+        self.assertFalse(manager._hydrate.called)
+        # Anything a boto Instance has loads the full object, once
+        self.assertEquals(None, record.ip_address)
+        self.assertTrue(record.hydrate() is self.instance)
+        manager._hydrate.assert_called_once_with('i-abc0')
+
+    def test_attribute(self):
+        manager = MagicMock()
+        manager.__name__ = 'InstanceManager'
+        manager.MODEL = Instance
+        record = Record.from_object(self.instance, FIELDS, manager=manager)
+        self.assertEquals('running', attribute(record, 'state'))
+        self.assertEquals(None, attribute(record, 'nope'))
+        self.assertRaises(NotLoaded, attribute, record, 'ip_address')
+        self.assertFalse(manager._hydrate.called)
+        self.assertEquals(None, attribute(self.instance, 'ip_address'))
+
+    def test_pickle(self):
+        record = Record.from_object(self.instance, FIELDS, manager=MagicMock())
+        loaded = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        self.assertEquals(record, loaded)
+        self.assertEquals(None, loaded._manager)
+        self.assertNotEquals(record, Record(FIELDS, ('i-abc1', 'running', {})))
@@ -0,0 +1,67 @@
+from ..base import BaseTestCase
+from copy import copy
+from mock import MagicMock, patch
+
+from ec2.models.managers import InstanceManager, VPCManager
+from ec2.models.records import Record
+
+
+class RegionTestCase(BaseTestCase):
+    def tearDown(self):
+        super(RegionTestCase, self).tearDown()
+        for manager in (InstanceManager, VPCManager):
+            for regional in manager.__dict__.get('_regional', {}).values():
+                regional.clear()
+
+    def test_for_region(self):
+        west = InstanceManager.for_region('us-west-2')
+        self.assertTrue(west is InstanceManager.for_region('us-west-2'))
+        self.assertTrue(issubclass(west, InstanceManager))
+        self.assertTrue(issubclass(west.DoesNotExist, InstanceManager.DoesNotExist))
+        self.assertEquals('us-west-2', west.REGION_NAME)
+        self.assertEquals(None, InstanceManager.REGION_NAME)
+
+        with self._patch_connection() as mock:
+            west.all()
+            mock.assert_called_once_with('us-west-2')
+            self.assertTrue(west.is_cached())
+            self.assertFalse(InstanceManager.is_cached())
+
+    def test_in_regions(self):
+        # A second region, with its own copies of the same instances
+        eu_connection = MagicMock()
+        eu_connection.get_all_instances = MagicMock(side_effect=lambda **kwargs: [
+            MagicMock(instances=[copy(i) for i in r.instances]) for r in self.connection.get_all_instances()])
+        connections = {'us-east-1': self.connection, 'eu-west-1': eu_connection}
+        with patch('ec2.models.managers.get_connection', side_effect=connections.get):
+            regions = InstanceManager.in_regions(['us-east-1', 'eu-west-1'])
+            instances = regions.filter(state='running')
+            self.assertEquals(['i-abc0', 'i-abc2'] * 2, [i.id for i in instances])
+
+            instances = regions.all()
+            self.assertEquals(8, len(instances))
+            self.assertEquals(['us-east-1'] * 4 + ['eu-west-1'] * 4, [i.region_name for i in instances])
+
+            self.assertRaises(InstanceManager.MultipleObjectsReturned, regions.get, id='i-abc0')
+            self.assertRaises(InstanceManager.DoesNotExist, regions.get, id='i-nope')
+
+    def test_in_one_region(self):
+        with self._patch_vpc_connection() as mock:
+            vpc = VPCManager.in_regions(['ap-south-1']).get(id='vpc-abc1')
+            self.assertEquals('ap-south-1', vpc.region_name)
+            mock.assert_called_once_with('ap-south-1')
+
+    def test_lite_records(self):
+        west = InstanceManager.for_region('us-west-2')
+        with self._patch_connection(), patch.object(west, 'LITE', True):
+            instances = InstanceManager.in_regions(['us-west-2']).all()
+            self.assertTrue(all(isinstance(i, Record) for i in instances))
+            self.assertEquals(['us-west-2'] * 4, [i.region_name for i in instances])
+
+    def test_parent_cache_not_shared(self):
+        with self._patch_connection() as mock:
+            InstanceManager.all()
+            west = InstanceManager.for_region('us-west-2')
+            self.assertFalse(west.is_cached())
+            west.all()
+            mock.assert_called_with('us-west-2')
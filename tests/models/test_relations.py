@@ -0,0 +1,101 @@
+from boto.ec2.group import Group
+from boto.ec2.instance import Reservation
+
+from ..base import BaseTestCase
+
+from ec2.models import Q, related
+from ec2.models.managers import InstanceManager, ReservationManager, SecurityGroupManager, VPCManager
+from ec2.models.records import NotLoaded
+
+
+class RelationsTestCase(BaseTestCase):
+    def setUp(self):
+        super(RelationsTestCase, self).setUp()
+        # Every instance in vpc-abc0 but the last one, which is in
+        # vpc-abc1, and in either or both security groups
+        instances = [i for r in self.connection.get_all_instances.return_value for i in r.instances]
+        sgs = self.connection.get_all_security_groups.return_value
+        for n, instance in enumerate(instances):
+            instance.vpc_id = 'vpc-abc%d' % (n == 3)
+            instance.groups = []
+            for sg in sgs[:n % 2 + 1]:
+                group = Group()
+                group.id, group.name = sg.id, sg.name
+                instance.groups.append(group)
+        for n, sg in enumerate(sgs):
+            sg.vpc_id = 'vpc-abc%d' % n
+
+    def ids(self, things):
+        return [i.id for i in things]
+
+    def test_filter(self):
+        with self._patch_connection(), self._patch_vpc_connection():
+            self.assertEquals(['i-abc3'], self.ids(InstanceManager.filter(vpc__cidr_block__startswith='10.1.')))
+            self.assertEquals(['i-abc1', 'i-abc3'], self.ids(InstanceManager.filter(groups__name='group-1')))
+            self.assertEquals(['i-abc0', 'i-abc1', 'i-abc2', 'i-abc3'], self.ids(InstanceManager.filter(groups__id='sg-abc0')))
+            self.assertEquals(['i-abc1'], self.ids(InstanceManager.filter(groups__name='group-1', vpc__state='available')))
+            self.assertEquals(['i-abc0', 'i-abc2'], self.ids(InstanceManager.exclude(groups__name='group-1')))
+            self.assertEquals(['i-abc0', 'i-abc3'], self.ids(InstanceManager.filter(Q(vpc__is_default=False) | Q(name='instance-0'))))
+            # Spanning more than one relation
+            self.assertEquals(['i-abc1', 'i-abc3'], self.ids(InstanceManager.filter(groups__vpc__cidr_block='10.1.0.0/16')))
+            self.assertEquals(['sg-abc1'], self.ids(SecurityGroupManager.filter(vpc__state='pending')))
+            self.assertEquals(['sg-abc0'], self.ids(SecurityGroupManager.filter(instances__name='instance-0')))
+            self.assertEquals(['vpc-abc1'], self.ids(VPCManager.filter(instances__state='stopped', instances__name='instance-3')))
+            self.assertEquals(['vpc-abc0'], self.ids(VPCManager.filter(security_groups__name='group-0')))
+
+    def test_filter_indexed(self):
+        with self._patch_connection(), self._patch_vpc_connection():
+            InstanceManager.all()
+            self.assertEquals(['i-abc3'], self.ids(InstanceManager.filter(vpc__cidr_block__startswith='10.1.')))
+            self.assertEquals(['i-abc1', 'i-abc3'], self.ids(InstanceManager.filter(groups__name='group-1')))
+            explained = InstanceManager.filter(groups__name='group-1').explain().splitlines()
+            self.assertEquals("  index: <Predicate: groups__name='group-1'> -> 2 of 4 objects", explained[2])
+            # Related objects that are missing don't match
+            self.assertEquals([], self.ids(InstanceManager.filter(vpc__cidr_block='10.9.0.0/16')))
+            self.assertEquals(1, len(self.vpc_connection.get_all_vpcs.call_args_list))
+
+    def test_related(self):
+        with self._patch_connection(), self._patch_vpc_connection():
+            instance = InstanceManager.get(id='i-abc1')
+            self.assertEquals('vpc-abc0', related(instance, 'vpc').id)
+            self.assertEquals(['sg-abc0', 'sg-abc1'], self.ids(related(instance, 'groups')))
+            self.assertTrue(related(instance, 'vpc') is VPCManager.get(id='vpc-abc0'))
+            self.assertEquals(['i-abc3'], self.ids(related(VPCManager.get(id='vpc-abc1'), 'instances')))
+            self.assertRaises(AttributeError, related, instance, 'subnet')
+            instance.vpc_id = None
+            self.assertEquals(None, related(instance, 'vpc'))
+
+            reservation = Reservation()
+            reservation.instances = [instance]
+            self.assertEquals(['i-abc1'], self.ids(related(reservation, 'instances')))
+
+    def test_prefetch_related(self):
+        with self._patch_connection(), self._patch_vpc_connection():
+            instances = InstanceManager.filter(state='running').prefetch_related('vpc', 'groups__vpc')
+            self.assertFalse(self.vpc_connection.get_all_vpcs.called)
+            self.assertEquals(['i-abc0', 'i-abc2'], self.ids(instances))
+            self.assertEquals(1, len(self.connection.get_all_security_groups.call_args_list))
+            self.assertEquals(1, len(self.vpc_connection.get_all_vpcs.call_args_list))
+            self.assertEquals(['vpc-abc0', 'vpc-abc0'], [related(i, 'vpc').id for i in instances])
+            self.assertEquals(1, len(self.vpc_connection.get_all_vpcs.call_args_list))
+            self.assertRaises(AttributeError, list, InstanceManager.filter().prefetch_related('subnet'))
+
+    def test_lite(self):
+        reservations = []
+        for n, mocked in enumerate(self.connection.get_all_instances.return_value):
+            reservation = Reservation()
+            reservation.id = 'r-abc%d' % n
+            reservation.instances = list(mocked.instances)
+            reservation.groups = reservation.instances[-1].groups
+            reservations.append(reservation)
+        self.connection.get_all_reservations.return_value = reservations
+        ReservationManager.LITE = True
+        try:
+            with self._patch_connection():
+                self.assertEquals(['r-abc0', 'r-abc1'], self.ids(ReservationManager.filter(groups__name='group-1')))
+                self.assertEquals(['r-abc0'], self.ids(ReservationManager.filter(groups__name='group-0', id='r-abc0')))
+                # Lite records don't hold their instances, and filters never fetch them one by one
+                self.assertRaises(NotLoaded, list, ReservationManager.filter(instances__state='running'))
+                self.assertFalse(self.connection.get_all_reservations.call_args_list[1:])
+        finally:
+            ReservationManager.LITE = False
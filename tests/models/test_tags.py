@@ -0,0 +1,65 @@
+from boto.ec2.instance import Instance
+from mock import MagicMock
+import unittest
+
+from ec2.models import models
+from ec2.models.helpers import snapshot
+from ec2.models.records import Record
+from ec2.models.tags import fold, fold_all, tag_value
+
+
+class TagTests(unittest.TestCase):
+    def setUp(self):
+        self.instance = Instance()
+        self.instance.id = 'i-abc0'
+        self.instance.tags = {'Name': 'web-01', 'Environment': 'prod'}
+
+    def test_fold(self):
+        self.assertEquals({'name': 'Name', 'environment': 'Environment'}, fold(self.instance.tags))
+
+    def test_tag_value(self):
+        self.assertEquals('web-01', tag_value(self.instance, 'name'))
+        self.assertEquals(None, tag_value(self.instance, 'Name'))
+        self.assertEquals('nope', tag_value(self.instance, 'owner', 'nope'))
+        self.assertEquals('nope', tag_value(Instance(), 'name', 'nope'))
+
+    def test_folded_once(self):
+        self.assertEquals(set(['name', 'environment']), fold_all([self.instance, Instance()]))
+        names = self.instance._tag_names[2]
+        tag_value(self.instance, 'name')
+        self.assertTrue(self.instance._tag_names[2] is names)
+
+    def test_changed_in_place(self):
+        tag_value(self.instance, 'name')
+        self.instance.tags['Name'] = 'web-02'
+        self.assertEquals('web-02', tag_value(self.instance, 'name'))
+        self.instance.tags['Owner'] = 'bob'
+        self.assertEquals('bob', tag_value(self.instance, 'owner'))
+        del self.instance.tags['Name']
+        self.instance.tags['NAME'] = 'web-03'
+        self.assertEquals('web-03', tag_value(self.instance, 'name'))
+        self.instance.tags = {'Role': 'db'}
+        self.assertEquals(None, tag_value(self.instance, 'name'))
+
+    def test_swapped_in_place(self):
+        # Same dict and number of tags
+        instance = models.Instance(MagicMock())
+        instance.id = 'i-abc0'
+        instance.add_tag('Name', 'web-01')
+        tag_value(instance, 'name')
+        instance.remove_tag('Name')
+        instance.add_tag('Owner', 'bob')
+        self.assertEquals('bob', tag_value(instance, 'owner'))
+        self.assertEquals(None, tag_value(instance, 'name'))
+
+    def test_snapshot(self):
+        other = Instance()
+        other.id = 'i-abc0'
+        other.tags = dict(self.instance.tags)
+        tag_value(self.instance, 'name')
+        self.assertEquals(snapshot(other), snapshot(self.instance))
+
+    def test_record(self):
+        record = Record.from_object(self.instance, {'id': 0, 'tags': 1})
+        self.assertEquals('prod', tag_value(record, 'environment'))
+        self.assertTrue(record._tag_names is not None)
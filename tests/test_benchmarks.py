@@ -0,0 +1,28 @@
+from .base import BaseTestCase
+import json
+
+from benchmarks import run
+from benchmarks.fleet import Fleet, StubConnection
+
+
+class BenchmarkTestCase(BaseTestCase):
+    def test_fleet(self):
+        fleet = Fleet(10)
+        self.assertEquals(10, len(fleet.instances))
+        self.assertEquals(5, len(fleet.reservations))
+        self.assertEquals([i.id for i in Fleet(10).instances], [i.id for i in fleet.instances])
+        connection = StubConnection(fleet)
+        page = connection.get_all_reservations(max_results=6)
+        self.assertEquals(3, len(page))
+        self.assertEquals('3', page.next_token)
+        page = connection.get_all_reservations(max_results=6, next_token=page.next_token)
+        self.assertEquals(2, len(page))
+        self.assertEquals(None, page.next_token)
+
+    def test_smoke(self):
+        results = run.run(sizes=[20], min_time=0, threads=2)
+        json.dumps(results)
+        names = [r['name'] for r in results['results']]
+        self.assertTrue('warm.filter.like' in names)
+        self.assertTrue('concurrent.cold.all' in names)
+        self.assertTrue(all(r['size'] == 20 and r['runs'] >= 1 for r in results['results']))
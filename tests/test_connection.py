@@ -1,5 +1,6 @@
 from .base import BaseTestCase
-from mock import patch
+from mock import MagicMock, patch
+from threading import Event, Thread
 
 import ec2
 
@@ -14,6 +15,17 @@ class ConnectionTestCase(BaseTestCase):
             ec2.connection.get_vpc_connection()
             mock.assert_called_once_with(aws_access_key_id='abc', aws_secret_access_key='xyz', region_name='us-east-1')
 
+    def test_connect_per_region(self):
+        with patch('boto.ec2.connect_to_region', side_effect=lambda **kwargs: kwargs['region_name']) as mock:
+            self.assertEquals('us-east-1', ec2.connection.get_connection())
+            self.assertEquals('us-west-2', ec2.connection.get_connection('us-west-2'))
+            self.assertEquals('us-west-2', ec2.connection.get_connection('us-west-2'))
+            self.assertEquals('us-east-1', ec2.connection.get_connection('us-east-1'))
+            self.assertEquals(2, mock.call_count)
+
+            ec2.credentials.REGION_NAME = 'eu-west-1'
+            self.assertEquals('eu-west-1', ec2.connection.get_connection())
+
 
 class CredentialsTestCase(BaseTestCase):
     def test_credentials(self):
@@ -29,3 +41,75 @@ class CredentialsTestCase(BaseTestCase):
     def test_from_file(self):
         ec2.credentials.from_file('tests/credentials.csv')
         self.assertEquals(dict(**ec2.credentials()), {'aws_access_key_id': 'foo', 'aws_secret_access_key': 'bar', 'region_name': 'us-east-1'})
+
+
+class ConnectionPoolTestCase(BaseTestCase):
+    def _in_thread(self, func):
+        results = []
+        thread = Thread(target=lambda: results.append(func()))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def test_per_thread(self):
+        pool = ec2.connection.ConnectionPool()
+        connect = MagicMock(side_effect=lambda: MagicMock())
+        main = pool.get('key', connect)
+        self.assertTrue(pool.get('key', connect) is main)
+        other = self._in_thread(lambda: pool.get('key', connect))
+        self.assertFalse(other is main)
+        self.assertEquals(2, pool.size('key'))
+        # The exited thread's connection is handed to the next thread
+        self.assertTrue(self._in_thread(lambda: pool.get('key', connect)) is other)
+        self.assertEquals(2, connect.call_count)
+
+    def test_max_size(self):
+        pool = ec2.connection.ConnectionPool(max_size=1)
+        connect = MagicMock(side_effect=lambda: MagicMock())
+        release = Event()
+        main = pool.get('key', connect)
+
+        def hold():
+            conn = pool.get('key', connect)
+            release.wait(5)
+            return conn
+        results = []
+        thread = Thread(target=lambda: results.append(hold()))
+        thread.start()
+        release.set()
+        thread.join()
+        self.assertTrue(results[0] is main)
+        self.assertEquals(1, connect.call_count)
+
+    def test_idle(self):
+        pool = ec2.connection.ConnectionPool(max_idle=60)
+        connect = MagicMock(side_effect=lambda: MagicMock())
+        with patch('time.time', return_value=1000):
+            conn = self._in_thread(lambda: pool.get('key', connect))
+        with patch('time.time', return_value=1100):
+            self.assertFalse(pool.get('key', connect) is conn)
+        conn.close.assert_called_once_with()
+        self.assertEquals(1, pool.size('key'))
+
+    def test_clear(self):
+        pool = ec2.connection.ConnectionPool()
+        conn = pool.get('key', MagicMock)
+        pool.clear()
+        conn.close.assert_called_once_with()
+        self.assertEquals(0, pool.size('key'))
+
+    def test_credentials_key(self):
+        with patch('boto.ec2.connect_to_region', side_effect=lambda **kwargs: MagicMock()):
+            first = ec2.connection.get_connection()
+            ec2.credentials.ACCESS_KEY_ID = 'def'
+            self.assertFalse(ec2.connection.get_connection() is first)
+
+    def test_patch_boto_once(self):
+        import boto.ec2.connection
+        ec2.connection.patch_boto()
+        boto.ec2.connection.Instance = Thread
+        ec2.connection.patch_boto()
+        self.assertTrue(boto.ec2.connection.Instance is Thread)
+        ec2.connection._patched = False
+        ec2.connection.patch_boto()
+        self.assertTrue(boto.ec2.connection.Instance is ec2.Instance)
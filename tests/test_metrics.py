@@ -0,0 +1,94 @@
+from .base import BaseTestCase
+from mock import MagicMock, patch
+import unittest
+
+from ec2 import metrics
+from ec2.metrics import PrometheusExporter, StatsdExporter
+from ec2.models.managers import InstanceManager
+
+
+class MetricsTests(unittest.TestCase):
+    def tearDown(self):
+        del metrics.hooks[:]
+
+    def test_disabled(self):
+        with patch('time.time') as now:
+            self.assertEquals(None, metrics.start())
+            metrics.stop(None, 'nothing')
+            metrics.incr('nothing')
+        self.assertFalse(now.called)
+
+    def test_hooks(self):
+        hook = MagicMock()
+        metrics.add_hook(hook)
+        metrics.add_hook(hook)
+        metrics.incr('api.calls', action='get_all_vpcs')
+        hook.assert_called_once_with('count', 'api.calls', 1, {'action': 'get_all_vpcs'})
+        with patch('time.time', side_effect=[10.0, 10.5]):
+            metrics.stop(metrics.start(), 'api.time')
+        hook.assert_called_with('timing', 'api.time', 0.5, {})
+        metrics.remove_hook(hook)
+        metrics.remove_hook(hook)
+        metrics.incr('api.calls')
+        self.assertEquals(2, hook.call_count)
+
+    def test_statsd(self):
+        exporter = StatsdExporter(prefix='ec2.')
+        self.assertEquals(
+            'ec2.api.calls.get_all_vpcs.VPCManager:1|c',
+            exporter.format('count', 'api.calls', 1, {'manager': 'VPCManager', 'action': 'get_all_vpcs'}))
+        self.assertEquals('ec2.cache.refresh:250|ms', exporter.format('timing', 'cache.refresh', 0.25, {}))
+        exporter.socket = MagicMock()
+        exporter('count', 'cache.hits', 1, {})
+        exporter.socket.sendto.assert_called_once_with('ec2.cache.hits:1|c', ('localhost', 8125))
+
+    def test_prometheus(self):
+        exporter = PrometheusExporter()
+        exporter('count', 'api.calls', 1, {'manager': 'VPCManager'})
+        exporter('count', 'api.calls', 1, {'manager': 'VPCManager'})
+        exporter('timing', 'cache.refresh', 0.5, {})
+        exporter('timing', 'cache.refresh', 0.25, {})
+        self.assertEquals('\n'.join([
+            '# TYPE ec2_api_calls_total counter',
+            'ec2_api_calls_total{manager="VPCManager"} 2',
+            '# TYPE ec2_cache_refresh_seconds summary',
+            'ec2_cache_refresh_seconds_count 2',
+            'ec2_cache_refresh_seconds_sum 0.75',
+        ]) + '\n', exporter.render())
+
+
+class ManagerMetricsTestCase(BaseTestCase):
+    def setUp(self):
+        super(ManagerMetricsTestCase, self).setUp()
+        self.exporter = PrometheusExporter()
+        metrics.add_hook(self.exporter)
+
+    def tearDown(self):
+        super(ManagerMetricsTestCase, self).tearDown()
+        metrics.remove_hook(self.exporter)
+
+    def test_manager(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            InstanceManager.all()
+            len(InstanceManager.filter(name__endswith='1'))
+        text = self.exporter.render()
+        self.assertTrue('ec2_api_calls_total{action="get_all_instances",manager="InstanceManager"} 1\n' in text)
+        self.assertTrue('ec2_api_time_seconds_count{action="get_all_instances",manager="InstanceManager"} 1\n' in text)
+        self.assertTrue('ec2_cache_misses_total{manager="InstanceManager"} 1\n' in text)
+        self.assertTrue('ec2_cache_hits_total{manager="InstanceManager"} 2\n' in text)
+        self.assertTrue('ec2_cache_refresh_seconds_count{manager="InstanceManager"} 1\n' in text)
+        self.assertTrue('ec2_filter_scanned_total{manager="InstanceManager"} 4\n' in text)
+        self.assertTrue('ec2_filter_matched_total{manager="InstanceManager"} 1\n' in text)
+
+    def test_filter(self):
+        with self._patch_connection():
+            InstanceManager.all()
+            # Only the candidates an index narrowed down to are scanned
+            len(InstanceManager.filter(id='i-abc1', name__endswith='1'))
+            InstanceManager.get(name='instance-2')
+            list(InstanceManager.iter_filter(name__endswith='3'))
+        text = self.exporter.render()
+        self.assertTrue('ec2_filter_time_seconds_count{manager="InstanceManager"} 3\n' in text)
+        self.assertTrue('ec2_filter_scanned_total{manager="InstanceManager"} 6\n' in text)
+        self.assertTrue('ec2_filter_matched_total{manager="InstanceManager"} 3\n' in text)
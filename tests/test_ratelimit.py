@@ -0,0 +1,111 @@
+from .base import BaseTestCase
+from boto.exception import EC2ResponseError
+from mock import patch
+import time
+import unittest
+
+from ec2 import ratelimit
+from ec2.models.managers import InstanceManager
+from ec2.ratelimit import RateLimiter, TokenBucket
+
+
+def throttled():
+    error = EC2ResponseError(503, 'Service Unavailable')
+    error.error_code = 'RequestLimitExceeded'
+    return error
+
+
+class ThrottlingConnection(object):
+    "Stub connection that throttles the first `failures` calls"
+
+    def __init__(self, failures, result=()):
+        self.failures = failures
+        self.result = result
+        self.calls = 0
+
+    def get_all_instances(self, filters=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise throttled()
+        return self.result
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst(self):
+        with patch('time.sleep') as sleep:
+            bucket = TokenBucket(10, 2)
+            bucket.acquire()
+            bucket.acquire()
+            self.assertFalse(sleep.called)
+            bucket.acquire()
+            self.assertAlmostEqual(0.1, sleep.call_args[0][0], places=2)
+
+    def test_adaptive(self):
+        bucket = TokenBucket(10, 2)
+        bucket.throttled()
+        self.assertEquals(5, bucket.rate)
+        for _ in xrange(20):
+            bucket.throttled()
+        self.assertEquals(1, bucket.rate)
+        bucket.succeeded()
+        self.assertEquals(2, bucket.rate)
+        for _ in xrange(20):
+            bucket.succeeded()
+        self.assertEquals(10, bucket.rate)
+
+    def test_clock_skew(self):
+        bucket = TokenBucket(10, 2)
+        with patch('time.time', return_value=time.time() - 60):
+            with patch('time.sleep') as sleep:
+                bucket.acquire()
+                self.assertFalse(sleep.called)
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_budgets(self):
+        limiter = RateLimiter(budgets={'create_vpc': (1.0, 2)})
+        self.assertEquals(1, limiter.bucket(('abc', 'us-east-1', 'create_vpc')).rate)
+        self.assertEquals(ratelimit.RATE, limiter.bucket(('abc', 'us-east-1', 'get_all_vpcs')).rate)
+        self.assertTrue(limiter.bucket(('abc', 'us-east-1', 'get_all_vpcs')) is limiter.bucket(('abc', 'us-east-1', 'get_all_vpcs')))
+        self.assertFalse(limiter.bucket(('abc', 'us-east-1', 'get_all_vpcs')) is limiter.bucket(('abc', 'us-west-2', 'get_all_vpcs')))
+
+    def test_retry(self):
+        connection = ThrottlingConnection(2, ['ok'])
+        limiter = RateLimiter()
+        with patch('time.sleep') as sleep:
+            self.assertEquals(['ok'], limiter.call(('abc', 'us-east-1', 'get_all_instances'), connection.get_all_instances))
+        self.assertEquals(3, connection.calls)
+        # Backing off twice, and each retry waits for a token too, since
+        # being throttled empties the bucket
+        self.assertEquals(4, sleep.call_count)
+        # Halved twice, then sped up by the successful call
+        self.assertEquals(3.5, limiter.bucket(('abc', 'us-east-1', 'get_all_instances')).rate)
+
+    def test_give_up(self):
+        connection = ThrottlingConnection(10)
+        limiter = RateLimiter(max_retries=3)
+        with patch('time.sleep'):
+            self.assertRaises(EC2ResponseError, limiter.call, ('abc', 'us-east-1', 'get_all_instances'), connection.get_all_instances)
+        self.assertEquals(4, connection.calls)
+
+    def test_other_errors(self):
+        def fail():
+            raise ValueError
+        with patch('time.sleep') as sleep:
+            self.assertRaises(ValueError, RateLimiter().call, ('abc', 'us-east-1', 'fail'), fail)
+        self.assertFalse(sleep.called)
+
+    def test_backoff(self):
+        with patch('random.uniform', side_effect=lambda a, b: b):
+            self.assertEquals([0.5, 1, 2, 4, 8, 16, 20], [ratelimit.backoff(n) for n in xrange(7)])
+
+
+class ManagerRateLimitTestCase(BaseTestCase):
+    def test_throttled_manager(self):
+        connection = ThrottlingConnection(1, self.connection.get_all_instances())
+        with patch('ec2.models.managers.get_connection', return_value=connection):
+            with patch('time.sleep'):
+                self.assertEquals(4, len(InstanceManager.all()))
+        self.assertEquals(2, connection.calls)
+        bucket = ratelimit.limiter.bucket(('abc', 'us-east-1', 'get_all_instances'))
+        self.assertTrue(bucket.rate < bucket.max_rate)